@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Headless CARE_One batch processing.
+
+Analyses every hour file of a tree of patient directories and saves the
+results in the database used by the CARE_One application:
+
+    python batch.py <root> [--db CARE_One_data.sqlite] [--workers N]
+
+The root holds P<id>/<date>/patient_<id>_<date>_<hour>.txt files. Hours
+already in the database are skipped unless --force is given. No display
+is needed.
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import multiprocessing
+import argparse
+import logging
+import time
+import sys
+import os
+
+#==============================================================================
+# Set Environment variables
+#==============================================================================
+os.environ["KERAS_BACKEND"] = "tensorflow"
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+from PyQt5.QtCore import QCoreApplication
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from core.engine import AnalysisEngine
+from core.storage import SqliteStorage
+from models.query import createTable
+from utils.data_base import connections
+from utils import trace
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+
+
+def find_days(root):
+    """Hour files under root, grouped by patient-day
+
+    Args:
+        root (str): root directory of P<id>/<date> folders
+
+    Returns:
+        days (dict): {(p_no, date): {hour: path}}, sorted by patient and date
+    """
+    days = {}
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        dirnames.sort()
+        for f in sorted(filenames):
+            path = os.path.join(dirpath, f)
+            if not (f.startswith('patient') and f.endswith('.txt')) or os.path.getsize(path) == 0:
+                continue
+            try:
+                _, p_no, date, hour = f.replace('.txt','').split('_')
+            except ValueError:
+                logger.warning(f'Skipping file with unexpected name: {path}')
+                continue
+            days.setdefault((p_no, date), {})[hour] = path
+    return dict(sorted(days.items()))
+
+def run_batch(root, db_name, workers, force=False):
+    """Analyse and save every hour file under root
+
+    Args:
+        root (str): root directory of P<id>/<date> folders
+        db_name (str): SQLite database file
+        workers (int): number of processes for the mechanics
+        force (bool): analyse hours already saved in the database again
+
+    Returns:
+        stats (dict): hours, breaths, failed days and seconds taken
+    """
+    connections.db_name = db_name
+    db = connections.connection()
+    if not db.isOpen():
+        raise RuntimeError(f'Unable to open database {db_name}: {db.lastError().text()}')
+    createTable(db)
+    db = None
+
+    days = find_days(root)
+    logger.info(f'Found {sum(len(h) for h in days.values())} hour files in {len(days)} patient-days')
+
+    stats = {'hours': 0, 'breaths': 0, 'failed': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    storage = SqliteStorage()
+    engine = AnalysisEngine(storage, workers=workers)
+    try:
+        with trace.run('batch'):
+            for (p_no, date), files in days.items():
+                hours = sorted(files)
+                if not force:
+                    saved = storage.saved_hours(p_no, date)
+                    hours = [h for h in hours if h not in saved]
+                if not hours:
+                    logger.info(f'{p_no} {date}: all hours already saved')
+                    continue
+
+                day_start = time.perf_counter()
+                try:
+                    with trace.span('day', p_no=p_no, date=date):
+                        results = engine.analyse([files[h] for h in hours])
+                except Exception:
+                    logger.exception(f'{p_no} {date}: analysis failed')
+                    stats['failed'] += 1
+                    continue
+                with trace.span('save', hours=len(results)):
+                    ok = engine.save_hours(results)
+                if not ok:
+                    logger.error(f'{p_no} {date}: results could not all be saved')
+                    stats['failed'] += 1
+                    continue
+
+                breaths = sum(r.b_count for r in results)
+                stats['hours'] += len(results)
+                stats['breaths'] += breaths
+                logger.info(f'{p_no} {date}: {len(results)} hours, {breaths} breaths in {time.perf_counter() - day_start:.1f} s')
+    finally:
+        engine.close()
+        stats['seconds'] = time.perf_counter() - start
+        storage.close()
+    return stats
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Analyse CARE_One hour files without the user interface.')
+    parser.add_argument('root', help='root directory of P<id>/<date>/patient_*.txt files')
+    parser.add_argument('--db', default='CARE_One_data.sqlite', help='SQLite database file (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes used for respiratory mechanics (default: %(default)s)')
+    parser.add_argument('--force', action='store_true', help='analyse hours already saved in the database again')
+    parser.add_argument('--log-level', default='INFO', help='logging level (default: %(default)s)')
+    parser.add_argument('--trace', nargs='?', const=trace.DEFAULT_DIR, metavar='DIR',
+                        help='write a Chrome trace of the run to DIR (default: %(const)s) and log its summary')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.trace:
+        trace.configure(True, args.trace)
+
+    # Qt SQL drivers need a core application, which needs no display
+    app = QCoreApplication(sys.argv[:1])
+    stats = run_batch(args.root, args.db, max(args.workers, 1), args.force)
+
+    minutes = stats['seconds']/60
+    print(f"Processed {stats['hours']} hours ({stats['breaths']} breaths) in {stats['seconds']:.1f} s")
+    if stats['seconds'] > 0:
+        print(f"Throughput: {stats['hours']/minutes:.1f} hours/min, {stats['breaths']/stats['seconds']:.0f} breaths/s")
+    if stats['failed']:
+        print(f"Failed patient-days: {stats['failed']}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    # Needed by the worker processes of a frozen build
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""CARE_One benchmark suite.
+
+Times each stage of the analysis pipeline on the example patient-day and
+compares with a saved baseline:
+
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json
+
+Exit status:
+
+    0  no stage regressed
+    1  a stage is slower than the baseline by more than --threshold
+    2  the baseline is of another data set (data, hours or breaths
+       differ) and is not compared
+
+Timings of different data are not comparable, so a stale baseline must
+neither pass as 0 nor be reported as a regression.
+
+--synthetic N runs on N generated hours instead (see generate.py).
+Each stage is run --repeat times and its median time is reported, with
+breaths/s and the peak memory allocated by the stage (from one extra
+traced run). Classification and reconstruction are skipped when keras
+is not installed. Runs single process, on the CPU, with no display.
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+from datetime import date
+import statistics
+import tracemalloc
+import tempfile
+import platform
+import argparse
+import logging
+import glob
+import json
+import time
+import sys
+import os
+
+#==============================================================================
+# Set Environment variables
+#==============================================================================
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+os.environ["KERAS_BACKEND"] = "tensorflow"
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+from PyQt5.QtCore import QCoreApplication
+import numpy as np
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from core.results import HourResult, DaySummary
+from core.storage import SqliteStorage
+from models.query import createTable
+from threads.HourlyView import build_plot_data
+from utils.calculations import Elastance, respiratory_mechanics
+from utils.data_base import connections
+from utils.decimate import minmax_indices
+from utils.preprocessing import to_ragged, head_ragged, norma_resample_batch
+from utils.synthetic import WaveformConfig, write_patient
+import utils.AI as AI
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_DATA = os.path.join(base_path, '..', 'examples', 'P0001', '2021-01-01')
+
+# Stages not run once per breath, reported without breaths/s
+NOT_PER_BREATH = {'model_load'}
+
+# Slowdowns shorter than this are timing noise, not regressions
+MIN_REGRESSION_S = 0.01
+
+# Report keys of the data set, which a baseline must share to be compared
+COMPARED_KEYS = ('data', 'hours', 'breaths')
+
+
+def keras_available():
+    try:
+        import keras.models
+        return True
+    except ImportError:
+        return False
+
+def stage_parse(ctx):
+    for path in ctx['paths']:
+        Elastance().parseHourFile(path)
+
+def stage_mechanics(ctx):
+    ctx['hours'] = [HourResult.from_dict(respiratory_mechanics(path)) for path in ctx['paths']]
+
+def stage_preprocessing(ctx):
+    pressure = [p for r in ctx['hours'] for p in r.pressure if len(p) != 0]
+    flow = [q for r in ctx['hours'] for q, p in zip(r.flow, r.pressure) if len(p) != 0]
+    norma_resample_batch(*to_ragged(pressure), 150)
+    flow, offsets = to_ragged(flow)
+    pressure, _ = to_ragged(pressure)
+    inspi_len = Elastance().inspi_len_batch(flow, offsets)
+    norma_resample_batch(*head_ragged(pressure, offsets, inspi_len), 64)
+
+def stage_model_load(ctx):
+    AI.registry.clear()
+    ctx['classi_model'] = AI.get_current_model()[1]
+    ctx['recon_model'] = AI.load_Recon_Model()
+
+def stage_classification(ctx):
+    pressure = [p for r in ctx['hours'] for p in r.pressure]
+    b_type = AI.AIpredict_batch(pressure, ctx['classi_model'])
+    start = 0
+    for r in ctx['hours']:
+        r.b_type = b_type[start:start+len(r.pressure)]
+        start += len(r.pressure)
+
+def stage_reconstruction(ctx):
+    for r in ctx['hours']:
+        r.AImag = AI.recon_batch(r.flow, r.pressure, ctx['recon_model'])
+
+def stage_db_save(ctx):
+    if not ctx['storage'].save_hours(ctx['hours']):
+        raise RuntimeError('DB save failed')
+
+def stage_db_fetch(ctx):
+    r = ctx['hours'][0]
+    hours = [h.hour for h in ctx['hours']]
+    ctx['fetched'], missing = ctx['storage'].fetch_day(r.p_no, r.date, hours)
+    for hour in hours:
+        ctx['storage'].fetch_hour(r.p_no, r.date, hour)
+    if missing:
+        raise RuntimeError(f'Hours missing from DB: {sorted(missing)}')
+
+def stage_aggregation(ctx):
+    DaySummary.from_hours(sorted(ctx['fetched'], key=lambda r: r.hour))
+
+def stage_plot_data(ctx):
+    for r in ctx['hours']:
+        data = build_plot_data(r.hour, r.P, r.Q, r.Ers, r.PEEP, r.b_len)
+        for y in (data['P'], data['Q'], data['Ers'], data['PEEP']):
+            minmax_indices(y, 0, len(y), 1000)
+
+# Stages in pipeline order: (name, function, needs keras)
+STAGES = [
+    ('parse', stage_parse, False),
+    ('mechanics', stage_mechanics, False),
+    ('preprocessing', stage_preprocessing, False),
+    ('model_load', stage_model_load, True),
+    ('classification', stage_classification, True),
+    ('reconstruction', stage_reconstruction, True),
+    ('db_save', stage_db_save, False),
+    ('db_fetch', stage_db_fetch, False),
+    ('aggregation', stage_aggregation, False),
+    ('plot_data', stage_plot_data, False),
+]
+
+def run_benchmark(data_dir, repeat=3, n_hours=None):
+    """Run every stage repeat times, then once more with memory tracing
+
+    Args:
+        data_dir (str): directory of hour files
+        repeat (int): timed runs of each stage
+        n_hours (int): use the first n_hours files only, all when None
+
+    Returns:
+        report (dict): environment, data size and per-stage results
+    """
+    paths = sorted(glob.glob(os.path.join(data_dir, 'patient_*.txt')))[:n_hours]
+    if not paths:
+        raise RuntimeError(f'No hour files in {data_dir}')
+    has_keras = keras_available()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        connections.db_name = os.path.join(tmp, 'benchmark.sqlite')
+        createTable(connections.connection())
+        ctx = {'paths': paths, 'storage': SqliteStorage()}
+        stages = {}
+        try:
+            for name, func, needs_keras in STAGES:
+                if needs_keras and not has_keras:
+                    stages[name] = {'skipped': 'keras not installed'}
+                    for r in ctx['hours']:
+                        r.b_type, r.AImag = [np.nan]*r.b_count, [np.nan]*r.b_count
+                    continue
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    func(ctx)
+                    times.append(time.perf_counter() - start)
+                tracemalloc.start()
+                func(ctx)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                stages[name] = {'median_s': statistics.median(times), 'min_s': min(times), 'peak_mb': peak/2**20}
+                logger.info(f'{name}: {stages[name]["median_s"]:.3f} s')
+            breaths = sum(r.b_count for r in ctx['hours'])
+        finally:
+            ctx = None
+            connections.release()
+
+    # mechanics parses the files too, report its own share
+    if 'median_s' in stages['mechanics']:
+        for key in ('median_s', 'min_s'):
+            stages['mechanics'][key] = max(stages['mechanics'][key] - stages['parse'][key], 0.0)
+        stages['mechanics']['excludes'] = 'parse'
+
+    for name, result in stages.items():
+        if 'median_s' in result and result['median_s'] > 0 and name not in NOT_PER_BREATH:
+            result['breaths_per_s'] = breaths/result['median_s']
+
+    try:
+        import resource
+        max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+    except ImportError:
+        max_rss_mb = None
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'data': os.path.relpath(data_dir, base_path),
+        'hours': len(paths),
+        'breaths': breaths,
+        'repeat': repeat,
+        'max_rss_mb': max_rss_mb,
+        'stages': stages,
+    }
+
+def baseline_mismatch(report, baseline):
+    """Differences of data set between a report and its baseline, whose
+    stage times cannot be compared when not empty
+
+    Returns:
+        mismatch (list): 'key: baseline value != report value' of data,
+            hours and breaths
+    """
+    return [f'{key}: {baseline.get(key)} != {report[key]}'
+            for key in COMPARED_KEYS if baseline.get(key) != report[key]]
+
+def format_report(report, baseline=None, threshold=0.1):
+    """Table of the stage results, with the change from baseline.
+    A baseline of another data set is not compared.
+
+    Returns:
+        text (str): the table
+        regressions (list): stages slower than baseline by more than threshold
+    """
+    lines = [f"{report['hours']} hours, {report['breaths']} breaths, median of {report['repeat']} runs"]
+    mismatch = baseline_mismatch(report, baseline) if baseline else []
+    if mismatch:
+        lines.append(f"Baseline of another data set not compared ({', '.join(mismatch)})")
+        baseline = None
+    lines.append(f"{'Stage':<16}{'Median s':>10}{'Breaths/s':>12}{'Peak MB':>10}" + (f"{'Baseline s':>12}{'Change':>9}" if baseline else ''))
+    regressions = []
+    for name, result in report['stages'].items():
+        if 'skipped' in result:
+            lines.append(f"{name:<16}  skipped, {result['skipped']}")
+            continue
+        rate = f"{result['breaths_per_s']:>12.0f}" if 'breaths_per_s' in result else f"{'-':>12}"
+        line = f"{name:<16}{result['median_s']:>10.3f}{rate}{result['peak_mb']:>10.1f}"
+        base = (baseline or {}).get('stages', {}).get(name, {})
+        if 'median_s' in base:
+            change = (result['median_s'] - base['median_s'])/base['median_s'] if base['median_s'] > 0 else 0.0
+            line += f"{base['median_s']:>12.3f}{change:>+9.1%}"
+            if change > threshold and result['median_s'] - base['median_s'] > MIN_REGRESSION_S:
+                line += '  REGRESSION'
+                regressions.append(name)
+        lines.append(line)
+    if report.get('max_rss_mb'):
+        lines.append(f"Max RSS: {report['max_rss_mb']:.0f} MB")
+    return '\n'.join(lines), regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the CARE_One analysis pipeline.',
+                                     epilog='exit status: 1 on a regression, 2 when the baseline is of another data set')
+    parser.add_argument('--data', default=DEFAULT_DATA, help='directory of hour files (default: example day)')
+    parser.add_argument('--hours', type=int, help='use the first HOURS files only (default: all)')
+    parser.add_argument('--synthetic', type=int, choices=range(1, 25), metavar='1-24',
+                        help='run on a day of SYNTHETIC generated hours instead of --data')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each stage (default: %(default)s)')
+    parser.add_argument('--save', metavar='JSON', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='JSON', help='compare with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown reported as a regression, as a fraction (default: %(default)s)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    # Qt SQL drivers need a core application, which needs no display
+    app = QCoreApplication(sys.argv[:1])
+    if args.synthetic:
+        with tempfile.TemporaryDirectory() as tmp:
+            paths, _ = write_patient(tmp, 1, date(2021, 1, 1), 1, args.synthetic, WaveformConfig(), spread=0)
+            report = run_benchmark(os.path.dirname(paths[0]), max(args.repeat, 1), args.hours)
+        report['data'] = f'synthetic, {args.synthetic} hours'
+    else:
+        report = run_benchmark(args.data, max(args.repeat, 1), args.hours)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    text, regressions = format_report(report, baseline, args.threshold)
+    print(text)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Baseline saved to {args.save}')
+    if baseline and baseline_mismatch(report, baseline):
+        return 2
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""
+Engine module.
+- Analysis of hour files and patient-days, independent of Qt
+- asyncio job API over the analysis
+
+Blocking use, e.g. from a QThread or a script:
+
+    engine = AnalysisEngine(SqliteStorage(), workers=4)
+    summary, hours = engine.day(paths, progress=print)
+
+asyncio use:
+
+    job = engine.submit_day(paths)
+    async for event in job.events():
+        print(event.stage, event.done, event.total)
+    summary, hours = await job
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+import threading
+import asyncio
+import logging
+import os
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from utils.calculations import respiratory_mechanics
+from utils.AI import get_current_model, AIpredict_batch, load_Recon_Model, recon_batch
+from utils import trace
+from .results import HourResult, DaySummary
+from .storage import MemoryStorage
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProgressEvent:
+    """Progress of an analysis stage
+
+    stage is one of 'fetch', 'mechanics', 'classification',
+    'reconstruction', 'save' and 'summary'.
+    """
+    stage: str
+    done: int
+    total: int
+    message: str = ''
+
+
+class JobCancelled(Exception):
+    """Raised in an analysis when its job is cancelled"""
+
+
+def split_fname(path):
+    """Patient number, date and hour from an hour file path"""
+    _, p_no, date, hour = os.path.basename(path).replace('.txt','').split('_')
+    return p_no, date, hour
+
+
+class AnalysisEngine():
+    """Respiratory mechanics, breath classification and reconstruction of
+    hour files, with results kept in a Storage.
+
+    Args:
+        storage (Storage): result store, in memory when None
+        workers (int): processes for the respiratory mechanics of many files
+        save (bool): save calculated hours in storage
+    """
+
+    def __init__(self, storage=None, workers=1, save=True):
+        self.storage = storage if storage is not None else MemoryStorage()
+        self.workers = max(int(workers), 1)
+        self.save = save
+        self._pool = None
+        self._jobs = None
+
+    # -------------------------------------------------------------------------
+    # Blocking API
+    # -------------------------------------------------------------------------
+    def analyse(self, paths, progress=None):
+        """Analyse hour files, without storage
+
+        Args:
+            paths (list): hour file paths
+            progress (callable): called with a ProgressEvent
+
+        Returns:
+            results (list): HourResult of each file, in the order of paths
+        """
+        report = progress or (lambda event: None)
+        results = self.mechanics(paths, report)
+        self.classify(results, report)
+        self.reconstruct(results, report)
+        return results
+
+    @trace.traced()
+    def mechanics(self, paths, report):
+        """Respiratory mechanics of many files, in worker processes when
+        there are more than one worker and file"""
+        total = len(paths)
+        workers = min(self.workers, total)
+        results = [None]*total
+        if workers > 1:
+            logger.info(f'Calculating results of {total} files with {workers} workers...')
+            try:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                # spans of the workers are sent back with their results
+                futures = {self._pool.submit(trace.call, trace.enabled(), respiratory_mechanics, p): i
+                            for i, p in enumerate(paths)}
+                for done, future in enumerate(as_completed(futures), 1):
+                    i = futures[future]
+                    results[i] = HourResult.from_dict(trace.merge(future.result()))
+                    report(ProgressEvent('mechanics', done, total, f'Calculation completed... {os.path.basename(paths[i])}'))
+            except JobCancelled:
+                raise
+            except Exception as e:
+                logger.warning(f'Worker pool failed, calculating remaining files serially: {e}')
+        for i, path in enumerate(paths):
+            if results[i] is None:
+                logger.info(f'Calculating results... {path}')
+                results[i] = HourResult.from_dict(respiratory_mechanics(path))
+                report(ProgressEvent('mechanics', sum(r is not None for r in results), total,
+                                     f'Calculation completed... {os.path.basename(path)}'))
+        return results
+
+    @trace.traced()
+    def classify(self, results, report):
+        """Classify the breaths of all hours together, then split per hour.
+        A failed classification leaves the breath types nan and marks the
+        hours failed, so that they are not saved and are classified again by
+        a later run."""
+        report(ProgressEvent('classification', 0, 0, 'Loading prediction model...'))
+        pressure = [p for r in results for p in r.pressure]
+        try:
+            _, PClassiModel = get_current_model()
+            b_type = AIpredict_batch(pressure, PClassiModel,
+                        callback=lambda done, total: report(ProgressEvent('classification', done, total, 'Predicting breath ...')))
+        except JobCancelled:
+            raise
+        except Exception as e:
+            logger.error(f'Breath prediction failed: {e}')
+            b_type = [np.nan] * len(pressure)
+            for r in results:
+                r.failed = f'classification: {e}'
+        start = 0
+        for r in results:
+            end = start + len(r.pressure)
+            r.b_type = b_type[start:end]
+            start = end
+        logger.info('Breath prediction completed.')
+
+    @trace.traced()
+    def reconstruct(self, results, report):
+        """Asynchrony magnitude of the breaths of each hour"""
+        report(ProgressEvent('reconstruction', 0, len(results), 'Loading recon model...'))
+        reconModel = load_Recon_Model()
+        for done, r in enumerate(results, 1):
+            r.AImag = recon_batch(r.flow, r.pressure, reconModel)
+            report(ProgressEvent('reconstruction', done, len(results), f'Breath recon completed... {r.hour}'))
+        logger.info('Breath recon prediction completed.')
+
+    def hour(self, path, progress=None, samples=True):
+        """Results of an hour file, from storage or calculated and saved
+
+        Args:
+            path (str): hour file path
+            progress (callable): called with a ProgressEvent
+            samples (bool): when False, an hour fetched from storage may come
+                without pressure and flow samples, see Storage.fetch_hour
+
+        Returns:
+            HourResult
+        """
+        report = progress or (lambda event: None)
+        p_no, date, hour = split_fname(path)
+        report(ProgressEvent('fetch', 0, 1, 'Fetching data from database...'))
+        try:
+            with trace.span('fetch'):
+                result = self.storage.fetch_hour(p_no, date, hour, samples=samples)
+        except Exception as e:
+            logger.warning(f'Cannot read {p_no} {date} {hour} from storage, calculating again: {e}')
+            result = None
+        if result is not None:
+            trace.count('hours_fetched')
+            report(ProgressEvent('fetch', 1, 1, 'Fetching data from database...'))
+            return result
+
+        logger.info(f'Initiating calculation... {path}')
+        result = self.analyse([path], report)[0]
+        if self.save:
+            report(ProgressEvent('save', 0, 1, 'Saving results...'))
+            with trace.span('save'):
+                self.save_hours([result])
+        return result
+
+    def day(self, paths, progress=None):
+        """Summary of the hour files of one patient-day. Hours in storage
+        are fetched, the others calculated and saved.
+
+        Returns:
+            summary (DaySummary)
+            results (list): HourResult of each hour, sorted by hour
+        """
+        report = progress or (lambda event: None)
+        files = {}
+        for path in paths:
+            p_no, date, hour = split_fname(path)
+            files.setdefault((p_no, date), {})[hour] = path
+
+        results, missing_paths = [], []
+        for (p_no, date), hours in files.items():
+            report(ProgressEvent('fetch', 0, len(hours), f'Fetching {p_no} {date} from database...'))
+            with trace.span('fetch'):
+                cached, missing = self.storage.fetch_day(p_no, date, hours.keys())
+            trace.count('hours_fetched', len(cached))
+            results.extend(cached)
+            missing_paths.extend(path for hour, path in hours.items() if hour in missing)
+
+        if missing_paths:
+            new_results = self.analyse(missing_paths, report)
+            if self.save:
+                report(ProgressEvent('save', 0, len(new_results), 'Saving results...'))
+                with trace.span('save', hours=len(new_results)):
+                    self.save_hours(new_results)
+            results.extend(new_results)
+
+        results = sorted(results, key=lambda r: (r.date, r.hour))
+        report(ProgressEvent('summary', 0, len(results), 'Processing complete. Populating result...'))
+        with trace.span('summary', hours=len(results)):
+            summary = DaySummary.from_hours(results)
+        return summary, results
+
+    def save_hours(self, results):
+        """Save the hours of results that did not fail
+
+        Returns:
+            bool: True when all hours were saved
+        """
+        complete = [r for r in results if r.failed is None]
+        for r in results:
+            if r.failed is not None:
+                logger.warning(f'{r.p_no} {r.date} {r.hour} not saved, {r.failed}')
+        saved = self.storage.save_hours(complete) if complete else True
+        return saved and len(complete) == len(results)
+
+    def close(self):
+        """Shut down worker processes and job thread"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._jobs is not None:
+            self._jobs.shutdown()
+            self._jobs = None
+
+    # -------------------------------------------------------------------------
+    # asyncio API
+    # -------------------------------------------------------------------------
+    def submit_hour(self, path):
+        """Start the analysis of an hour file, see hour(). Call from a
+        coroutine.
+
+        Returns:
+            Job: awaitable for the HourResult
+        """
+        return self._submit(self.hour, path)
+
+    def submit_day(self, paths):
+        """Start the analysis of a patient-day, see day(). Call from a
+        coroutine.
+
+        Returns:
+            Job: awaitable for (DaySummary, results)
+        """
+        return self._submit(self.day, paths)
+
+    def _submit(self, func, arg):
+        # Jobs run one at a time on a thread of their own: the models and
+        # the database writer are shared by all of them
+        if self._jobs is None:
+            self._jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AnalysisJob')
+        job = Job(asyncio.get_event_loop())
+
+        def run():
+            try:
+                if job.cancelled():
+                    raise JobCancelled()
+                return func(arg, progress=job.report)
+            finally:
+                self.storage.close()
+
+        job.start(self._jobs, run)
+        return job
+
+
+class Job():
+    """Analysis job of an AnalysisEngine, awaitable for its result
+
+    Progress events are streamed with events(). cancel() stops the job at
+    its next progress event, raising JobCancelled on await.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._cancel = threading.Event()
+        self._events = asyncio.Queue()
+        self._future = None
+
+    def start(self, executor, func):
+        self._future = self._loop.run_in_executor(executor, func)
+        self._future.add_done_callback(lambda f: self._events.put_nowait(None))
+
+    def report(self, event):
+        """Progress callback, called from the job thread"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self._loop.call_soon_threadsafe(self._events.put_nowait, event)
+
+    async def events(self):
+        """Progress events of the job, ending when the job is done"""
+        while True:
+            event = await self._events.get()
+            if event is None:
+                return
+            yield event
+
+    async def result(self):
+        return await self._future
+
+    def __await__(self):
+        return self.result().__await__()
+
+    def done(self):
+        return self._future.done()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
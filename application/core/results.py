@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""
+Results module.
+- Typed results of an hour and summaries of a patient-day
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import logging
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from utils.sketch import QuantileSketch, SKETCH_DECIMALS
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+
+# Respiratory parameters of each breath
+PARAMS = ['Ers', 'Rrs', 'PEEP', 'PIP', 'TV', 'DP']
+
+
+@dataclass
+class HourResult:
+    """Results of one hour file
+
+    Per-breath lists hold np.nan for rejected breaths. Hours fetched for a
+    day summary only carry the per-breath lists of parameters saved without
+    a quantile sketch, the others are None and summarised from sketch.
+    """
+    p_no: str
+    date: str
+    hour: str
+    b_count: int
+    b_len: List[int]
+    b_type: List = field(default_factory=list)
+    AImag: List[float] = field(default_factory=list)
+    Ers: Optional[List[float]] = None
+    Rrs: Optional[List[float]] = None
+    PEEP: Optional[List[float]] = None
+    PIP: Optional[List[float]] = None
+    TV: Optional[List[float]] = None
+    DP: Optional[List[float]] = None
+    b_num_all: Optional[List[int]] = None
+    P: Optional[List[float]] = None             # pressure samples
+    Q: Optional[List[float]] = None             # flow samples
+    pressure: Optional[List[list]] = None       # pressure of each breath, [] when rejected
+    flow: Optional[List[list]] = None           # flow of each breath, [] when rejected
+    debug: Optional[dict] = None
+    sketch: Dict[str, Optional[QuantileSketch]] = field(default_factory=dict)
+    pyramids: Optional[dict] = None             # {'P': pyramid, 'Q': pyramid} saved with the hour
+    from_storage: bool = False
+    failed: Optional[str] = None                # error of a failed stage, such hours are not saved
+
+    @classmethod
+    def from_dict(cls, dObj, from_storage=False):
+        """Build from a results dictionary (dObj), unknown keys are ignored"""
+        names = cls.__dataclass_fields__.keys()
+        return cls(from_storage=from_storage, **{k: v for k, v in dObj.items() if k in names})
+
+    def to_dict(self):
+        """Results dictionary (dObj) as used by utils.data_base"""
+        return {name: getattr(self, name) for name in self.__dataclass_fields__}
+
+    def param_sketch(self, param):
+        """Quantile sketch of a parameter. Hours calculated now, or saved
+        before sketches were stored, are sketched from raw values."""
+        sketch = self.sketch.get(param)
+        if sketch is None:
+            sketch = QuantileSketch.from_values(getattr(self, param), SKETCH_DECIMALS[param])
+        return sketch
+
+
+@dataclass
+class ParamSummary:
+    """All day quantiles of a parameter and box statistics of each hour"""
+    q5: float
+    q25: float
+    q50: float
+    q75: float
+    q95: float
+    min: float
+    max: float
+    box: List[dict]
+    raw: List[Optional[list]]
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+@dataclass
+class DaySummary:
+    """Summary of the hours of a patient-day, in hour order"""
+    p_no: str
+    date: str
+    hours: List[str]
+    b_count: List[int]
+    b_type: List[list]
+    AImag: List[list]
+    params: Dict[str, ParamSummary]
+
+    @classmethod
+    def from_hours(cls, hours):
+        """Combine multiple hours into an all day summary
+
+        All day quantiles come from the merged quantile sketches of the
+        hours, so hours fetched with sketches only need no per-breath data.
+
+        Args:
+            hours (list): HourResult of each hour, sorted by hour
+
+        Returns:
+            DaySummary
+        """
+        rounding = {'Ers': 1, 'Rrs': 1, 'PEEP': 1, 'PIP': 1, 'TV': 0, 'DP': 1}
+        params = {}
+        for param in PARAMS:
+            sketches = [h.param_sketch(param) for h in hours]
+            sketch = QuantileSketch.merge_all(sketches)
+            q = np.around(sketch.quantile([.05,.25,.50,.75,.95]), rounding[param])
+            if param == 'TV':
+                q = q.astype(int)
+            params[param] = ParamSummary(*q, min=sketch.min(), max=sketch.max(),
+                                         box=[sk.box_stats() for sk in sketches],
+                                         raw=[getattr(h, param) for h in hours])
+        return cls(p_no=hours[0].p_no, date=hours[0].date,
+                   hours=[h.hour for h in hours],
+                   b_count=[h.b_count for h in hours],
+                   b_type=[h.b_type for h in hours],
+                   AImag=[h.AImag for h in hours],
+                   params=params)
+
+    def to_dict(self):
+        """Day results dictionary as used by the Patient Overview screen"""
+        result = {
+            'p_no': self.p_no,
+            'date': self.date,
+            'hours': self.hours,
+            'b_count': self.b_count,
+            'b_type': self.b_type,
+            'AImag': {'raw': self.AImag}
+        }
+        for param, summary in self.params.items():
+            result[param] = summary.to_dict()
+        return result
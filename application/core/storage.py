@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""
+Storage module.
+- Interface of the result store used by the analysis engine
+- In memory and SQLite implementations
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+from abc import ABC, abstractmethod
+from dataclasses import replace
+import threading
+import logging
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from .results import HourResult
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+
+
+class Storage(ABC):
+    """Interface of a result store
+
+    Methods may be called from any thread. close() releases what the
+    calling thread holds.
+    """
+
+    @abstractmethod
+    def fetch_hour(self, p_no, date, hour, samples=True):
+        """All results of an hour, with pyramids
+
+        Args:
+            samples (bool): when False, the pressure and flow samples (P, Q)
+                of an hour stored with pyramids may be left None, see
+                fetch_samples()
+
+        Returns:
+            HourResult, None if not stored
+        """
+
+    @abstractmethod
+    def fetch_samples(self, p_no, date, hour):
+        """Pressure and flow samples of an hour
+
+        Returns:
+            P, Q, scale: samples are P/scale and Q/scale, None if not stored
+        """
+
+    @abstractmethod
+    def fetch_day(self, p_no, date, hours):
+        """Results of many hours of a patient-day, summary data only
+
+        Returns:
+            results (list): HourResult of each stored hour
+            missing (set): hours not stored
+        """
+
+    @abstractmethod
+    def saved_hours(self, p_no, date):
+        """Hours of a patient-day in the store
+
+        Returns:
+            set
+        """
+
+    @abstractmethod
+    def hour_version(self, p_no, date, hour):
+        """Version of a stored hour, which changes each time it is saved
+
+        Returns:
+            int, None if not stored
+        """
+
+    @abstractmethod
+    def save_hours(self, results):
+        """Save many hours, replacing stored ones
+
+        Args:
+            results (list): HourResult of each hour
+
+        Returns:
+            bool: True when all hours were saved
+        """
+
+    def close(self):
+        """Release what the calling thread holds, nothing by default"""
+
+
+class MemoryStorage(Storage):
+    """Result store kept in a dictionary, for tests, benchmarks and runs
+    that do not keep results"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hours = {}
+        self._versions = {}
+        self._saves = 0
+
+    def fetch_hour(self, p_no, date, hour, samples=True):
+        with self._lock:
+            result = self._hours.get((p_no, date, hour))
+        return None if result is None else replace(result, from_storage=True)
+
+    def fetch_samples(self, p_no, date, hour):
+        with self._lock:
+            result = self._hours.get((p_no, date, hour))
+        return None if result is None else (result.P, result.Q, 1)
+
+    def fetch_day(self, p_no, date, hours):
+        missing = set(hours)
+        with self._lock:
+            results = [replace(self._hours[(p_no, date, h)], from_storage=True)
+                        for h in sorted(missing) if (p_no, date, h) in self._hours]
+        missing.difference_update(r.hour for r in results)
+        return results, missing
+
+    def saved_hours(self, p_no, date):
+        with self._lock:
+            return {h for (p, d, h) in self._hours if p == p_no and d == date}
+
+    def hour_version(self, p_no, date, hour):
+        with self._lock:
+            return self._versions.get((p_no, date, hour))
+
+    def save_hours(self, results):
+        with self._lock:
+            for r in results:
+                self._saves += 1
+                self._hours[(r.p_no, r.date, r.hour)] = r
+                self._versions[(r.p_no, r.date, r.hour)] = self._saves
+        return True
+
+
+class SqliteStorage(Storage):
+    """Result store in the CARE_One SQLite database, through the Qt SQL
+    connections of utils.data_base (one per thread)"""
+
+    def __init__(self):
+        # Qt SQL is only needed by this implementation
+        from utils import data_base
+        self._db = data_base
+
+    def fetch_hour(self, p_no, date, hour, samples=True):
+        db = self._db.connections.connection(readonly=True)
+        # samples are read anyway for hours saved without pyramid
+        P_pyr, Q_pyr = self._db.fetch_db_pyramid(db, p_no, date, hour)
+        dObj = self._db.fetch_db_hour(db, p_no, date, hour, samples=samples or not P_pyr)
+        if dObj is None:
+            return None
+        result = HourResult.from_dict(dObj, from_storage=True)
+        result.pyramids = {'P': P_pyr, 'Q': Q_pyr}
+        return result
+
+    def fetch_samples(self, p_no, date, hour):
+        return self._db.fetch_db_samples(self._db.connections.connection(readonly=True), p_no, date, hour)
+
+    def fetch_day(self, p_no, date, hours):
+        db = self._db.connections.connection(readonly=True)
+        results, missing = self._db.fetch_db_day(db, p_no, date, hours)
+        return [HourResult.from_dict(dObj, from_storage=True) for dObj in results], missing
+
+    def saved_hours(self, p_no, date):
+        return self._db.fetch_db_saved_hours(self._db.connections.connection(readonly=True), p_no, date)
+
+    def hour_version(self, p_no, date, hour):
+        # INSERT OR REPLACE gives the row of a saved again hour a new id
+        return self._db.fetch_db_hour_id(self._db.connections.connection(readonly=True), p_no, date, hour)
+
+    def save_hours(self, results):
+        return self._db.save_db_hours(self._db.connections.connection(), [r.to_dict() for r in results])
+
+    def close(self):
+        self._db.connections.release()
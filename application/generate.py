@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Synthetic CARE_One data.
+
+Writes hour files of simulated patients for scale and stress testing, in
+the P<id>/<date>/patient_*.txt layout read by batch.py and the
+application:
+
+    python generate.py <out> --patients 30 --days 7
+
+Each patient gets its own E, R, PEEP and breath rate drawn around the
+given values. Noise, sample spikes, truncated breaths and unparsable
+lines exercise the rejection paths of the parser. The same --seed
+writes the same files.
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+import argparse
+import logging
+import time
+import sys
+import os
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from utils.synthetic import WaveformConfig, write_patient
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+
+
+def generate(out, patients, days, hours, cfg, start_date, seed=0, spread=0.2, workers=1):
+    """Write the hour files of patients 1 to patients
+
+    Returns:
+        paths (list): files written
+        n_breaths (int): breaths written
+    """
+    jobs = [(out, p, start_date, days, hours, cfg, seed, spread) for p in range(1, patients + 1)]
+    if workers > 1 and patients > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, patients)) as pool:
+            written = list(pool.map(write_patient, *zip(*jobs)))
+    else:
+        written = [write_patient(*job) for job in jobs]
+    return [p for paths, _ in written for p in paths], sum(n for _, n in written)
+
+def parse_args(argv=None):
+    defaults = WaveformConfig()
+    parser = argparse.ArgumentParser(description='Write synthetic ventilator hour files.')
+    parser.add_argument('out', help='output directory')
+    parser.add_argument('--patients', type=int, default=1, help='number of patients (default: %(default)s)')
+    parser.add_argument('--days', type=int, default=1, help='days per patient (default: %(default)s)')
+    parser.add_argument('--hours', type=int, default=24, choices=range(1, 25), metavar='1-24',
+                        help='hours per day (default: %(default)s)')
+    parser.add_argument('--start-date', type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(), default=date(2021, 1, 1),
+                        help='date of the first day, YYYY-MM-DD (default: 2021-01-01)')
+    parser.add_argument('--E', type=float, default=defaults.E, help='elastance, cmH2O/L (default: %(default)s)')
+    parser.add_argument('--R', type=float, default=defaults.R, help='resistance, cmH2O s/L (default: %(default)s)')
+    parser.add_argument('--peep', type=float, default=defaults.PEEP, help='PEEP, cmH2O (default: %(default)s)')
+    parser.add_argument('--drive', type=float, default=defaults.drive,
+                        help='inspiratory pressure above PEEP, cmH2O (default: %(default)s)')
+    parser.add_argument('--rate', type=float, default=defaults.rate, help='breaths/min (default: %(default)s)')
+    parser.add_argument('--asyn', type=float, default=defaults.asyn_fraction,
+                        help='fraction of asynchronous breaths (default: %(default)s)')
+    parser.add_argument('--noise', type=float, default=defaults.noise,
+                        help='pressure noise SD in cmH2O, 10x in L/min on flow (default: %(default)s)')
+    parser.add_argument('--spikes', type=float, default=defaults.spike_rate,
+                        help='fraction of breaths with a spike sample (default: %(default)s)')
+    parser.add_argument('--truncated', type=float, default=defaults.truncated_fraction,
+                        help='fraction of breaths cut short (default: %(default)s)')
+    parser.add_argument('--malformed', type=float, default=defaults.malformed_rate,
+                        help='fraction of breaths with an unparsable line (default: %(default)s)')
+    parser.add_argument('--spread', type=float, default=0.2,
+                        help='relative spread of E, R, PEEP and rate between patients (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes, one patient each (default: CPU count)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    cfg = WaveformConfig(E=args.E, R=args.R, PEEP=args.peep, drive=args.drive, rate=args.rate,
+                         asyn_fraction=args.asyn, noise=args.noise, spike_rate=args.spikes,
+                         truncated_fraction=args.truncated, malformed_rate=args.malformed)
+
+    start = time.perf_counter()
+    paths, n_breaths = generate(args.out, args.patients, args.days, args.hours, cfg,
+                                args.start_date, args.seed, args.spread, args.workers)
+    print(f'Wrote {len(paths)} hours ({n_breaths} breaths) to {args.out} in {time.perf_counter() - start:.1f} s')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
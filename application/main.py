@@ -25,7 +25,9 @@
 # =============================================================================
 import os
 import sys
+import multiprocessing
 import logging.config
+import time
 
 #==============================================================================
 # Set Environment variables
@@ -38,9 +40,8 @@ os.environ["KERAS_BACKEND"] = "tensorflow"
 # Third-party imports
 #==============================================================================
 from PyQt5.QtWidgets import QApplication, QMessageBox, QSplashScreen 
-from PyQt5.QtSql import QSqlDatabase
 from PyQt5.QtGui import QIcon, QPixmap
-from PyQt5.QtCore import Qt, QThread
+from PyQt5.QtCore import Qt, QThread, QSettings
 
 #==============================================================================
 # Setup System path
@@ -70,6 +71,29 @@ __title__ = 'CARE_One'
 
 
 
+class StartupTimer():
+    """Wall time of each startup phase, logged as one report once the main
+    window is shown. The ML stack is not part of startup, its import time
+    is logged by utils.AI on the first prediction.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        """End the current phase and name it"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self):
+        lines = [f'{phase:<16}{seconds*1000:8.0f} ms' for phase, seconds in self.phases]
+        total = sum(seconds for _, seconds in self.phases)
+        lines.append(f'{"Total":<16}{total*1000:8.0f} ms')
+        logger.info('Startup time\n' + '\n'.join(lines))
+
+
 class ImportThread(QThread):
     '''
     Do import of main code within another thread.
@@ -90,12 +114,14 @@ class ImportThread(QThread):
         from models.query import createTable
 
         CAREApp.showSplashMsg(self,f'Version: {__version__}\nStarting up')
-        
+        self.splash.timer.mark('Module import')
+
 
 
 class CAREApp(QApplication):
 
     def __init__(self):
+        self.timer = StartupTimer()
         QApplication.__init__(self, sys.argv)
         self.setOrganizationName("CARENet")
         self.setOrganizationDomain("caresoft.live")
@@ -125,6 +151,8 @@ class CAREApp(QApplication):
 
         # show the splash screen on normal start
         self.splash = self.makeSplash()
+        self.splash.timer = self.timer
+        self.timer.mark('Qt init')
         
         # create thread to import large modules
         self.thread = ImportThread(self.splash)
@@ -137,15 +165,27 @@ class CAREApp(QApplication):
         from models.query import createTable
 
         self.db = self.db_handle()
+        self.timer.mark('DB open')
 
         # standard start main window
         self.openMainWindow()
+        self.timer.mark('UI build')
 
         # initialize/create db table entry
         createTable(self.db)
+        self.timer.mark('DB schema')
 
         # clear splash when startup done
         self.splash.finish(self.window)
+        self.timer.report()
+
+        # tracing of analysis runs, also switched on by CARE_ONE_TRACE
+        if QSettings().value('trace', False, type=bool):
+            from utils import trace
+            trace.configure(True)
+
+        # load prediction models in the background, ready for the first analysis
+        self.window.start_warm_up()
 
     def closeBootloaderSplash(self):
         """Close bootloader splash screen when running in one-file mode"""
@@ -186,11 +226,11 @@ class CAREApp(QApplication):
 
     def db_handle(self):
         """Create and open database"""
-        db = QSqlDatabase.addDatabase("QSQLITE", connectionName="dbb")
-        db.setDatabaseName("CARE_One_data.sqlite")
-        dbName = db.databaseName()
-        conName = db.connectionName()
-        if not db.open():
+        from utils.data_base import connections
+
+        connections.db_name = "CARE_One_data.sqlite"
+        db = connections.connection()
+        if not db.isOpen():
             logger.error("Unable to connect to the database")
             QMessageBox.critical(None, ("Cannot open database"),
                                     ("Unable to establish a database connection.\n"
@@ -211,6 +251,8 @@ def run():
     sys.exit(app.exec_())
 
 if __name__ == '__main__':
+    # Needed by the worker processes of the frozen (PyInstaller) build
+    multiprocessing.freeze_support()
     run()
 
 
@@ -115,4 +115,131 @@ def createTable(db):
             
         )
         """
-    )
\ No newline at end of file
+    )
+
+    upgradeSchema(db)
+
+def tableColumns(db, table):
+    """Names of the columns of a table, empty if it does not exist"""
+    query = QSqlQuery(db)
+    query.exec(f"PRAGMA table_info({table})")
+    columns = set()
+    while query.next():
+        columns.add(query.value(1))
+    return columns
+
+def _schemaV1(db, query):
+    # Keep only the latest row of each patient-hour, then forbid duplicates
+    return query.exec(
+        """
+        DELETE FROM results WHERE id NOT IN (
+            SELECT MAX(id) FROM results GROUP BY p_no, date, hour
+        )
+        """
+    ) and query.exec(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_results_p_no_date_hour
+        ON results (p_no, date, hour)
+        """
+    )
+
+def _schemaV2(db, query):
+    # One row per breath with typed columns, for SQL-side aggregation
+    return query.exec(
+        """
+        CREATE TABLE IF NOT EXISTS breaths (
+            p_no VARCHAR(50) NOT NULL,
+            date VARCHAR(40) NOT NULL,
+            hour VARCHAR(40) NOT NULL,
+            b_idx INTEGER NOT NULL,     --position of breath in hour
+            b_num INTEGER,              --breath number from ventilator
+            b_len INTEGER,
+            b_type VARCHAR(10),         --Normal, Asyn, NULL if rejected
+            Ers REAL,
+            Rrs REAL,
+            PEEP REAL,
+            PIP REAL,
+            TV REAL,
+            DP REAL,
+            AImag REAL,
+            PRIMARY KEY (p_no, date, hour, b_idx)
+        )
+        """
+    ) and query.exec(
+        """
+        CREATE INDEX IF NOT EXISTS idx_breaths_p_no_b_type
+        ON breaths (p_no, b_type)
+        """
+    )
+
+def _schemaV3(db, query):
+    # Mergeable quantile sketch of each parameter, see utils.sketch
+    # Columns left by an earlier, interrupted upgrade are kept
+    columns = tableColumns(db, 'results')
+    for param in ['Ers','Rrs','PEEP','PIP','TV','DP']:
+        if f'{param}_sketch' in columns:
+            continue
+        if not query.exec(f"ALTER TABLE results ADD COLUMN {param}_sketch BLOB"):
+            return False
+    return True
+
+def _schemaV4(db, query):
+    # Min/max pyramid of the pressure and flow waveforms, see utils.decimate
+    return query.exec(
+        """
+        CREATE TABLE IF NOT EXISTS pyramid (
+            p_no VARCHAR(50) NOT NULL,
+            date VARCHAR(40) NOT NULL,
+            hour VARCHAR(40) NOT NULL,
+            level INTEGER NOT NULL,     --bucket size in samples
+            p_min BLOB,
+            p_max BLOB,
+            q_min BLOB,
+            q_max BLOB,
+            PRIMARY KEY (p_no, date, hour, level)
+        )
+        """
+    )
+
+# Steps of upgradeSchema: (version, description, step)
+SCHEMA_VERSIONS = [
+    (1, 'unique (p_no, date, hour) index', _schemaV1),
+    (2, 'breaths table', _schemaV2),
+    (3, 'quantile sketch columns', _schemaV3),
+    (4, 'waveform pyramid table', _schemaV4),
+]
+
+def upgradeSchema(db):
+    """Upgrade the results table to the latest schema version.
+    The version is kept in SQLite's user_version pragma.
+
+    Each version is upgraded in its own transaction together with
+    user_version, and rolled back on error, so a failed upgrade leaves
+    the database at the previous version and is run again on next start.
+
+    Returns:
+        bool: True when the database is at the latest version
+    """
+    query = QSqlQuery(db)
+    query.exec("PRAGMA user_version")
+    version = query.value(0) if query.next() else 0
+    query.finish()
+
+    for target, description, step in SCHEMA_VERSIONS:
+        if version >= target:
+            continue
+        logger.info(f'Upgrading db schema to version {target}: {description}')
+        if not db.transaction():
+            logger.error(f"Error: cannot start transaction: {db.lastError().text()}")
+            return False
+        query = QSqlQuery(db)
+        ok = step(db, query) and query.exec(f"PRAGMA user_version = {target}")
+        error = query.lastError().text()
+        query.finish()
+        if ok and db.commit():
+            version = target
+            continue
+        logger.error(f"Error: db schema version {target} rolled back: {error or db.lastError().text()}")
+        db.rollback()
+        return False
+    return True
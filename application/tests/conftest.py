@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Test setup: modules are imported from application/, as when running
+main.py from there."""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import sys
+import os
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import pytest
+
+application_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if application_path not in sys.path:
+    sys.path.insert(0, application_path)
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    """Core application, needed by the Qt SQL drivers"""
+    from PyQt5.QtCore import QCoreApplication
+    return QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+
+@pytest.fixture
+def connection(qapp, tmp_path):
+    """Read-write connection to a new, empty database file"""
+    from utils.data_base import connections
+    db_name = connections.db_name
+    connections.db_name = str(tmp_path/'CARE_One_test.sqlite')
+    yield connections.connection()
+    connections.release()
+    connections.db_name = db_name
+
+@pytest.fixture
+def db(connection):
+    """Connection to a new database file with the latest schema"""
+    from models.query import createTable
+    createTable(connection)
+    return connection
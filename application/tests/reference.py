@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Reference implementations and data shared by the tests
+
+The per-breath functions are the original line by line implementations
+replaced by the vectorized analysis, kept to check that results did not
+change.
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import functools
+import glob
+import os
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from utils.calculations import Elastance
+
+EXAMPLE_DAY = os.path.join(os.path.dirname(__file__), '..', '..', 'examples', 'P0001', '2021-01-01')
+EXAMPLE_HOURS = sorted(glob.glob(os.path.join(EXAMPLE_DAY, 'patient_*.txt')))
+
+# Hours compared breath by breath, the reference parser takes seconds
+# each. These hold deleted lines and breaths rejected on E, R and VT.
+HOURS = [path for path in EXAMPLE_HOURS if os.path.basename(path)[-12:-10] in ('00', '07', '12', '21')]
+
+PARAMS = ['Ers', 'Rrs', 'PEEP', 'PIP', 'TV', 'DP']
+
+
+def calc_resp_mechanics_per_breath(path):
+    """Reference: calcRespMechanics reading the file line by line and
+    solving each breath with linear_r"""
+    elastance = Elastance()
+    pressure, flow, b_num_all, b_len, rejected = [], [], [], [], []
+    P, Q, Ers_A, Rrs_A, P_A, Q_A, PEEP_A, PIP_A, TV_A, DP_A = [],[],[],[],[],[],[],[],[],[]
+    b_count = 0
+    b_counter = [0,0,0,0,0,0]
+    b_num = 0
+    with open(path, "r") as f:
+        for num, line in enumerate(f):
+            if ("BS," in line) == True:
+                b_num = elastance._extractBNum(line)
+            elif ("BE" in line) == True:
+                b_count += 1
+                b_len.append(len(pressure))
+                P.extend(pressure)
+                Q.extend(flow)
+                b_num_all.append(b_num)
+                reason = None
+                if len(pressure) >= 20:
+                    if len(pressure) == len(flow):
+                        E, R, PEEP, PIP, TidalVolume, _, _ = elastance.linear_r(pressure, flow, useIM=True)
+                        if abs(E) < 100:
+                            if abs(R) < 100:
+                                if TidalVolume < 1:
+                                    P_A.append(pressure)
+                                    Q_A.append(flow)
+                                    Ers_A.append(E)
+                                    Rrs_A.append(R)
+                                    PEEP_A.append(round(PEEP,1))
+                                    PIP_A.append(round(PIP,1))
+                                    TV_A.append(round(TidalVolume*1000))
+                                    DP_A.append(round(PIP-PEEP,1))
+                                    b_counter[0] += 1
+                                else:
+                                    reason = f'THRESHOLD: VT >= 1000ml, RAW: {round(TidalVolume*1000)}'
+                                    b_counter[1] += 1
+                            else:
+                                reason = f'THRESHOLD: abs(R) > 100, RAW: {R}'
+                                b_counter[2] += 1
+                        else:
+                            reason = f'THRESHOLD: abs(E) > 100, RAW: {E}'
+                            b_counter[3] += 1
+                    else:
+                        reason = f'THRESHOLD: len(pressure) != len(flow), RAW: {len(pressure)},{len(flow)}'
+                        b_counter[4] += 1
+                else:
+                    reason = f'THRESHOLD: len(pressure) <= 20, RAW: {len(pressure)}'
+                    b_counter[5] += 1
+                if reason is not None:
+                    elastance.add_nan(P_A, Q_A, Ers_A, Rrs_A, PEEP_A, PIP_A, TV_A, DP_A)
+                    rejected.append((b_num, reason))
+                pressure, flow = [], []
+            elif line != '':
+                section = line.split(',')
+                try:
+                    p_split = float(section[1])
+                    q_split = float(section[0])
+                except Exception:
+                    continue
+                if abs(p_split) <= 100 and abs(q_split) <= 1000:
+                    if len(pressure) > 1:
+                        P_i = float(last_sec[1])
+                        Q_i = float(last_sec[0])
+                        last_sec = section
+                        if abs(p_split - P_i) <= 50:
+                            if abs(q_split - Q_i) <= 100:
+                                pressure.append(round(p_split,1))
+                                flow.append(round(q_split,1))
+                            else:
+                                rejected.append((b_num,f'LINE {num}, LINE DEL: Qi-Qi-1 >= 50, RAW: {q_split}, {Q_i}'))
+                        else:
+                            rejected.append((b_num,f'LINE {num}, LINE DEL: Pi-Pi-1 >= 50, RAW: {p_split}, {P_i}'))
+                    else:
+                        last_sec = section
+                        pressure.append(round(p_split,1))
+                        flow.append(round(q_split,1))
+                else:
+                    rejected.append((b_num,f'LINE DEL: abs(P)<=100 or abs(Q)<=1000, RAW: {p_split}, {q_split}'))
+
+    debug = {'rejected': rejected, 'b_counter': b_counter}
+    return P, Q, P_A, Q_A, Ers_A, Rrs_A, b_count, PEEP_A, PIP_A, TV_A, DP_A, b_num_all, b_len, debug
+
+@functools.lru_cache(maxsize=None)
+def vectorized(path):
+    return Elastance().calcRespMechanics(path)
+
+@functools.lru_cache(maxsize=None)
+def per_breath(path):
+    return calc_resp_mechanics_per_breath(path)
+
+def breath_arrays(result):
+    """Parameters of the accepted breaths of a calcRespMechanics result"""
+    P, Q, P_A, Q_A, Ers_A, Rrs_A, b_count, PEEP_A, PIP_A, TV_A, DP_A, b_num_all, b_len, debug = result
+    return dict(zip(PARAMS, (np.array(v, dtype=np.float64) for v in (Ers_A, Rrs_A, PEEP_A, PIP_A, TV_A, DP_A))))
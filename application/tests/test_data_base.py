@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Database schema, encoding and saving of results"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import json
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+from PyQt5.QtCore import QByteArray
+from PyQt5.QtSql import QSqlQuery
+import numpy as np
+import pytest
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from models import query as schema
+from utils.data_base import (pack_array, unpack_array, unpack_fixed, save_db_hours, save_db_breaths,
+                              fetch_db_hour, fetch_db_hour_id, fetch_db_samples)
+from utils.decimate import minmax_pyramid
+
+
+def hour_results(hour='00-00-00', n=30, seed=0):
+    """Results dictionary of a made up hour, with one rejected breath"""
+    rng = np.random.default_rng(seed)
+    b_len = rng.integers(40, 60, n)
+    params = {
+        'Ers': np.round(rng.uniform(20, 40, n), 1),
+        'Rrs': np.round(rng.uniform(5, 15, n), 1),
+        'PEEP': np.round(rng.uniform(5, 10, n), 1),
+        'PIP': np.round(rng.uniform(20, 30, n), 1),
+        'TV': np.round(rng.uniform(300, 500, n)),
+        'DP': np.round(rng.uniform(10, 20, n), 1),
+        'AImag': np.round(rng.uniform(0, 50, n), 2),
+    }
+    for values in params.values():
+        values[3] = np.nan
+    b_type = ['Asyn' if a > 40 else 'Normal' for a in params['AImag']]
+    b_type[3] = np.nan
+    dObj = {name: values.tolist() for name, values in params.items()}
+    dObj.update({
+        'p_no': 'P0001',
+        'date': '2021-01-01',
+        'hour': hour,
+        'P': np.round(rng.uniform(5, 30, b_len.sum()), 1).tolist(),
+        'Q': np.round(rng.uniform(-60, 60, b_len.sum()), 1).tolist(),
+        'b_count': n,
+        'b_type': b_type,
+        'b_num_all': list(range(1, n + 1)),
+        'b_len': b_len.tolist(),
+        'debug': {'rejected': [[4, 'THRESHOLD: abs(E) > 100, RAW: 120.0']], 'b_counter': [n - 1, 0, 0, 1, 0, 0]},
+    })
+    return dObj
+
+def rows(db, sql):
+    """All rows of a query, as tuples with None for NULL"""
+    query = QSqlQuery(db)
+    assert query.exec(sql), query.lastError().text()
+    result = []
+    while query.next():
+        result.append(tuple(None if query.isNull(i) else query.value(i) for i in range(query.record().count())))
+    query.finish()
+    return result
+
+
+@pytest.mark.parametrize('dtype, decimals', [('<f8', 0), ('<i4', 0), ('|u1', 0), ('<i2', 0), ('<i2', 1), ('<i2', 2)])
+def test_pack_round_trip(dtype, decimals):
+    values = np.round(np.random.default_rng(0).uniform(0, 100, 1000), decimals)
+    if dtype == '<f8':
+        values[[0, 10]] = np.nan
+    packed = pack_array(values.tolist(), dtype, decimals)
+    assert len(packed) == 8 + len(values)*np.dtype(dtype).itemsize
+    np.testing.assert_array_equal(unpack_array(packed), values)
+    np.testing.assert_array_equal(unpack_array(packed.data()), values)
+    # fixed-point values are a view on the column value, scaled by the caller
+    raw, scale = unpack_fixed(packed)
+    assert raw.base is packed
+    assert raw.dtype == np.dtype(dtype) and scale == 10**decimals
+    np.testing.assert_array_equal(raw/scale, values)
+
+def test_unpack_empty():
+    assert len(unpack_array(pack_array([], '<i2', decimals=1))) == 0
+
+def test_unpack_legacy_json():
+    values = [1.5, None, 3.0]
+    assert unpack_array('[1.5, null, 3.0]') == values
+    assert unpack_array(QByteArray(b'[1.5, null, 3.0]')) == values
+    assert unpack_fixed('[1.5, null, 3.0]') == (values, 1)
+
+def test_fetch_legacy_row(db):
+    # hour saved as JSON text before packed columns
+    lists = {'p': [10.5, 11.0], 'q': [-1.5, 2.0], 'b_num_all': [1, 2], 'b_len': [1, 1], 'debug': {}}
+    lists.update({f'{param}_raw': [30.1, None] for param in ['Ers', 'Rrs', 'PEEP', 'PIP', 'TV', 'DP', 'AM']})
+    columns = ', '.join(lists)
+    values = ', '.join(f"'{json.dumps(v)}'" for v in lists.values())
+    rows(db, f"""INSERT INTO results (p_no, date, hour, b_count, b_type, {columns})
+            VALUES ('P0001', '2021-01-01', '00-00-00', 2, '["Normal", NaN]', {values})""")
+    dObj = fetch_db_hour(db, 'P0001', '2021-01-01', '00-00-00')
+    assert dObj['P'] == lists['p'] and dObj['Ers'] == lists['Ers_raw']
+    assert dObj['b_len'] == lists['b_len']
+    assert fetch_db_samples(db, 'P0001', '2021-01-01', '00-00-00') == (lists['p'], lists['q'], 1)
+
+def test_upgrade_from_v0(connection, monkeypatch):
+    # results table as created before schema versions, holding a duplicate hour
+    monkeypatch.setattr(schema, 'SCHEMA_VERSIONS', [])
+    schema.createTable(connection)
+    monkeypatch.undo()
+    assert rows(connection, "PRAGMA user_version") == [(0,)]
+    for hour, b_count in [('00-00-00', 1), ('01-00-00', 3), ('00-00-00', 2)]:
+        rows(connection, f"INSERT INTO results (p_no, date, hour, b_count) VALUES ('P0001', '2021-01-01', '{hour}', {b_count})")
+
+    assert schema.upgradeSchema(connection)
+    assert rows(connection, "PRAGMA user_version") == [(schema.SCHEMA_VERSIONS[-1][0],)]
+    # the latest row of the duplicate hour is kept
+    assert rows(connection, "SELECT hour, b_count FROM results ORDER BY hour") == [('00-00-00', 2), ('01-00-00', 3)]
+    assert {f'{p}_sketch' for p in ['Ers','Rrs','PEEP','PIP','TV','DP']} <= schema.tableColumns(connection, 'results')
+    assert schema.tableColumns(connection, 'breaths')
+    assert schema.tableColumns(connection, 'pyramid')
+    assert not QSqlQuery(connection).exec("INSERT INTO results (p_no, date, hour) VALUES ('P0001', '2021-01-01', '01-00-00')")
+
+    # upgrading again changes nothing
+    assert schema.upgradeSchema(connection)
+    assert rows(connection, "SELECT COUNT(*) FROM results") == [(2,)]
+
+def test_save_replaces_hour(db):
+    first, second = hour_results(seed=0), hour_results(seed=1)
+    assert save_db_hours(db, [first, hour_results('01-00-00')])
+    assert save_db_hours(db, [second])
+
+    assert rows(db, "SELECT hour, COUNT(*) FROM results GROUP BY hour") == [('00-00-00', 1), ('01-00-00', 1)]
+    dObj = fetch_db_hour(db, 'P0001', '2021-01-01', '00-00-00')
+    np.testing.assert_array_equal(dObj['Ers'], second['Ers'])
+    np.testing.assert_array_equal(dObj['P'], second['P'])
+    assert dObj['debug'] == second['debug']
+    # breaths and pyramid of the hour are replaced, not added
+    assert rows(db, "SELECT COUNT(*) FROM breaths WHERE hour='00-00-00'") == [(second['b_count'],)]
+    assert rows(db, "SELECT COUNT(*) FROM pyramid WHERE hour='00-00-00'") == [(len(minmax_pyramid(second['P'])),)]
+    # statements prepared once for the batch bind the values of each hour
+    assert rows(db, "SELECT hour, COUNT(*), MAX(b_idx) FROM breaths GROUP BY hour") == [('00-00-00', 30, 29), ('01-00-00', 30, 29)]
+    assert rows(db, "SELECT DISTINCT hour FROM pyramid ORDER BY hour") == [('00-00-00',), ('01-00-00',)]
+
+def test_hour_id_changes_on_save(db):
+    # the Hourly View plot cache relies on it to drop hours saved again
+    assert fetch_db_hour_id(db, 'P0001', '2021-01-01', '00-00-00') is None
+    assert save_db_hours(db, [hour_results()])
+    first = fetch_db_hour_id(db, 'P0001', '2021-01-01', '00-00-00')
+    assert save_db_hours(db, [hour_results(seed=1)])
+    assert fetch_db_hour_id(db, 'P0001', '2021-01-01', '00-00-00') not in (None, first)
+
+def test_save_breaths(db):
+    r = hour_results()
+    params = ['Ers', 'Rrs', 'PEEP', 'PIP', 'TV', 'DP', 'AImag']
+    args = [r[name] for name in ['b_num_all', 'b_len', 'b_type'] + params]
+    assert save_db_breaths(db, 'P0001', '2021-01-01', '00-00-00', *args)
+
+    saved = rows(db, f"""SELECT b_idx, b_num, b_len, b_type, {', '.join(params)} FROM breaths
+                    WHERE p_no='P0001' AND date='2021-01-01' AND hour='00-00-00' ORDER BY b_idx""")
+    assert len(saved) == r['b_count']
+    for i, row in enumerate(saved):
+        assert row[:3] == (i, r['b_num_all'][i], r['b_len'][i])
+        if i == 3:
+            # rejected breath: nan values and breath type are NULL
+            assert row[3:] == (None,)*(1 + len(params))
+        else:
+            assert row[3:] == (r['b_type'][i], *(r[name][i] for name in params))
+    assert rows(db, "SELECT COUNT(*) FROM breaths WHERE Ers IS NULL AND b_type IS NULL") == [(1,)]
+
+    # lists of different lengths are refused, the saved breaths are kept
+    args[-1] = args[-1][:-1]
+    assert not save_db_breaths(db, 'P0001', '2021-01-01', '00-00-00', *args)
+
+def test_fetch_samples(db):
+    dObj = hour_results()
+    assert save_db_hours(db, [dObj])
+    P, Q, scale = fetch_db_samples(db, 'P0001', '2021-01-01', '00-00-00')
+    assert P.dtype == Q.dtype == np.int16 and scale == 10
+    np.testing.assert_array_equal(P/scale, dObj['P'])
+    np.testing.assert_array_equal(Q/scale, dObj['Q'])
+    assert fetch_db_samples(db, 'P0001', '2021-01-01', '01-00-00') is None
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Min/max decimation of waveforms for plotting"""
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+import pytest
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from utils.decimate import minmax_indices, minmax_pyramid, pyramid_view, PYRAMID_LEVELS
+
+
+def signal(n, seed=0):
+    """Random walk rounded to 0.1, as pressure samples are"""
+    return np.round(np.cumsum(np.random.default_rng(seed).normal(0, 1, n)), 1)
+
+@pytest.mark.parametrize('n, start, stop, n_buckets', [
+    (10000, 0, 10000, 100),     # whole buckets
+    (10007, 0, 10007, 100),     # last bucket partial
+    (10000, 1234, 8765, 333),   # range inside the signal
+    (10000, -50, 20000, 97),    # range past both ends
+])
+def test_minmax_indices_keep_extremes(n, start, stop, n_buckets):
+    y = signal(n)
+    idx = minmax_indices(y, start, stop, n_buckets)
+    start, stop = max(start, 0), min(stop, n)
+    assert len(idx) <= 2*n_buckets
+    assert np.all(np.diff(idx) > 0)
+    assert idx[0] >= start and idx[-1] < stop
+    size = -(-(stop - start) // n_buckets)
+    kept = set(idx.tolist())
+    for lo in range(start, stop, size):
+        bucket = y[lo:min(lo + size, stop)]
+        assert lo + np.argmin(bucket) in kept
+        assert lo + np.argmax(bucket) in kept
+
+def test_minmax_indices_short_and_empty():
+    y = signal(150)
+    np.testing.assert_array_equal(minmax_indices(y, 10, 100, 50), np.arange(10, 100))
+    assert len(minmax_indices(y, 200, 300, 50)) == 0
+    assert len(minmax_indices(np.zeros(0), 0, 100, 50)) == 0
+
+def test_minmax_indices_nan():
+    y = signal(10000)
+    y[2000:2600] = np.nan
+    idx = minmax_indices(y, 0, len(y), 100)
+    # the gap stays visible, the extremes around it are kept
+    assert np.isnan(y[idx]).any()
+    assert np.nanargmin(y) in idx and np.nanargmax(y) in idx
+
+    idx = minmax_indices(np.full(10000, np.nan), 0, 10000, 100)
+    assert len(idx) <= 2*100 and np.all((idx >= 0) & (idx < 10000))
+
+@pytest.mark.parametrize('n', [3000*10, 3000*10 + 1234, 49, 1])
+def test_minmax_pyramid(n):
+    y = signal(n)
+    pyramid = minmax_pyramid(y)
+    assert list(pyramid) == list(PYRAMID_LEVELS)
+    for level, (mins, maxs) in pyramid.items():
+        assert len(mins) == len(maxs) == -(-n // level)
+        for k in range(len(mins)):
+            assert mins[k] == y[k*level:(k + 1)*level].min()
+            assert maxs[k] == y[k*level:(k + 1)*level].max()
+
+def test_minmax_pyramid_empty_and_nan():
+    for mins, maxs in minmax_pyramid([]).values():
+        assert len(mins) == len(maxs) == 0
+    for level, (mins, maxs) in minmax_pyramid(np.full(3100, np.nan)).items():
+        assert len(mins) == -(-3100 // level)
+        assert np.isnan(mins).all() and np.isnan(maxs).all()
+
+def test_pyramid_view():
+    y = signal(3000*4 + 700)
+    level = 500
+    mins, maxs = minmax_pyramid(y)[level]
+    # samples 1200:2600 lie in buckets 2 to 5
+    x, y_view = pyramid_view(mins, maxs, level, 1200, 2600)
+    np.testing.assert_array_equal(x, np.repeat(np.arange(2, 6)*level + level/2, 2))
+    np.testing.assert_array_equal(y_view[0::2], mins[2:6])
+    np.testing.assert_array_equal(y_view[1::2], maxs[2:6])
+    # partial last bucket and range past both ends
+    x, y_view = pyramid_view(mins, maxs, level, -100, 10**6)
+    assert len(x) == len(y_view) == 2*len(mins)
+    x, y_view = pyramid_view(mins, maxs, level, 10**6, 2*10**6)
+    assert len(x) == len(y_view) == 0
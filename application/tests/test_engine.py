@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Analysis engine with in memory storage and its asyncio job API
+
+The prediction models are replaced by fakes, so that the tests neither
+need keras nor the trained models.
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import asyncio
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+import pytest
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+import core.engine as engine_module
+from core.engine import AnalysisEngine, JobCancelled, split_fname
+from core.results import DaySummary
+from core.storage import MemoryStorage
+from reference import EXAMPLE_HOURS
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """Fake classification and reconstruction models, every breath Normal
+    with no asynchrony. Calls are counted by stage."""
+    calls = {'classification': 0, 'reconstruction': 0}
+
+    def predict(breaths, model, callback=None):
+        calls['classification'] += 1
+        if callback is not None:
+            callback(len(breaths), len(breaths))
+        return ['Normal']*len(breaths)
+
+    def recon(flows, pressures, model):
+        calls['reconstruction'] += 1
+        return [0.0]*len(pressures)
+
+    monkeypatch.setattr(engine_module, 'get_current_model', lambda: (None, 'classification model'))
+    monkeypatch.setattr(engine_module, 'AIpredict_batch', predict)
+    monkeypatch.setattr(engine_module, 'load_Recon_Model', lambda: 'reconstruction model')
+    monkeypatch.setattr(engine_module, 'recon_batch', recon)
+    return calls
+
+@pytest.fixture
+def engine():
+    engine = AnalysisEngine(MemoryStorage())
+    yield engine
+    engine.close()
+
+def run(coroutine):
+    """Run a coroutine on a new event loop"""
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def test_hour_saved_then_fetched(engine, models):
+    path = EXAMPLE_HOURS[0]
+    events = []
+    result = engine.hour(path, progress=events.append)
+    assert not result.from_storage and result.failed is None
+    assert result.b_type == ['Normal']*len(result.b_type) and len(result.b_type) == len(result.b_len)
+    stages = [e.stage for e in events]
+    assert stages.index('mechanics') < stages.index('classification') < stages.index('reconstruction') < stages.index('save')
+
+    p_no, date, hour = split_fname(path)
+    assert engine.storage.saved_hours(p_no, date) == {hour}
+    events.clear()
+    fetched = engine.hour(path, progress=events.append)
+    assert fetched.from_storage and fetched.b_len == result.b_len
+    assert {e.stage for e in events} == {'fetch'}
+    assert models == {'classification': 1, 'reconstruction': 1}
+
+def test_day_analyses_missing_hours(engine, models):
+    paths = EXAMPLE_HOURS[:3]
+    engine.hour(paths[1])
+    summary, results = engine.day(paths)
+    assert isinstance(summary, DaySummary)
+    assert [r.hour for r in results] == [split_fname(p)[2] for p in paths]
+    assert [r.from_storage for r in results] == [False, True, False]
+    # the two missing hours are classified together, reconstructed one by one
+    assert models == {'classification': 2, 'reconstruction': 3}
+    assert summary.b_count == [r.b_count for r in results]
+
+def test_failed_classification_not_saved(engine, models, monkeypatch):
+    def predict(breaths, model, callback=None):
+        raise RuntimeError('no model')
+    monkeypatch.setattr(engine_module, 'AIpredict_batch', predict)
+
+    result = engine.hour(EXAMPLE_HOURS[0])
+    assert result.failed == 'classification: no model'
+    assert len(result.b_type) == len(result.b_len) and np.isnan(result.b_type).all()
+    assert engine.storage.saved_hours(*split_fname(EXAMPLE_HOURS[0])[:2]) == set()
+    assert not engine.save_hours([result])
+
+def test_job_events_and_result(engine, models):
+    async def main():
+        job = engine.submit_hour(EXAMPLE_HOURS[0])
+        events = [event async for event in job.events()]
+        return job, events, await job
+    job, events, result = run(main())
+    assert job.done() and not job.cancelled()
+    assert [e.stage for e in events][-1] == 'save'
+    assert any(e.stage == 'classification' and e.done == e.total > 0 for e in events)
+    assert result.hour == split_fname(EXAMPLE_HOURS[0])[2] and not result.from_storage
+
+def test_job_cancel(engine, models):
+    async def main():
+        job = engine.submit_hour(EXAMPLE_HOURS[0])
+        async for event in job.events():
+            # the job stops at its next progress event
+            job.cancel()
+        with pytest.raises(JobCancelled):
+            await job
+        return job
+    job = run(main())
+    assert job.cancelled()
+    assert engine.storage.saved_hours(*split_fname(EXAMPLE_HOURS[0])[:2]) == set()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Batched respiratory mechanics against linear_r on each breath"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import os
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+import pytest
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from utils.calculations import Elastance
+from utils.preprocessing import to_ragged
+from reference import HOURS, PARAMS, vectorized, per_breath, breath_arrays
+
+
+@pytest.mark.parametrize('path', HOURS, ids=os.path.basename)
+def test_respiratory_mechanics(path):
+    params, ref_params = breath_arrays(vectorized(path)), breath_arrays(per_breath(path))
+    for param in PARAMS:
+        np.testing.assert_array_equal(params[param], ref_params[param], err_msg=param)
+
+@pytest.mark.parametrize('path', HOURS, ids=os.path.basename)
+def test_linear_r_batch(path):
+    P_A, Q_A = vectorized(path)[2:4]
+    breaths = [(p, q) for p, q in zip(P_A, Q_A) if len(p) != 0]
+    pressure, offsets = to_ragged([p for p, _ in breaths])
+    flow, _ = to_ragged([q for _, q in breaths])
+    batch = Elastance().linear_r_batch(pressure, flow, offsets, useIM=True)
+    ref = np.array([Elastance().linear_r(p, q, useIM=True) for p, q in breaths], dtype=np.float64).T
+    # Ers, Rrs, PEEP and PIP exactly, tidal volume, I:E and VE to rounding
+    np.testing.assert_array_equal(np.array(batch[:4]), ref[:4])
+    np.testing.assert_allclose(np.array(batch[4:]), ref[4:], rtol=1e-12)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""One pass hour file parser against the line by line reader"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import os
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+import pytest
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from utils.synthetic import WaveformConfig, hour_text
+from reference import EXAMPLE_HOURS, HOURS, vectorized, per_breath
+
+
+def test_example_day_present():
+    assert len(EXAMPLE_HOURS) == 24
+
+@pytest.mark.parametrize('path', HOURS, ids=os.path.basename)
+def test_parsed_arrays(path):
+    P, Q, P_A, Q_A, _, _, b_count, _, _, _, _, b_num_all, b_len, debug = vectorized(path)
+    ref_P, ref_Q, ref_P_A, ref_Q_A, _, _, ref_b_count, _, _, _, _, ref_b_num_all, ref_b_len, ref_debug = per_breath(path)
+    assert P == ref_P
+    assert Q == ref_Q
+    assert b_count == ref_b_count
+    assert b_len == ref_b_len
+    assert b_num_all == ref_b_num_all
+    assert P_A == ref_P_A
+    assert Q_A == ref_Q_A
+    assert debug == ref_debug
+
+def test_parsed_arrays_synthetic(tmp_path):
+    # spikes, unparsable lines and short breaths, rare in the example day
+    cfg = WaveformConfig(noise=0.2, spike_rate=0.1, truncated_fraction=0.05, malformed_rate=0.05)
+    text, _, _ = hour_text(cfg, np.random.default_rng(1), seconds=600)
+    path = str(tmp_path/'patient_P0001_2021-01-01_00-00-00.txt')
+    with open(path, 'w') as f:
+        f.write(text)
+    result, ref = vectorized(path), per_breath(path)
+    debug = result[-1]
+    assert debug['b_counter'][5] > 0
+    assert any('Pi-Pi-1' in r for _, r in debug['rejected'])
+    assert any('Qi-Qi-1' in r for _, r in debug['rejected'])
+    assert any('abs(P)<=100' in r for _, r in debug['rejected'])
+    assert result[:6] == ref[:6]
+    assert result[6:] == ref[6:]
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Batched model inputs against the per-breath norma_resample"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import os
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+from scipy.interpolate import interp1d
+import numpy as np
+import pytest
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from utils.calculations import Elastance
+from utils.preprocessing import to_ragged, head_ragged, norma_resample_batch
+from reference import HOURS, vectorized
+
+
+def norma_resample_per_breath(input_data, data_size):
+    """Reference: normalise, resample with interp1d and pad one breath, as
+    keras pad_sequences(padding='post', truncating='post') did"""
+    input_data = np.array(input_data)
+    input_data = (input_data - min(input_data))/max(input_data - min(input_data))
+    x = np.arange(0, input_data.size)
+    new_x = np.arange(0, input_data.size-1, input_data.size/data_size)
+    resampled = interp1d(x, input_data)(new_x)[:data_size]
+    return np.concatenate((resampled, np.full(data_size - len(resampled), resampled[-1])))
+
+
+@pytest.mark.parametrize('path', HOURS, ids=os.path.basename)
+@pytest.mark.parametrize('data_size', [150, 64])
+def test_model_inputs(path, data_size):
+    P_A, Q_A = vectorized(path)[2:4]
+    breaths = [(p, q) for p, q in zip(P_A, Q_A) if len(p) != 0]
+    elastance = Elastance()
+    if data_size == 64:
+        # reconstruction model input: inspiration only
+        pressure = [elastance._seperate_breath(p, np.array(q)/60)[2] for p, q in breaths]
+        flow, offsets = to_ragged([q for _, q in breaths])
+        values, offsets = head_ragged(to_ragged([p for p, _ in breaths])[0], offsets, elastance.inspi_len_batch(flow, offsets))
+    else:
+        pressure = [p for p, _ in breaths]
+        values, offsets = to_ragged(pressure)
+    immatrix = norma_resample_batch(values, offsets, data_size)
+    ref = np.array([norma_resample_per_breath(p, data_size) for p in pressure])
+    np.testing.assert_array_equal(immatrix, ref)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Quantile sketches against np.percentile on the raw values"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import os
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+import pytest
+from matplotlib import cbook
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from utils.sketch import QuantileSketch, SKETCH_DECIMALS, hour_sketches
+from reference import EXAMPLE_HOURS, HOURS, PARAMS, vectorized, breath_arrays
+
+
+@pytest.mark.parametrize('path', HOURS, ids=os.path.basename)
+def test_hour_sketch_quantiles(path):
+    params = breath_arrays(vectorized(path))
+    sketches = hour_sketches(*(params[p] for p in PARAMS))
+    for param in PARAMS:
+        values = params[param][~np.isnan(params[param])]
+        np.testing.assert_allclose(sketches[param].quantile([.05, .25, .50, .75, .95]),
+                                   np.percentile(values, [5, 25, 50, 75, 95]),
+                                   rtol=0, atol=1e-9, err_msg=param)
+        assert sketches[param].min() == values.min()
+        assert sketches[param].max() == values.max()
+
+def test_day_sketch_quantiles():
+    # sketches of every hour merged as for the day summary
+    hours = [breath_arrays(vectorized(path)) for path in EXAMPLE_HOURS]
+    for param in PARAMS:
+        sketch = QuantileSketch.merge_all(QuantileSketch.from_values(h[param], SKETCH_DECIMALS[param]) for h in hours)
+        values = np.concatenate([h[param] for h in hours])
+        values = values[~np.isnan(values)]
+        assert sketch.count() == len(values)
+        np.testing.assert_allclose(sketch.quantile([.05, .25, .50, .75, .95]),
+                                   np.percentile(values, [5, 25, 50, 75, 95]),
+                                   rtol=0, atol=1e-9, err_msg=param)
+
+def assert_box_stats_close(stats, values, decimals, err_msg=''):
+    """Box statistics of a sketch against matplotlib's from the raw values,
+    within the rounding of the sketch"""
+    expected = cbook.boxplot_stats(values)[0]
+    atol = 0.5*10**-decimals + 1e-9
+    for key in ['med', 'q1', 'q3', 'whislo', 'whishi']:
+        np.testing.assert_allclose(stats[key], expected[key], rtol=0, atol=atol, err_msg=f'{err_msg} {key}')
+    assert len(stats['fliers']) == len(expected['fliers']), err_msg
+    np.testing.assert_allclose(np.sort(stats['fliers']), np.sort(expected['fliers']), rtol=0, atol=atol, err_msg=err_msg)
+
+def test_day_box_stats():
+    hours = [breath_arrays(vectorized(path)) for path in EXAMPLE_HOURS]
+    for param in PARAMS:
+        sketch = QuantileSketch.merge_all(QuantileSketch.from_values(h[param], SKETCH_DECIMALS[param]) for h in hours)
+        values = np.concatenate([h[param] for h in hours])
+        assert_box_stats_close(sketch.box_stats(), values[~np.isnan(values)], SKETCH_DECIMALS[param], param)
+
+def test_merged_box_stats_with_fliers():
+    # unrounded values with outliers on both sides, split in uneven chunks.
+    # No value is near the whisker reach, where rounding could move it
+    # across.
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.uniform(20, 40, 5000), [5.123, 6.5, 61.37, 70.01]])
+    rng.shuffle(values)
+    chunks = np.split(values, [7, 1200, 1201, 4000])
+    sketch = QuantileSketch.merge_all(QuantileSketch.from_values(c, 2) for c in chunks)
+    stats = sketch.box_stats()
+    assert len(stats['fliers']) == 4
+    assert_box_stats_close(stats, values, 2)
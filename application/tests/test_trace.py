@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Timing spans, their nesting and the merging of worker spans"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+from concurrent.futures import ProcessPoolExecutor
+import json
+import time
+import os
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import pytest
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from utils import trace
+
+
+def work(seconds):
+    """Traced task of a worker"""
+    with trace.span('work'):
+        time.sleep(seconds)
+        trace.count('items')
+    return seconds
+
+@pytest.fixture
+def tracer(tmp_path):
+    """Tracing on, writing to tmp_path, configuration restored after"""
+    enabled, out_dir = trace.tracer.enabled, trace.tracer.out_dir
+    trace.configure(True, str(tmp_path))
+    yield trace.tracer
+    trace.tracer.enabled, trace.tracer.out_dir = enabled, out_dir
+
+
+def test_off_and_outside_run(tracer):
+    # spans outside a run are not recorded
+    assert tracer.collector() is None
+    assert trace.span('outside') is trace._NULL_SPAN
+    trace.configure(False)
+    with tracer.collect() as collector:
+        assert trace.span('off') is trace._NULL_SPAN
+        trace.count('off')
+    assert collector.data()['events'] == []
+
+def test_nested_self_time(tracer):
+    with tracer.collect() as collector:
+        with trace.span('outer', n=1) as outer:
+            time.sleep(0.02)
+            for _ in range(2):
+                with trace.span('inner'):
+                    time.sleep(0.01)
+            outer.set(m=2)
+        trace.count('items', 3)
+    data = collector.data()
+    stats = data['stats']
+    assert stats['inner'][0] == 2 and stats['outer'][0] == 1
+    assert stats['outer'][2] == pytest.approx(stats['outer'][1] - stats['inner'][1], abs=1e-9)
+    assert stats['outer'][2] >= 0.02
+    assert stats['inner'][1] == pytest.approx(stats['inner'][2])
+    assert data['root'] == pytest.approx(stats['outer'][1])
+    assert data['counters'] == {'items': 3}
+    event, = [e for e in data['events'] if e['name'] == 'outer']
+    assert event['args'] == {'n': 1, 'm': 2}
+
+def test_collect_restores_outer_run(tracer):
+    with tracer.collect() as outer:
+        with trace.span('parent'):
+            with tracer.collect() as inner:
+                with trace.span('separate'):
+                    time.sleep(0.01)
+        assert tracer.collector() is outer
+    assert set(outer.data()['stats']) == {'parent'}
+    assert set(inner.data()['stats']) == {'separate'}
+    # spans of another collector are not children of the open span
+    assert outer.data()['stats']['parent'][2] >= 0.01
+
+def test_merge_serial(tracer):
+    with tracer.collect() as collector:
+        with trace.span('parent'):
+            assert trace.merge(trace.call(True, work, 0.02)) == 0.02
+        # merged at top level, the spans have no parent
+        trace.merge(trace.call(True, work, 0.01))
+    data = collector.data()
+    stats = data['stats']
+    works = [e['dur']/1e6 for e in data['events'] if e['name'] == 'work']
+    assert len(works) == stats['work'][0] == 2
+    assert stats['parent'][2] == pytest.approx(stats['parent'][1] - works[0], abs=1e-9)
+    assert data['root'] == pytest.approx(stats['parent'][1] + works[1])
+    assert trace.call(False, work, 0) == (0, None)
+
+def test_merge_worker_processes(tracer):
+    with tracer.collect() as collector:
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            with trace.span('mechanics'):
+                futures = [pool.submit(trace.call, True, work, 0.05) for _ in range(4)]
+                assert [trace.merge(f.result()) for f in futures] == [0.05]*4
+    data = collector.data()
+    stats = data['stats']
+    assert stats['work'][0] == 4 and data['counters'] == {'items': 4}
+    assert {pid for pid, _ in data['threads']} - {os.getpid()}
+    # worker time, in parallel, is not self time of the parent, which is
+    # clamped at zero when the workers add up to more than its duration
+    calls, total, self_time, _ = stats['mechanics']
+    assert self_time == pytest.approx(max(total - stats['work'][1], 0.0), abs=1e-9)
+    assert data['root'] == pytest.approx(total)
+
+def test_run_writes_trace(tracer, tmp_path):
+    with trace.run('test'):
+        with trace.span('stage'):
+            trace.count('items')
+    path, = tmp_path.glob('trace_test_*.json')
+    with open(str(path)) as f:
+        events = json.load(f)['traceEvents']
+    assert {'test', 'stage', 'items', 'thread_name'} <= {e['name'] for e in events}
+    assert tracer.collector() is None
@@ -23,27 +23,30 @@
 # =============================================================================
 # Standard library imports
 # =============================================================================
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from dataclasses import replace
+from datetime import datetime
+import threading
 import logging
-import json
 
 #==============================================================================
 # Third-party imports
 #==============================================================================
 from PyQt5 import QtCore
 from PyQt5.QtCore import pyqtSignal, QSettings
-from PyQt5.QtSql import QSqlQuery
 from PyQt5 import QtCore
 import numpy as np
-from matplotlib.dates import DateFormatter
-from keras import backend as K
+from matplotlib.dates import DateFormatter, date2num
 
 #==============================================================================
 # Local application imports
 #==============================================================================
-from utils.calculations import Elastance, _calcQuartiles
-from utils.AI import get_current_model, AIpredict, load_Recon_Model, recon
-from utils.data_base import save_db_hour
+from core.engine import AnalysisEngine, split_fname
+from core.storage import SqliteStorage
+from utils.calculations import _calcQuartiles
+from utils.sketch import QuantileSketch, SKETCH_DECIMALS, hour_sketches
+from utils.decimate import minmax_indices, minmax_pyramid, pyramid_view
+from utils import trace
 
 #==============================================================================
 # Setup Logging
@@ -52,6 +55,55 @@ from utils.data_base import save_db_hour
 logger = logging.getLogger(__name__)
 logger.info('Thread module imported')
 
+# Fewest buckets of the decimated line plot, used before the canvas is sized
+LOD_MIN_BUCKETS = 1000
+
+# Plot series of the last hours shown, by filename, with the version of the
+# stored hour they were made from, see HourlyView.plot_data
+PLOT_CACHE_SIZE = 8
+_plot_cache = OrderedDict()
+_plot_cache_lock = threading.Lock()
+
+# Progress bar value of each analysis stage
+PROGRESS_PCT = {'fetch': 80, 'mechanics': 20, 'classification': 70, 'reconstruction': 80, 'save': 90, 'summary': 90}
+
+def build_plot_data(hour, P, Q, E, PEEP_A, b_len, P_pyr=None, Q_pyr=None):
+    """Sample resolution series of the Hourly View line plot, see
+    HourlyView.plot_data. P and Q may be None when both pyramids are given,
+    they are then loaded on first zoom past the finest pyramid level."""
+    # x values are matplotlib dates of samples at 50 Hz from start of hour
+    t0 = date2num(datetime.strptime(hour, "%H-%M-%S"))
+    dt = 0.02/86400
+    b_len = np.asarray(b_len, dtype=np.int64)
+    if P is not None:
+        P, Q = np.asarray(P, dtype=np.float64), np.asarray(Q, dtype=np.float64)
+    data = {
+        't0': t0,
+        'dt': dt,
+        'x': t0 + np.arange(int(b_len.sum()))*dt,
+        'P': P,
+        'Q': Q,
+        # Extend plot params according to breath length for plotting
+        'Ers': np.repeat(np.asarray(E, dtype=np.float64), b_len),
+        'PEEP': np.repeat(np.asarray(PEEP_A, dtype=np.float64), b_len),
+        'P_pyr': P_pyr or minmax_pyramid(P),
+        'Q_pyr': Q_pyr or minmax_pyramid(Q),
+    }
+    return data
+
+def cached_plot_data(fname, version):
+    """Plot data of an hour shown recently, see HourlyView.plot_data, or
+    None. Data made from another version of the stored hour, which was
+    saved again since, is dropped."""
+    with _plot_cache_lock:
+        data = _plot_cache.get(fname)
+        if data is not None and data['version'] != version:
+            del _plot_cache[fname]
+            data = None
+        if data is not None:
+            _plot_cache.move_to_end(fname)
+        return data
+
 class HourlyView(QtCore.QObject):
     finished    = pyqtSignal()
     done        = pyqtSignal()
@@ -63,142 +115,103 @@ class HourlyView(QtCore.QObject):
     status      = pyqtSignal(int)
     run_token   = True
 
-    def __init__(self,fname,db,ui):
+    def __init__(self,fname,ui):
         super(HourlyView, self).__init__()
         self.fname = fname
-        self.db = db
         self.ui = ui
         self.hour = self.fname.split('/')[-1].replace('.txt','').split('_')[3]
-        self.model_name = None
         self.settings = QSettings()
+        self.storage = SqliteStorage()
 
     def run(self):
         """Run Hourly View module thread"""
-        logging.info('Running run() funtion in Hourly View worker ...')
-        logging.info(f'Current filename: {self.fname}')
-        self.open_pbar.emit()
-        fname = self.fname.replace('.txt','')
-        p_no = str(fname.split('_')[1])
-        date = str(fname.split('_')[2])
-        hour = str(fname.split('_')[3])
-
-        try:
-            P, Q, Ers, Rrs, b_count, b_type, PEEP_A, PIP_A, TV_A, DP_A, AImag, b_num_all, b_len, debug = self.fetch_db()
-            self.update_pbar.emit(80,'Fetching data from database...')
-        except Exception as e:
-            logger.info(f'Initiating calculation...{e}')
-            self.update_pbar.emit(10,'Initiating calculation...')
-            self.update_pbar.emit(50,'Loading model ...')
-            
-        # Calculate respiratory mechanics and save results in db
-            P, Q, Ers, Rrs, b_count, b_type, PEEP_A, PIP_A, TV_A, DP_A, AImag, b_num_all, b_len, debug = self.calc_RM()
-            if self.settings.value('saveDB', True, type=bool) == True:
-                save_db_hour(self.db, P, Q, Ers, Rrs, b_count, b_type, PEEP_A, PIP_A, TV_A, DP_A, AImag, b_num_all, b_len, p_no, date, hour, debug)
-        
-        self.done.emit()
-        self.update_pbar.emit(90,'Populating Graphics...')
-        self.ui.label_breath_no.setText(str(b_count))
-
-        # Plot line, box, pie chart; populate resp table
-        self.plot_line(P, Q, Ers, Rrs, PEEP_A, b_num_all, b_len)
-        self.plot_box(Ers, Rrs, PEEP_A, PIP_A, TV_A, DP_A, AImag)
-        self.plot_pie(b_type)
-
-        # Emit signals
-        self.printDebug.emit(debug, b_count)
-        self.writeTable.emit(_calcQuartiles(Ers, Rrs, PEEP_A, PIP_A, TV_A, DP_A))
-        self.update_pbar.emit(100,'Processing Done...')
-        self.update_UI.emit(p_no,date,hour)
-        self.finished.emit()
-
-    def calc_RM(self):
-        """Calculate respiratory mechanics."""
-        self.update_pbar.emit(20,'Calculating respiratory mechanics...')
-        logger.info('_calc_ER run')
-        
-        P, Q, P_A, Q_A, Ers_A, Rrs_A, b_count, PEEP_A, PIP_A, TV_A, DP_A, b_num_all, b_len, debug = Elastance().calcRespMechanics(self.fname)
-        b_type = self._get_prediction(P_A, b_count)
-        AImag = self._get_recon(P_A, Q_A)
-
-        self.update_pbar.emit(90,'Calculation complete. Processing data...')
-        return P, Q, Ers_A, Rrs_A, b_count, b_type, PEEP_A, PIP_A, TV_A, DP_A, AImag, b_num_all, b_len, debug
-
-    def _get_prediction(self, pressure, b_count):
-        
-        self.update_pbar.emit(60,'Starting breath prediction...')
-        now_count = 0
-        b_type = []
-        
-        logger.info(f'Loading prediction model...')
-        self.update_pbar.emit(70,f'Loading prediction model...')
-        K.clear_session() # Clear keras backend last session to prevent crash
-        self.model_name, self.PClassiModel = get_current_model()
-
-        for p in pressure:
-            now_count += 1
-            progress = int((now_count/b_count)*100)
-            self.update_pbar.emit(progress,'Predicting breath ...')
-            if p == []:
-                b_type.append(np.nan)
-            else:
+        with trace.run('hourly_view'):
+            logging.info('Running run() funtion in Hourly View worker ...')
+            logging.info(f'Current filename: {self.fname}')
+            self.open_pbar.emit()
+            fname = self.fname.replace('.txt','')
+            p_no = str(fname.split('_')[1])
+            date = str(fname.split('_')[2])
+            hour = str(fname.split('_')[3])
+
+            # Hours shown recently come from the plot cache, others from db,
+            # or calculated and saved in db. Samples of a saved hour are only
+            # read when zoomed in, see _update_lod
+            data = cached_plot_data(self.fname, self.storage.hour_version(p_no, date, hour))
+            if data is None:
+                engine = AnalysisEngine(SqliteStorage(), save=self.settings.value('saveDB', True, type=bool))
                 try:
-                    b_type.append(AIpredict(p, self.PClassiModel))
-                except:
-                    b_type.append(np.nan)
-
-        logger.info('Breath recon prediction completed.')
-        
-        return b_type
-
-    def _get_recon(self, pressure, flow):
-
-        AImag = []
-        logger.info(f'Loading recon model...')
-        self.update_pbar.emit(70,f'Loading recon model...')
-        reconModel = load_Recon_Model()
-
-        logger.info(f'Starting breath recon ...')
-        self.update_pbar.emit(80,f'Starting breath recon ...')
-
-        for idx, p in enumerate(pressure):
-            if p == []:
-                AImag.append(np.nan)
-            else:
-                q = flow[idx]
-                AImag.append(recon(q, p, reconModel))
-        
-        logger.info('Breath recon prediction completed.')
-        return AImag
-
-    def plot_line(self, P, Q, E, R, PEEP_A, b_num_all, b_len):
-        """Plot line plot with data from thread"""
+                    r = engine.hour(self.fname, progress=self.report_progress, samples=False)
+                finally:
+                    engine.close()
+                    engine.storage.close()
+                data = self.plot_data(r, self.storage.hour_version(p_no, date, hour))
+            r = data['result']
+            Ers, Rrs, b_count, b_type = r.Ers, r.Rrs, r.b_count, r.b_type
+            PEEP_A, PIP_A, TV_A, DP_A, AImag, b_num_all, b_len, debug = r.PEEP, r.PIP, r.TV, r.DP, r.AImag, r.b_num_all, r.b_len, r.debug
+
+            self.done.emit()
+            self.update_pbar.emit(90,'Populating Graphics...')
+            self.ui.label_breath_no.setText(str(b_count))
+
+            # Plot line, box, pie chart; populate resp table
+            self.plot_line(data, b_num_all, b_len)
+            self.plot_box(Ers, Rrs, PEEP_A, PIP_A, TV_A, DP_A, AImag)
+            self.plot_pie(b_type)
+            # a short hour reads its samples for the first view, on this thread
+            self.storage.close()
+
+            # Emit signals
+            self.printDebug.emit(debug, b_count)
+            self.writeTable.emit(_calcQuartiles(Ers, Rrs, PEEP_A, PIP_A, TV_A, DP_A))
+            self.update_pbar.emit(100,'Processing Done...')
+            self.update_UI.emit(p_no,date,hour)
+            self.finished.emit()
+
+    def report_progress(self, event):
+        """Show a ProgressEvent of the analysis engine on the progress bar"""
+        logger.info(f'{event.stage}: {event.message}')
+        if event.stage == 'classification' and event.total:
+            self.update_pbar.emit(int((event.done/event.total)*100), event.message)
+        else:
+            self.update_pbar.emit(PROGRESS_PCT[event.stage], event.message)
+
+    @trace.traced()
+    def plot_line(self, data, b_num_all, b_len):
+        """Plot line plot with data from thread
+
+        Lines are drawn from a min/max decimated view of the samples in the
+        visible x-range, recomputed when the user zooms or pans. Pressure and
+        flow views at 1 s resolution or coarser come from the min/max
+        pyramid saved with the hour (built here when missing), finer ones
+        from the full resolution data, read from the database on the first
+        such zoom when P and Q are None.
+        """
         # format time x-axis
         formatter = DateFormatter('%H:%M:%S')
-        x = [datetime.strptime(self.hour, "%H-%M-%S")]
-        for i in range(1,len(P)):
-            x.append(x[i-1]+ timedelta(milliseconds=20))
-
-        import time
-        start = time.process_time()
-
-        # Extend plot params according to breath length for plotting
-        Ers, PEEP = [], []
-        for i in range(len(b_len)):
-            Ers.extend([E[i] for x in range(b_len[i])])
-            PEEP.extend([PEEP_A[i] for x in range(b_len[i])])
-            
-        logger.info(f'Time used to extend plot params: {time.process_time() - start}')
 
         # plot lines
-        line1, = self.ui.graphWidget.canvas.ax.plot(x, P, label='Pressure')
-        line2, = self.ui.graphWidget.canvas.ax.plot(x, Q, label='Flow')
-        line3, = self.ui.graphWidget.canvas.ax.plot(x, Ers, label='Ers')
-        line4, = self.ui.graphWidget.canvas.ax.plot(x, PEEP, label='PEEP')
-        self.ui.graphWidget.canvas.ax.tick_params(axis = 'both', which = 'major', labelsize = 14)
-        self.ui.graphWidget.canvas.ax.axhline(0, color='grey', linewidth=0.8)
-        self.ui.graphWidget.canvas.ax.xaxis.set_major_formatter(formatter)
-        leg = self.ui.graphWidget.canvas.ax.legend(fancybox=True, loc ="upper right")
+        self.t0, self.dt, self.lod_x = data['t0'], data['dt'], data['x']
+        self.lod_series = [data['P'], data['Q'], data['Ers'], data['PEEP']]
+        self.lod_pyramids = [data['P_pyr'], data['Q_pyr'], None, None]
+        ax = self.ui.graphWidget.canvas.ax
+        line1, = ax.plot([], [], label='Pressure')
+        line2, = ax.plot([], [], label='Flow')
+        line3, = ax.plot([], [], label='Ers')
+        line4, = ax.plot([], [], label='PEEP')
+        self.lod_lines = [line1, line2, line3, line4]
+        n_samples = len(self.lod_x)
+        self._update_lod(0, n_samples)
+        ax.set_xlim(self.t0, self.t0 + max(n_samples - 1, 1)*self.dt)
+        ylim = self._lod_ylim()
+        if ylim is not None:
+            ax.set_ylim(ylim)
+        ax.tick_params(axis = 'both', which = 'major', labelsize = 14)
+        ax.axhline(0, color='grey', linewidth=0.8)
+        ax.xaxis.set_major_formatter(formatter)
+        leg = ax.legend(fancybox=True, loc ="upper right")
         line4.set_visible(False)
+        ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
         self.ui.graphWidget.canvas.draw()
 
         # configure legend to show/hide when clicked
@@ -213,15 +226,92 @@ class HourlyView(QtCore.QObject):
         # Annotate will significantly slow down plotting performance
         annot = False
         if annot:
-            if b_num_all != []:
-                x_annotate = [datetime.strptime(self.hour, "%H-%M-%S")]
-                
-                for i in range(len(b_len)-1):
-                    x_annotate.append(x_annotate[i]+timedelta(milliseconds=20*b_len[i]))
+            if len(b_num_all) != 0:
+                x_annotate = self.t0 + np.concatenate(([0], np.cumsum(b_len[:-1])))*self.dt
                 
                 for i, x in enumerate(x_annotate):
                     annot = self.ui.graphWidget.canvas.ax.annotate(b_num_all[i], xy=(x,1), xytext=(0,2),textcoords="offset points")
     
+    @trace.traced()
+    def plot_data(self, r, version):
+        """Sample resolution series of the line plot, cached per hour
+
+        Args:
+            r (HourResult): results of the hour, P and Q None if not read yet
+            version: version of the stored hour, see Storage.hour_version,
+                None if not stored
+
+        Returns:
+            data (dict): t0 and dt (matplotlib dates), x, P, Q, Ers, PEEP
+                arrays, pyramids of pressure and flow, the results without
+                their samples and the version
+        """
+        P_pyr, Q_pyr = (r.pyramids['P'], r.pyramids['Q']) if r.pyramids else ({}, {})
+        data = build_plot_data(self.hour, r.P, r.Q, r.Ers, r.PEEP, r.b_len, P_pyr, Q_pyr)
+        data['result'] = replace(r, P=None, Q=None, pressure=None, flow=None)
+        data['version'] = version
+        with _plot_cache_lock:
+            _plot_cache[self.fname] = data
+            while len(_plot_cache) > PLOT_CACHE_SIZE:
+                _plot_cache.popitem(last=False)
+        return data
+
+    def _update_lod(self, start, stop):
+        """Set line data to a screen resolution view of samples start:stop"""
+        n_buckets = max(self.ui.graphWidget.canvas.width(), LOD_MIN_BUCKETS)
+        per_bucket = (min(stop, len(self.lod_x)) - max(start, 0))/n_buckets
+        for i, (line, pyramid) in enumerate(zip(self.lod_lines, self.lod_pyramids)):
+            levels = [level for level in (pyramid or {}) if level <= per_bucket]
+            if levels:
+                level = max(levels)
+                x, y_view = pyramid_view(*pyramid[level], level, start, stop)
+                line.set_data(self.t0 + x*self.dt, y_view)
+            else:
+                if self.lod_series[i] is None:
+                    self._load_samples()
+                y = self.lod_series[i]
+                idx = minmax_indices(y, start, stop, n_buckets)
+                line.set_data(self.lod_x[idx], y[idx])
+
+    def _load_samples(self):
+        """Read the pressure and flow samples of the hour from the database,
+        on the first zoom past the finest pyramid level"""
+        p_no, date, hour = split_fname(self.fname)
+        samples = self.storage.fetch_samples(p_no, date, hour)
+        if samples is None:
+            raise RuntimeError(f'Samples of {p_no} {date} {hour} not in database')
+        # Fixed-point samples are scaled here, in their one float64 copy
+        *samples, scale = samples
+        P, Q = (np.true_divide(y, scale, dtype=np.float64) for y in samples)
+        self.lod_series[0], self.lod_series[1] = P, Q
+        with _plot_cache_lock:
+            data = _plot_cache.get(self.fname)
+            if data is not None:
+                data['P'], data['Q'] = P, Q
+
+    def _lod_ylim(self):
+        """y-range of all samples, with a 5% margin. Pressure and flow come
+        from the coarsest level of their pyramid, which holds the same
+        extremes. None when there is no finite sample, the current y-range
+        is then kept."""
+        ranges = [(y, y) for y in self.lod_series[2:]]
+        ranges += [pyramid[max(pyramid)] for pyramid in self.lod_pyramids[:2] if pyramid]
+        ranges = [(mins, maxs) for mins, maxs in ranges if np.isfinite(mins).any()]
+        if not ranges:
+            return None
+        lo = min(np.nanmin(mins) for mins, _ in ranges)
+        hi = max(np.nanmax(maxs) for _, maxs in ranges)
+        margin = (hi - lo)*0.05
+        return lo - margin, hi + margin
+
+    def on_xlim_changed(self, ax):
+        # On zoom or pan, re-fetch full resolution data of the visible range
+        lo, hi = ax.get_xlim()
+        start = int(np.floor((lo - self.t0)/self.dt))
+        stop = int(np.ceil((hi - self.t0)/self.dt)) + 1
+        self._update_lod(start, stop)
+        self.ui.graphWidget.canvas.draw_idle()
+
     def on_pick(self,event):
         # On the pick event, find the original line corresponding to the legend
         # proxy line, and toggle its visibility.
@@ -234,19 +324,22 @@ class HourlyView(QtCore.QObject):
         legline.set_alpha(1.0 if visible else 0.2)
         self.ui.graphWidget.canvas.draw()
 
+    @trace.traced()
     def plot_box(self, E, R, PEEP_A, PIP_A, TV_A, DP_A, AImag):
-        rm_nan = lambda input: [a for a in input if not np.isnan(a)] 
-        """Plot data from thread"""
-        box1 = self.ui.boxGraphWidget.canvas.ax1.boxplot( rm_nan(E), labels=['Ers'])
-        box2 = self.ui.boxGraphWidget.canvas.ax2.boxplot( rm_nan(R), labels=['Rrs'])
-        box3 = self.ui.boxGraphWidget.canvas.ax3.boxplot( rm_nan(PEEP_A), labels=['PEEP'])
-        box4 = self.ui.boxGraphWidget.canvas.ax4.boxplot( rm_nan(PIP_A), labels=['PIP'])
-        box5 = self.ui.boxGraphWidget.canvas.ax5.boxplot( rm_nan(TV_A), labels=[r'$V_t$'])
-        box6 = self.ui.boxGraphWidget.canvas.ax6.boxplot( rm_nan(DP_A), labels=['PIP-PEEP'])
-        box7 = self.ui.AMBoxWidget.canvas.ax.boxplot( rm_nan(AImag), labels=['Masyn'])
+        """Plot data from thread, with box statistics from quantile sketches"""
+        sketches = hour_sketches(E, R, PEEP_A, PIP_A, TV_A, DP_A)
+        sketches['AImag'] = QuantileSketch.from_values(AImag, SKETCH_DECIMALS['AImag'])
+        box1 = self.ui.boxGraphWidget.canvas.ax1.bxp([sketches['Ers'].box_stats(label='Ers')])
+        box2 = self.ui.boxGraphWidget.canvas.ax2.bxp([sketches['Rrs'].box_stats(label='Rrs')])
+        box3 = self.ui.boxGraphWidget.canvas.ax3.bxp([sketches['PEEP'].box_stats(label='PEEP')])
+        box4 = self.ui.boxGraphWidget.canvas.ax4.bxp([sketches['PIP'].box_stats(label='PIP')])
+        box5 = self.ui.boxGraphWidget.canvas.ax5.bxp([sketches['TV'].box_stats(label=r'$V_t$')])
+        box6 = self.ui.boxGraphWidget.canvas.ax6.bxp([sketches['DP'].box_stats(label='PIP-PEEP')])
+        box7 = self.ui.AMBoxWidget.canvas.ax.bxp([sketches['AImag'].box_stats(label='Masyn')])
         self.ui.boxGraphWidget.canvas.draw()
         self.ui.AMBoxWidget.canvas.draw()
 
+    @trace.traced()
     def plot_pie(self,b_type):
         
         Asyn = b_type.count('Asyn')
@@ -279,35 +372,5 @@ class HourlyView(QtCore.QObject):
         self.ui.pieGraphWidget.canvas.ax.legend(labels,fancybox=True, bbox_to_anchor=(0.85,1.025), loc="upper left")
         self.ui.pieGraphWidget.canvas.draw()
         
-    def fetch_db(self):
-        fname = self.fname.replace('.txt','')
-        p_no = str(fname.split('_')[1])
-        date = str(fname.split('_')[2])
-        hour = str(fname.split('_')[3])
-        query = QSqlQuery(self.db)
-        query.exec(f"""SELECT p, q, Ers_raw, Rrs_raw, b_count, b_type, b_num_all, b_len, debug,
-                        PEEP_raw, PIP_raw, TV_raw, DP_raw, AM_raw  FROM results 
-                        WHERE p_no='{p_no}' AND date='{date}' AND hour='{hour}';
-                        """)
-        if query.next():
-            query.first()
-            P         = json.loads(query.value(0))
-            Q         = json.loads(query.value(1))
-            Ers       = json.loads(query.value(2))
-            Rrs       = json.loads(query.value(3))
-            b_count   = query.value(4)
-            b_type    = json.loads(query.value(5))
-            b_num_all = json.loads(query.value(6))
-            b_len     = json.loads(query.value(7))
-            debug     = json.loads(query.value(8))
-            PEEP_A    = json.loads(query.value(9))
-            PIP_A     = json.loads(query.value(10))
-            TV_A      = json.loads(query.value(11))
-            DP_A      = json.loads(query.value(12))
-            AImag     = json.loads(query.value(13))
-            logger.info("DB entry retrieved successful")
-            return P, Q, Ers, Rrs, b_count, b_type, PEEP_A, PIP_A, TV_A, DP_A, AImag, b_num_all, b_len, debug
-        else:
-            raise Exception
 
     
\ No newline at end of file
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Model Warm Up module."""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import threading
+import logging
+import time
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+from PyQt5 import QtCore
+from PyQt5.QtCore import pyqtSignal
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from utils.AI import registry
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+
+
+class ModelWarmUp(QtCore.QObject):
+    """Load both models and run a dummy batch through each in the background
+
+    Models are shared through utils.AI.registry, whose lock makes an analysis
+    started mid warm-up wait for the model being loaded instead of loading
+    it a second time.
+    """
+    finished = pyqtSignal()
+
+    def __init__(self):
+        super(ModelWarmUp, self).__init__()
+        self._cancel = threading.Event()
+
+    def run(self):
+        """Run Model Warm Up worker"""
+        start = time.perf_counter()
+        try:
+            registry.warm_up(cancel=self._cancel)
+            if not self._cancel.is_set():
+                logger.info(f'Model warm up done in {time.perf_counter() - start:.2f} s')
+        except Exception:
+            # models are loaded again, with error reporting, by the analysis
+            logger.exception('Model warm up failed')
+        self.finished.emit()
+
+    def cancel(self):
+        """Stop before loading the next model or before the dummy prediction
+        of a model just loaded, a model load in progress is completed"""
+        self._cancel.set()
@@ -42,11 +42,13 @@ import matplotlib.pyplot as plt
 #==============================================================================
 from threads.PatientOverview import PatientOverview
 from threads.HourlyView import HourlyView
+from threads.ModelWarmUp import ModelWarmUp
 from ui.ui_main import Ui_MainWindow
 from ui.about_dialog import AboutDialog
 from ui.settings_dialog import SettingsDialog
 from ui.stacked_pbar import StackedProgressBar
 from ui.pbar import PopUpProgressBar
+from utils.data_base import connections
 
 #==============================================================================
 # Setup Logging
@@ -57,6 +59,9 @@ logger = logging.getLogger(__name__)
 # set mpl figure font size
 plt.rcParams.update({'font.size': 12})
 
+# Longest wait for the model warm up thread when closing, in ms
+WARM_UP_STOP_TIMEOUT = 500
+
 class MainWindow(QMainWindow):
     def __init__(self,db):
         super(MainWindow, self).__init__()
@@ -94,6 +99,49 @@ class MainWindow(QMainWindow):
             self.ui.tableWidget.horizontalHeaderItem(i).setText(labels[i])
             self.ui.tableWidget_2.horizontalHeaderItem(i).setText(labels[i])
 
+    def start_warm_up(self):
+        """Start low priority background loading of the prediction models"""
+        self.warmUp = ModelWarmUp()
+        self.warmUp_thread = QThread()
+        self.warmUp_thread.setObjectName('ModelWarmUpThread')
+        self.warmUp.moveToThread(self.warmUp_thread)
+        self.warmUp_thread.started.connect(self.warmUp.run)
+        self.warmUp.finished.connect(self.warmUp_thread.quit)
+        self.warmUp_thread.start(QThread.LowestPriority)
+        logger.info('Model warm up thread started')
+
+    def stop_warm_up(self, timeout=WARM_UP_STOP_TIMEOUT):
+        """Cancel the model warm up and wait for its thread to exit
+
+        Args:
+            timeout (int): longest wait in ms, a model load in progress
+                cannot be interrupted
+
+        Returns:
+            bool: True when the thread is not running
+        """
+        if getattr(self, 'warmUp_thread', None) is None or not self.warmUp_thread.isRunning():
+            return True
+        self.warmUp.cancel()
+        self.warmUp_thread.quit()
+        if not self.warmUp_thread.wait(timeout):
+            logger.info('Model warm up thread still loading a model')
+            return False
+        logger.info('Model warm up thread stopped')
+        return True
+
+    def closeEvent(self, event):
+        # Rather than blocking the GUI until a model load completes, hide
+        # the window and close it again once the warm up thread exits
+        if not self.stop_warm_up():
+            self.hide()
+            if not getattr(self, 'close_on_warm_up_exit', False):
+                self.warmUp_thread.finished.connect(self.close)
+                self.close_on_warm_up_exit = True
+            event.ignore()
+            return
+        super(MainWindow, self).closeEvent(event)
+
     def open_fname_dialog(self):
         """Dialog to select filename
            Link to: Hourly View module (def self.start_HV_analysis())
@@ -122,7 +170,7 @@ class MainWindow(QMainWindow):
     def start_HV_analysis(self,**kwargs):
         """Start Hourly View analysis thread"""
         self.ui.statusBar.showMessage("Processing Data")
-        self.HVWorker = HourlyView(fname=self.fname_full_path,db=self.db,ui=self.ui)
+        self.HVWorker = HourlyView(fname=self.fname_full_path,ui=self.ui)
         self.HVWorker_thread = QThread()
         self.HVWorker.setObjectName('HourlyView')
         self.HVWorker_thread.setObjectName('HourlyViewThread')
@@ -150,7 +198,7 @@ class MainWindow(QMainWindow):
 
         # if fileList is not empty
         if len(files_filtered) != 0:
-            self.postP = PatientOverview(fname=files_filtered,dirSelected=self.dirSelected,db=self.db,ui=self.ui)
+            self.postP = PatientOverview(fname=files_filtered,dirSelected=self.dirSelected,ui=self.ui)
             self.postP_thread = QThread()
             self.postP.moveToThread(self.postP_thread)
             self.postP_thread.started.connect(self.postP.run)
@@ -257,7 +305,7 @@ class MainWindow(QMainWindow):
         
         logger.info(f'User selected export csv filename: {name}')
         if name != "":
-            query = QSqlQuery(self.db)
+            query = QSqlQuery(connections.connection(readonly=True))
             query.exec(f"""SELECT p_no, date, hour, b_count,
                             Ers_min,   Ers_max,  Ers_q5,  Ers_q25,  Ers_q50,  Ers_q75,  Ers_q95,
                             Rrs_min,   Rrs_max,  Rrs_q5,  Rrs_q25,  Rrs_q50,  Rrs_q75,  Rrs_q95,
@@ -310,7 +358,7 @@ class MainWindow(QMainWindow):
         name, _ = QFileDialog.getSaveFileName(self, 'Save File', date,"Comma Seperated values (*.csv)")
         logger.info(f'User selected export csv filename: {name}')
         if name != "":
-            query = QSqlQuery(self.db)
+            query = QSqlQuery(connections.connection(readonly=True))
             query.exec(f"""SELECT p_no, date, hour, b_count,
                             Ers_min,   Ers_max,  Ers_q5,  Ers_q25,  Ers_q50,  Ers_q75,  Ers_q95,
                             Rrs_min,   Rrs_max,  Rrs_q5,  Rrs_q25,  Rrs_q50,  Rrs_q75,  Rrs_q95,
@@ -25,6 +25,7 @@ from PyQt5.QtCore import QSettings
 from PyQt5.QtWidgets import QPushButton, QVBoxLayout, QMessageBox
 from PyQt5.QtWidgets import QApplication, QWidget
 import sys
+import os
 import logging
 
 # For test
@@ -82,6 +83,10 @@ class SettingsDialog(QtWidgets.QDialog):
             self.settings.setValue('saveDB',True)
             self.ui.saveDBTrue.setChecked(True)
 
+        # Default to one worker process per CPU core
+        self.ui.workersSpinBox.setValue(self.settings.value('workers', os.cpu_count() or 1, type=int))
+        self.ui.traceCheckBox.setChecked(self.settings.value('trace', False, type=bool))
+
         
     def saveSettings(self,key,value):
         self.settings.setValue(key,value)
@@ -95,6 +100,12 @@ class SettingsDialog(QtWidgets.QDialog):
             self.settings.setValue('saveDB',False)
             logger.info(f'Save DB set: False')
 
+        self.settings.setValue('workers',self.ui.workersSpinBox.value())
+        logger.info(f'Worker processes set: {self.ui.workersSpinBox.value()}')
+
+        self.settings.setValue('trace',self.ui.traceCheckBox.isChecked())
+        logger.info(f'Trace set: {self.ui.traceCheckBox.isChecked()}')
+
         QMessageBox.information(None, ("Information"),
                                     ("Settings saved successfully.\n"
                                      "Please restart application for changes to take effect."
@@ -30,7 +30,7 @@ class Ui_SettingsDialog(object):
         self.horizontalLayout.setObjectName("horizontalLayout")
         self.gridLayout.addLayout(self.horizontalLayout, 0, 1, 1, 1)
         spacerItem = QtWidgets.QSpacerItem(20, 30, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.MinimumExpanding)
-        self.gridLayout.addItem(spacerItem, 2, 0, 1, 1)
+        self.gridLayout.addItem(spacerItem, 4, 0, 1, 1)
         self.label_2 = QtWidgets.QLabel(self.gridLayoutWidget)
         self.label_2.setObjectName("label_2")
         self.gridLayout.addWidget(self.label_2, 1, 0, 1, 1)
@@ -47,6 +47,20 @@ class Ui_SettingsDialog(object):
         self.btn_group_saveDB.addButton(self.saveDBFalse)
         self.horizontalLayout_2.addWidget(self.saveDBFalse)
         self.gridLayout.addLayout(self.horizontalLayout_2, 1, 1, 1, 1)
+        self.label_3 = QtWidgets.QLabel(self.gridLayoutWidget)
+        self.label_3.setObjectName("label_3")
+        self.gridLayout.addWidget(self.label_3, 2, 0, 1, 1)
+        self.workersSpinBox = QtWidgets.QSpinBox(self.gridLayoutWidget)
+        self.workersSpinBox.setMinimum(1)
+        self.workersSpinBox.setMaximum(64)
+        self.workersSpinBox.setObjectName("workersSpinBox")
+        self.gridLayout.addWidget(self.workersSpinBox, 2, 1, 1, 1)
+        self.label_4 = QtWidgets.QLabel(self.gridLayoutWidget)
+        self.label_4.setObjectName("label_4")
+        self.gridLayout.addWidget(self.label_4, 3, 0, 1, 1)
+        self.traceCheckBox = QtWidgets.QCheckBox(self.gridLayoutWidget)
+        self.traceCheckBox.setObjectName("traceCheckBox")
+        self.gridLayout.addWidget(self.traceCheckBox, 3, 1, 1, 1)
 
         self.retranslateUi(SettingsDialog)
         self.buttonBox.accepted.connect(SettingsDialog.accept)
@@ -59,3 +73,7 @@ class Ui_SettingsDialog(object):
         self.label_2.setText(_translate("SettingsDialog", "Save Results to DB"))
         self.saveDBTrue.setText(_translate("SettingsDialog", "True"))
         self.saveDBFalse.setText(_translate("SettingsDialog", "False"))
+        self.label_3.setToolTip(_translate("SettingsDialog", "Number of processes used to analyse hour files in Patient Overview"))
+        self.label_3.setText(_translate("SettingsDialog", "Worker Processes"))
+        self.label_4.setToolTip(_translate("SettingsDialog", "Write a timing trace of each analysis run to the traces folder"))
+        self.label_4.setText(_translate("SettingsDialog", "Trace Analysis"))
@@ -26,19 +26,26 @@ AI module.
 # =============================================================================
 # Standard library imports
 # =============================================================================
+import threading
 import logging
 import random
+import time
+import sys
 import os
 
 #==============================================================================
 # Third-party imports
 #==============================================================================
-from keras.preprocessing.sequence import pad_sequences
-from keras.models import load_model
-from scipy.interpolate import interp1d
-from scipy import trapz
+# keras (TensorFlow) and scipy are imported on first use, see _load_model
 import numpy as np
 
+#==============================================================================
+# Local application imports
+#==============================================================================
+from .calculations import Elastance
+from .preprocessing import to_ragged, head_ragged, norma_resample_batch
+from . import trace
+
 #==============================================================================
 # Setup Logging
 #==============================================================================
@@ -46,57 +53,162 @@ import numpy as np
 logger = logging.getLogger(__name__)
 base_path = os.path.abspath(os.path.dirname(__file__))
 
+# Number of breaths sent to the models per predict call
+PREDICT_BATCH_SIZE = 512
+
+CLASSI_MODEL_NAME = 'CNNPressureClassificationModel.hdf5'
+RECON_MODEL_NAME = 'ABReCAPressureFlowReconstructionModel.hdf5'
+
+
+class ModelRegistry():
+    """Thread-safe cache of the trained Keras models.
+
+    Models are loaded once per process and handed out to every caller.
+    Each entry is keyed by a version made of the model file name,
+    modification time and size, so a model is only reloaded when its
+    file changes on disk.
+    """
+
+    def __init__(self, model_dir):
+        self.model_dir = model_dir
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def path(self, model_name):
+        return os.path.join(self.model_dir, model_name)
+
+    def version(self, model_name):
+        """Versioned key of a model file: (name, mtime_ns, size)"""
+        st = os.stat(self.path(model_name))
+        return (model_name, st.st_mtime_ns, st.st_size)
+
+    def get(self, model_name, cancel=None):
+        """Return the loaded model, loading it if missing or out of date
+
+        A newly loaded model runs one dummy prediction, under the lock and
+        before any caller gets it, so that the first real prediction does
+        not pay for building the predict function.
+
+        Args:
+            model_name (str): file name of the model in model_dir
+            cancel (threading.Event): once set, a missing model is not
+                loaded and None is returned, and a model just loaded skips
+                its dummy prediction
+
+        Returns:
+            model: Keras model
+        """
+        version = self.version(model_name)
+        with self._lock:
+            entry = self._models.get(model_name)
+            if entry is None or entry[0] != version:
+                if cancel is not None and cancel.is_set():
+                    return None
+                logger.info(f'Loading model {model_name}...')
+                model = _load_model(self.path(model_name))
+                if cancel is None or not cancel.is_set():
+                    shape = [1 if d is None else d for d in model.input_shape]
+                    model.predict(np.zeros(shape))
+                entry = (version, model)
+                self._models[model_name] = entry
+                logger.info(f'Model {model_name} loaded successfully.')
+        return entry[1]
+
+    def warm_up(self, model_names=(CLASSI_MODEL_NAME, RECON_MODEL_NAME), cancel=None):
+        """Load and warm up models ahead of the first analysis, see get()
+
+        Args:
+            model_names (tuple): file names of the models to warm up
+            cancel (threading.Event): stop at the next step once set, a
+                model load in progress cannot be interrupted
+        """
+        for model_name in model_names:
+            self.get(model_name, cancel=cancel)
+            if cancel is not None and cancel.is_set():
+                logger.info('Model warm up cancelled.')
+                return
+            logger.info(f'Model {model_name} warmed up.')
+
+    def clear(self):
+        """Drop all loaded models"""
+        with self._lock:
+            self._models.clear()
+
+registry = ModelRegistry(os.path.join(base_path,'..','src'))
+
+
+def _load_model(path):
+    """Load a Keras model, importing keras on first call
+
+    The import of keras and TensorFlow takes seconds, so it is kept out of
+    application startup and paid by the first prediction instead.
+    """
+    if 'keras.models' not in sys.modules:
+        start = time.perf_counter()
+        import keras.models
+        logger.info(f'ML import: {time.perf_counter() - start:.2f} s')
+    from keras.models import load_model
+    with trace.span('model_load', model=os.path.basename(path)):
+        return load_model(path)
 
 def get_current_model():
     """ Load model """
     logger.info('Now Loading The Trained Model.')
-    model_name = 'CNNPressureClassificationModel.hdf5'
-    PClassiModel = load_model(os.path.join(base_path,'..\src',model_name))
+    PClassiModel = registry.get(CLASSI_MODEL_NAME)
     logger.info('Classification Model loaded successfully.')
-    return model_name, PClassiModel
+    return CLASSI_MODEL_NAME, PClassiModel
     
 def AIpredict(input_data, PClassiModel):
+    """Classify a single breath. See AIpredict_batch."""
+    return AIpredict_batch([input_data], PClassiModel)[0]
+
+def AIpredict_batch(breaths, PClassiModel, batch_size=PREDICT_BATCH_SIZE, callback=None):
+    """Classify breath types with one model call per batch of breaths
+
+    Args:
+        breaths (list): pressure list of each breath, [] for rejected breaths
+        PClassiModel ([type]): classification trained model
+        batch_size (int): number of breaths per predict call
+        callback (callable): called with (done, total) after each batch
+
+    Returns:
+        b_type (list): 'Normal', 'Asyn' or np.nan for each breath, in order
+    """
     seed_value = 7
     random.seed(seed_value)
     np.random.seed(seed_value)
     data_size = 150
-    input_data = np.array(input_data) # convert into array
-    input_data = (input_data - min(input_data))/max(input_data - min(input_data)) #normalise data
-    
-    x = np.arange(0,(input_data).size)
-    new_x = np.arange(0,input_data.size-1,input_data.size/data_size) 
-    input_data = np.transpose(interp1d(x,input_data)(new_x))
-    input_data = input_data.reshape(len(input_data),1)
-    input_data = pad_sequences(np.transpose(input_data),maxlen=data_size,dtype= 'float64',padding='post', truncating='post', value = (input_data)[-1])
-    preprocessed_data = input_data.reshape(data_size)
-    
-    Preds = PClassiModel.predict(preprocessed_data.reshape(1,150,1)) # this line classifies the type of breathing cycle
-    out = np.argmax(Preds)
-    
-    if out == 0: # Normal breath
-        return('Normal')
-    elif out == 1: # Asyn breath
-        return('Asyn')
-    elif out == 2: #noise breath
-        return('Normal')
-    else: 
-        return('Normal')
+
+    b_type = [np.nan] * len(breaths)
+    idx = [i for i, p in enumerate(breaths) if len(p) != 0]
+    if len(idx) == 0:
+        return b_type
+    with trace.span('preprocessing', breaths=len(idx)):
+        preprocessed_data = norma_resample_batch(*to_ragged([breaths[i] for i in idx]), data_size)
+        preprocessed_data = preprocessed_data.reshape(len(idx), data_size, 1)
+
+    out = []
+    for start in range(0, len(idx), batch_size):
+        with trace.span('predict', breaths=min(batch_size, len(idx)-start)):
+            Preds = PClassiModel.predict(preprocessed_data[start:start+batch_size]) # this line classifies the type of breathing cycle
+        out.extend(np.argmax(Preds, axis=1))
+        if callback is not None:
+            callback(min(start+batch_size, len(idx)), len(idx))
+    trace.count('breaths_classified', len(idx))
+
+    # 0: Normal breath, 1: Asyn breath, 2: noise breath (reported as Normal)
+    for i, o in zip(idx, out):
+        b_type[i] = 'Asyn' if o == 1 else 'Normal'
+    return b_type
 
 def norma_resample(input_data, data_size):
-    input_data = np.array(input_data) # convert into array
-    input_data = (input_data - min(input_data))/max(input_data - min(input_data))
-    x = np.arange(0,(input_data).size)
-    new_x = np.arange(0,input_data.size-1,input_data.size/data_size)
-    input_data = np.transpose(interp1d(x,input_data.reshape(len(input_data)))(new_x))
-    input_data = input_data.reshape(len(input_data),1)
-    input_data = pad_sequences(np.transpose(input_data),maxlen=data_size,dtype= 'float64',padding='post', truncating='post', value = (input_data)[-1])
-    immatrix_p = input_data.reshape(data_size)
-    return immatrix_p
+    """Normalise, resample and pad a single breath. See norma_resample_batch."""
+    values, offsets = to_ragged([input_data])
+    return norma_resample_batch(values, offsets, data_size)[0]
 
 def load_Recon_Model():
-    model_name = 'ABReCAPressureFlowReconstructionModel.hdf5'
-    ReconModel = load_model(os.path.join(base_path,'..\src',model_name))
-    return ReconModel
+    """ Load reconstruction model """
+    return registry.get(RECON_MODEL_NAME)
 
 def recon(flow, pressure, ReconModel):
     """Predict Asynchrony magnitude using pressure reconstruction
@@ -109,46 +221,77 @@ def recon(flow, pressure, ReconModel):
     Returns:
         magAI: Asynchrony magnitude
     """
+    return recon_batch([flow], [pressure], ReconModel)[0]
+
+def recon_batch(flows, pressures, ReconModel, batch_size=PREDICT_BATCH_SIZE, callback=None):
+    """Predict Asynchrony magnitude of many breaths using pressure reconstruction
+
+    The resampled inspiratory pressures of all breaths are stacked into one
+    (N,64,1) input, reconstructed in batches and scored with array operations.
+
+    Args:
+        flows (list): flow list of each breath
+        pressures (list): pressure list of each breath, [] for rejected breaths
+        ReconModel ([type]): reconstruction trained model
+        batch_size (int): number of breaths per predict call
+        callback (callable): called with (done, total) after each batch
+
+    Returns:
+        AImag (list): Asynchrony magnitude or np.nan for each breath, in order
+    """
     random.seed(7)
     np.random.seed(7)
-    temp_flow = np.array(flow)/60
-    Fth = 5
+    data_size = 64
 
-    flow_inspi_loc_ends = np.argmax(temp_flow[1+Fth:-1]<= 0) # add 5 data points in future so that will avoid the 1st digit as negative
-    flow_inspi = temp_flow[0:flow_inspi_loc_ends+Fth]
-    
-    while (len(flow_inspi) <= 10):
-        #print(len(flow_head))
-        flow_inspi_loc_ends = np.argmax(temp_flow[1+Fth:-1]<= 0) # add 5 data points in future so that will avoid the 1st digit as negative
-        flow_inspi = temp_flow[0:flow_inspi_loc_ends+Fth]
-        Fth = Fth +1
-    
-    flow_inspi_loc_ends = np.argmax(temp_flow[1+Fth:-1]<= 0) # add 5 data points in future so that will avoid the 1st digit as negative
-    flow_inspi = temp_flow[0:flow_inspi_loc_ends+Fth]
-    
-    flow_expi = temp_flow[flow_inspi_loc_ends+1+Fth::]
-    flow_expi_loc_starts = np.argmin(flow_expi)
-    flow_expi = flow_expi[flow_expi_loc_starts::]
-    
-    #% Pressure Inspiration and expiration
-    pressure_inspi = pressure[0:flow_inspi_loc_ends+Fth]
-    
-    temp = norma_resample(pressure_inspi,64)
-    
-    reconstructed = ReconModel.predict(temp.reshape(1,64,1))
-    reconstructed = reconstructed.reshape(64) # Normalized output (0-1)
-
-    Error = max((temp.reshape(64,) - reconstructed.reshape(64,)))
-    reconstructed = reconstructed +Error
-    max_recon = max(reconstructed)
-    reconstructed = reconstructed/max_recon # to normalize
-    normalized_AB = temp.reshape(64,)/max_recon
-    VI = 1 - (abs(trapz(reconstructed) - trapz(normalized_AB)))/trapz(reconstructed) # VI metric
-    magAB = (abs(trapz(reconstructed) - trapz(normalized_AB)))/trapz(reconstructed) *100 #Magnitude of AB
-    magAB = np.around(magAB,2)
-    
-    if not np.isnan(magAB):
-        return magAB
-    else:
-        return np.nan
+    AImag = [np.nan] * len(pressures)
+    idx = [i for i, p in enumerate(pressures) if len(p) != 0]
+    if len(idx) == 0:
+        return AImag
+
+    # Pressure Inspiration, split on flow as in Elastance._seperate_breath
+    with trace.span('preprocessing', breaths=len(idx)):
+        flow, offsets = to_ragged([flows[i] for i in idx])
+        pressure, _ = to_ragged([pressures[i] for i in idx])
+        inspi_len = Elastance().inspi_len_batch(flow, offsets)
+        temp = norma_resample_batch(*head_ragged(pressure, offsets, inspi_len), data_size)
+
+    reconstructed = []
+    for start in range(0, len(idx), batch_size):
+        batch = temp[start:start+batch_size]
+        with trace.span('recon', breaths=len(batch)):
+            reconstructed.append(ReconModel.predict(batch.reshape(len(batch), data_size, 1)).reshape(len(batch), data_size))
+        if callback is not None:
+            callback(min(start+batch_size, len(idx)), len(idx))
+    reconstructed = np.concatenate(reconstructed)  # Normalized output (0-1)
+
+    with trace.span('recon_metrics', breaths=len(idx)):
+        _, magAB = _recon_metrics(temp, reconstructed)
+    trace.count('breaths_reconstructed', len(idx))
+    for i, m in zip(idx, magAB):
+        AImag[i] = m if not np.isnan(m) else np.nan
+    return AImag
 
+def _recon_metrics(temp, reconstructed):
+    """VI metric and magnitude of AB for each row of input and reconstruction
+
+    Args:
+        temp (ndarray): (N,64) normalized inspiratory pressure
+        reconstructed (ndarray): (N,64) model output
+
+    Returns:
+        VI, magAB (ndarray): per breath
+    """
+    from scipy import trapz
+
+    Error = np.max(temp - reconstructed, axis=1)
+    # offset in the model output precision, as adding a scalar would
+    reconstructed = reconstructed + Error[:, None].astype(reconstructed.dtype)
+    max_recon = np.max(reconstructed, axis=1)
+    reconstructed = reconstructed/max_recon[:, None] # to normalize
+    normalized_AB = temp/max_recon[:, None]
+    area_recon = trapz(reconstructed, axis=1)
+    area_AB = trapz(normalized_AB, axis=1)
+    VI = 1 - (abs(area_recon - area_AB))/area_recon # VI metric
+    magAB = (abs(area_recon - area_AB))/area_recon *100 #Magnitude of AB
+    magAB = np.around(magAB,2)
+    return VI, magAB
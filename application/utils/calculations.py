@@ -27,10 +27,16 @@ Calculations module.
 # =============================================================================
 # Standard library imports
 # =============================================================================
-from scipy import integrate
 import numpy as np
 import logging
 import math
+import re
+import os
+
+#==============================================================================
+# Local application imports
+#==============================================================================
+from . import trace
 
 #==============================================================================
 # Setup Logging
@@ -53,100 +59,199 @@ class Elastance():
         Returns:
             P, Q, P_A, Q_A, Ers_A, Rrs_A, b_count, PEEP_A, PIP_A, TV_A, DP_A, b_num_all
         """
-        pressure, flow, b_num_all, b_len, rejected = [], [], [], [], []
-        P, Q, Ers_A, Rrs_A, P_A, Q_A, PEEP_A, PIP_A, TV_A, DP_A = [],[],[],[],[],[],[],[],[],[]
-        b_count = 0
+        P_A, Q_A, Ers_A, Rrs_A, PEEP_A, PIP_A, TV_A, DP_A = [],[],[],[],[],[],[],[]
         b_counter = [0,0,0,0,0,0]
-        import time
-        start = time.process_time()
-        with open(path, "r") as f:
-            for num, line in enumerate(f):
-                if ("BS," in line) == True:
-                    b_num = self._extractBNum(line)
-                elif ("BE" in line) == True:
-                    # return this no matter what
-                    b_count += 1
-                    b_len.append(len(pressure))
-                    P.extend(pressure)          # for plotting purpose, include all 
-                    Q.extend(flow)              # for plotting purpose, include all 
-                    b_num_all.append(b_num)
-
-                    # Calc and filter breath
-                    if len(pressure) >= 20:
-                        if len(pressure) == len(flow):
-                            E, R, PEEP, PIP, TidalVolume, _, _ = self.linear_r(pressure, flow, useIM=True) # calculate respiratory parameter 
-                            if abs(E) < 100:
-                                if abs(R) < 100:
-                                    if TidalVolume < 1:
-                                        P_A.append(pressure)
-                                        Q_A.append(flow)
-                                        Ers_A.append(E)
-                                        Rrs_A.append(R)
-                                        PEEP_A.append(round(PEEP,1))
-                                        PIP_A.append(round(PIP,1))
-                                        TV_A.append(round(TidalVolume*1000))
-                                        DP_A.append(round(PIP-PEEP,1))
-                                        b_counter[0] += 1
-                                    else:
-                                        self.add_nan(P_A, Q_A, Ers_A, Rrs_A, PEEP_A, PIP_A, TV_A, DP_A)
-                                        rejected.append((b_num,f'THRESHOLD: VT >= 1000ml, RAW: {round(TidalVolume*1000)}'))
-                                        b_counter[1] += 1
-                                else:
-                                    self.add_nan(P_A, Q_A, Ers_A, Rrs_A, PEEP_A, PIP_A, TV_A, DP_A)
-                                    rejected.append((b_num,f'THRESHOLD: abs(R) > 100, RAW: {R}'))
-                                    b_counter[2] += 1
+        with trace.span('parse'):
+            P, Q, b_len, b_num_all, be_line, line_rejected = self.parseHourFile(path)
+        b_count = len(b_len)
+        bounds = np.concatenate(([0], np.cumsum(b_len))).tolist()
+
+        # calculate respiratory parameter of every breath long enough in one go
+        long_enough = np.flatnonzero(b_len >= 20)
+        offsets = np.concatenate(([0], np.cumsum(b_len[long_enough])))
+        in_batch = np.repeat(b_len >= 20, b_len)
+        with trace.span('linear_r', breaths=len(long_enough)):
+            Ers_B, Rrs_B, PEEP_B, PIP_B, TV_B, _, _ = self.linear_r_batch(P[in_batch], Q[in_batch], offsets, useIM=True)
+        batch_idx = dict(zip(long_enough.tolist(), range(len(long_enough))))
+        P, Q, b_len = P.tolist(), Q.tolist(), b_len.tolist()
+
+        for i in range(b_count):
+            pressure = P[bounds[i]:bounds[i+1]]
+            flow = Q[bounds[i]:bounds[i+1]]
+            b_num = b_num_all[i]
+            reason = None
+
+            # Calc and filter breath
+            if len(pressure) >= 20:
+                if len(pressure) == len(flow):
+                    j = batch_idx[i]
+                    E, R, PEEP, PIP, TidalVolume = Ers_B[j], Rrs_B[j], int(PEEP_B[j]), float(PIP_B[j]), TV_B[j]
+                    if abs(E) < 100:
+                        if abs(R) < 100:
+                            if TidalVolume < 1:
+                                P_A.append(pressure)
+                                Q_A.append(flow)
+                                Ers_A.append(E)
+                                Rrs_A.append(R)
+                                PEEP_A.append(round(PEEP,1))
+                                PIP_A.append(round(PIP,1))
+                                TV_A.append(round(TidalVolume*1000))
+                                DP_A.append(round(PIP-PEEP,1))
+                                b_counter[0] += 1
                             else:
-                                self.add_nan(P_A, Q_A, Ers_A, Rrs_A, PEEP_A, PIP_A, TV_A, DP_A)
-                                rejected.append((b_num,f'THRESHOLD: abs(E) > 100, RAW: {E}'))
-                                b_counter[3] += 1
+                                reason = f'THRESHOLD: VT >= 1000ml, RAW: {round(TidalVolume*1000)}'
+                                b_counter[1] += 1
                         else:
-                            self.add_nan(P_A, Q_A, Ers_A, Rrs_A, PEEP_A, PIP_A, TV_A, DP_A)
-                            rejected.append((b_num,f'THRESHOLD: len(pressure) != len(flow), RAW: {len(pressure)},{len(flow)}'))
-                            b_counter[4] += 1
+                            reason = f'THRESHOLD: abs(R) > 100, RAW: {R}'
+                            b_counter[2] += 1
                     else:
-                        self.add_nan(P_A, Q_A, Ers_A, Rrs_A, PEEP_A, PIP_A, TV_A, DP_A)
-                        rejected.append((b_num,f'THRESHOLD: len(pressure) <= 20, RAW: {len(pressure)}'))
-                        b_counter[5] += 1
-
-                    # Clear P and Q temporary list
-                    pressure, flow = [], [] # reset temp list
+                        reason = f'THRESHOLD: abs(E) > 100, RAW: {E}'
+                        b_counter[3] += 1
                 else:
-                    if line != '': # Filter out empty lines
-                        section = line.split(',') # 2.34, 5.78 -> ['2.34','5.78']
-                        try:
-                            p_split = float(section[1])
-                            q_split = float(section[0])
-                            if abs(p_split) <= 100 and abs(q_split) <= 1000:
-                                if len(pressure) > 1:
-                                    # Get previous point
-                                    P_i = float(last_sec[1])
-                                    Q_i = float(last_sec[0])
-                                    last_sec = section    
-
-                                    if abs(p_split - P_i) <= 50:
-                                        if abs(q_split - Q_i) <= 100:
-                                            pressure.append(round(p_split,1))
-                                            flow.append(round(q_split,1))
-                                        else:
-                                            rejected.append((b_num,f'LINE {num}, LINE DEL: Qi-Qi-1 >= 50, RAW: {q_split}, {Q_i}'))
-                                    else:
-                                        rejected.append((b_num,f'LINE {num}, LINE DEL: Pi-Pi-1 >= 50, RAW: {p_split}, {P_i}'))
-                                else:
-                                    last_sec = section
-                                    pressure.append(round(p_split,1))
-                                    flow.append(round(q_split,1))
-                            else:
-                                rejected.append((b_num,f'LINE DEL: abs(P)<=100 or abs(Q)<=1000, RAW: {p_split}, {q_split}'))
-                        except Exception as e:
-                            logger.info(e)
-        logger.info(f'Time used to extract breath: {time.process_time() - start}')
-        
+                    reason = f'THRESHOLD: len(pressure) != len(flow), RAW: {len(pressure)},{len(flow)}'
+                    b_counter[4] += 1
+            else:
+                reason = f'THRESHOLD: len(pressure) <= 20, RAW: {len(pressure)}'
+                b_counter[5] += 1
+
+            if reason is not None:
+                self.add_nan(P_A, Q_A, Ers_A, Rrs_A, PEEP_A, PIP_A, TV_A, DP_A)
+                line_rejected.append((be_line[i], (b_num, reason)))
+
+        # Breath rejections are reported at their BE line, between the
+        # deleted sample lines, in the order the file was read
+        line_rejected.sort(key=lambda r: r[0])
+        rejected = [r for _, r in line_rejected]
+
         debug = {
             'rejected': rejected,
             'b_counter': b_counter
         }
         return P, Q, P_A, Q_A, Ers_A, Rrs_A, b_count, PEEP_A, PIP_A, TV_A, DP_A, b_num_all, b_len, debug
-    
+
+    def parseHourFile(self, path):
+        """Read a ventilator hour file in one pass into flat sample arrays.
+
+        The BS/BE marker rows are located as a line index and the amplitude
+        (abs(P)<=100, abs(Q)<=1000) and point-to-point (dP<=50, dQ<=100)
+        filters are applied as array masks. Samples are assigned to the
+        breath closed by the next BE row, exactly as the line-by-line
+        reader did.
+
+        Args:
+            path (string): file path
+
+        Returns:
+            P, Q (ndarray): filtered samples of every closed breath, concatenated
+            b_len (ndarray): number of samples in each breath
+            b_num_all (list): breath number of each breath
+            be_line (ndarray): line index of the BE row closing each breath
+            rejected (list): (line index, (b_num, reason)) of every deleted line
+        """
+        with open(path, "r") as f:
+            text = f.read()
+        lines = text.split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        n_lines = len(lines)
+
+        # Locate marker rows from their character offsets
+        lens = np.fromiter(map(len, lines), dtype=np.int64, count=n_lines)
+        starts = np.concatenate(([0], np.cumsum(lens + 1)[:-1]))
+        def marker_rows(marker):
+            offsets = [m.start() for m in re.finditer(marker, text)]
+            return np.unique(np.searchsorted(starts, offsets, side='right') - 1).astype(np.int64)
+        bs_line = marker_rows('BS,')
+        be_line = np.setdiff1d(marker_rows('BE'), bs_line)
+        is_data = np.ones(n_lines, dtype=bool)
+        is_data[bs_line] = False
+        is_data[be_line] = False
+        data_line = np.flatnonzero(is_data)
+        # Breath number in effect after each BS row, 0 before the first one
+        bs_num = np.array([0] + [self._extractBNum(lines[i] + '\n') for i in bs_line], dtype=np.int64)
+
+        # Parse pressure and flow, dropping lines that fail to convert
+        p, q, parsed = self._parseSamples([lines[i] for i in data_line])
+        line_no = data_line[parsed]
+        p, q = p[parsed], q[parsed]
+
+        # Breath closing each sample and breath number in effect on its line
+        breath = np.searchsorted(be_line, line_no)
+        b_num = bs_num[np.searchsorted(bs_line, line_no, side='right')]
+
+        rejected = []
+
+        # Amplitude filter
+        amp_ok = (np.abs(p) <= 100) & (np.abs(q) <= 1000)
+        for k in np.flatnonzero(~amp_ok):
+            rejected.append((line_no[k], (int(b_num[k]), f'LINE DEL: abs(P)<=100 or abs(Q)<=1000, RAW: {float(p[k])}, {float(q[k])}')))
+        line_no, p, q, breath, b_num = line_no[amp_ok], p[amp_ok], q[amp_ok], breath[amp_ok], b_num[amp_ok]
+
+        # Point-to-point filter against the previous in-range sample. The
+        # first two in-range samples of a breath are always kept.
+        first = np.ones(len(p), dtype=bool)
+        first[1:] = breath[1:] != breath[:-1]
+        group_start = np.flatnonzero(first)
+        rank = np.arange(len(p)) - group_start[np.cumsum(first) - 1]
+        dp = np.abs(np.diff(p, prepend=np.nan)) <= 50
+        dq = np.abs(np.diff(q, prepend=np.nan)) <= 100
+        checked = rank >= 2
+        for k in np.flatnonzero(checked & ~dp):
+            rejected.append((line_no[k], (int(b_num[k]), f'LINE {line_no[k]}, LINE DEL: Pi-Pi-1 >= 50, RAW: {float(p[k])}, {float(p[k-1])}')))
+        for k in np.flatnonzero(checked & dp & ~dq):
+            rejected.append((line_no[k], (int(b_num[k]), f'LINE {line_no[k]}, LINE DEL: Qi-Qi-1 >= 50, RAW: {float(q[k])}, {float(q[k-1])}')))
+        keep = ~checked | (dp & dq)
+
+        # Samples after the last BE never belong to a breath
+        n_breaths = len(be_line)
+        keep &= breath < n_breaths
+        P = _around(p[keep], 1)
+        Q = _around(q[keep], 1)
+        b_len = np.bincount(breath[keep], minlength=n_breaths)
+
+        b_num_all = bs_num[np.searchsorted(bs_line, be_line, side='right')].tolist()
+
+        rejected = [(int(n), r) for n, r in rejected]
+        return P, Q, b_len, b_num_all, be_line.tolist(), rejected
+
+    def _parseSamples(self, lines):
+        """Convert 'flow, pressure' lines to float arrays.
+
+        Returns:
+            pressure, flow (ndarray), parsed (ndarray): False where a line failed
+        """
+        n = len(lines)
+        pressure = np.full(n, np.nan)
+        flow = np.full(n, np.nan)
+        parsed = np.ones(n, dtype=bool)
+        if n == 0:
+            return pressure, flow, parsed
+
+        # Fast path: every line holds exactly one comma and two valid numbers
+        block = '\n'.join(lines)
+        raw = np.frombuffer(block.encode(), dtype=np.uint8)
+        commas = np.cumsum(raw == ord(','))
+        line_ends = np.flatnonzero(raw == ord('\n'))
+        per_line = np.diff(np.concatenate(([0], commas[line_ends], commas[-1:])))
+        if np.all(per_line == 1):
+            fields = block.replace('\n', ',').split(',')
+            try:
+                values = np.fromiter(map(float, fields), dtype=np.float64, count=len(fields)).reshape(n, 2)
+                return values[:, 1], values[:, 0], parsed
+            except ValueError:
+                pass
+
+        # Slow path: convert line by line and drop the malformed ones
+        for k, line in enumerate(lines):
+            section = line.split(',') # 2.34, 5.78 -> ['2.34','5.78']
+            try:
+                pressure[k] = float(section[1])
+                flow[k] = float(section[0])
+            except Exception as e:
+                parsed[k] = False
+                logger.info(e)
+        return pressure, flow, parsed
+
     def linear_r(self, P, Q, useIM):
         """Perform Linear Regression
 
@@ -158,6 +263,9 @@ class Elastance():
         Returns:
             Ers, Rrs, PEEP_non_array, PIP, TidalVolume, IE, VE: Analysis results
         """
+        # imported here, scipy.integrate adds most of a second to startup
+        from scipy import integrate
+
         temp_flow = np.array(Q)/60
         temp_pressure = P
 
@@ -219,6 +327,144 @@ class Elastance():
 
         return Ers, Rrs, PEEP_non_array, PIP, TidalVolume, IE, VE
     
+    def linear_r_batch(self, P, Q, offsets, useIM=True, block_size=256):
+        """Perform Linear Regression for many breaths at once.
+
+        Same computation as linear_r, vectorized across breaths. Breaths are
+        given as one ragged array: breath i is P[offsets[i]:offsets[i+1]].
+        They are processed in blocks of similar length padded to a matrix,
+        and Ers/Rrs come from the closed-form 2x2 normal equations. Breaths
+        whose solution is ill-conditioned or lands next to a rounding tie
+        are re-solved with np.linalg.lstsq, so results match linear_r.
+
+        Args:
+            P (array): Pressure of all breaths, concatenated
+            Q (array): Flow rate of all breaths, concatenated
+            offsets (array): Start of each breath, followed by the total length
+            useIM (boolean): True to use Integral method
+            block_size (int): Number of breaths solved together
+
+        Returns:
+            Ers, Rrs, PEEP, PIP, TidalVolume, IE, VE: Analysis results, one array
+            element per breath
+        """
+        P = np.asarray(P, dtype=np.float64)
+        Q = np.asarray(Q, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.diff(offsets)
+        results = np.full((7, len(lengths)), np.nan)
+
+        # Sort by length so each padded block wastes little memory
+        order = np.argsort(lengths, kind='stable')
+        for i in range(0, len(order), block_size):
+            idx = order[i:i+block_size]
+            results[:, idx] = self._linear_r_block(P, Q, offsets[idx], lengths[idx], useIM)
+
+        Ers, Rrs, PEEP, PIP, TidalVolume, IE, VE = results
+        return Ers, Rrs, PEEP, PIP, TidalVolume, IE, VE
+
+    def _linear_r_block(self, P, Q, start, n, useIM):
+        """linear_r on a block of breaths padded to a common width."""
+        width = max(int(n.max()), 16)
+        temp_pressure = _ragged_rows(P, start, n, width)
+        temp_flow = _ragged_rows(Q, start, n, width)/60
+        cols = np.arange(width)
+        valid = cols < n[:, None]
+
+        # get maximum pressure pip
+        PIP = np.where(valid, temp_pressure, -np.inf).max(axis=1)
+
+        inspi_len, expi_start, Fth = self._seperate_breath_batch(temp_flow, n)
+        rows = np.arange(len(n))
+        resolved = ~np.isnan(Fth)
+        inspi_len = np.where(resolved, inspi_len, 1)
+        expi_start = np.where(resolved, expi_start, n - 1)
+
+        # use expi min as peep
+        expi = (cols >= expi_start[:, None]) & valid
+        PEEP = np.floor(np.where(expi, temp_pressure, np.inf).min(axis=1))
+
+        # expiration flow starts at its minimum
+        flow_expi_loc_starts = np.argmin(np.where(expi, temp_flow, np.inf), axis=1)
+        flow_expi = _ragged_rows(temp_flow.ravel(), rows*width + flow_expi_loc_starts, n - flow_expi_loc_starts, width)
+        expi_len = n - flow_expi_loc_starts
+
+        flow_inspi = temp_flow
+        pressure_inspi = temp_pressure
+        inspi = cols < inspi_len[:, None]
+        Time = _linspace_rows(inspi_len, width)
+        expi_Time = _linspace_rows(expi_len, width)
+
+        V = _cumtrapz_rows(flow_inspi, Time)
+        V_expi = _cumtrapz_rows(flow_expi, expi_Time)
+
+        if useIM:
+            # Using Integral method, reintegrate to reduce noise
+            A1 = _cumtrapz_rows(V, Time)
+            A2 = V
+            B = _cumtrapz_rows(pressure_inspi - PEEP[:, None], Time)
+        else:
+            A1 = V
+            A2 = flow_inspi
+            B = pressure_inspi - PEEP[:, None]
+
+        # Closed-form least squares from the 2x2 normal equations
+        A1, A2, B = [np.where(inspi, x, 0) for x in (A1, A2, B)]
+        a11 = (A1*A1).sum(axis=1)
+        a12 = (A1*A2).sum(axis=1)
+        a22 = (A2*A2).sum(axis=1)
+        b1 = (A1*B).sum(axis=1)
+        b2 = (A2*B).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            det = a11*a22 - a12*a12
+            Ers = (a22*b1 - a12*b2)/det
+            Rrs = (a11*b2 - a12*b1)/det
+            refine = (np.abs(det) <= 1e-8*a11*a22) | _near_tie(Ers, 1) | _near_tie(Rrs, 1)
+        for i in np.flatnonzero(refine & resolved):
+            L = inspi_len[i]
+            A = np.vstack((A1[i, :L], A2[i, :L])).T
+            Ers[i], Rrs[i] = np.linalg.lstsq(A, B[i, :L], rcond=-1)[0]
+
+        # round Ers, Rrs to one decimal point
+        Ers = np.around(Ers, 1)
+        Rrs = np.around(Rrs, 1)
+
+        # get other parameters
+        TidalVolume = np.where(inspi, V, -np.inf).max(axis=1)
+        IE = expi_len/inspi_len
+        VE = np.abs(np.where(cols < expi_len[:, None], V_expi, np.inf).min(axis=1))
+
+        # Limit Rrs to zero, remove negative value
+        Rrs = np.where(Rrs < 0, 0, Rrs)
+
+        out = np.array([Ers, Rrs, PEEP, PIP, TidalVolume, IE, VE])
+        out[:, ~resolved] = np.nan
+        return out
+
+    def inspi_len_batch(self, Q, offsets, block_size=256):
+        """Number of inspiration points of each breath, as found by
+        _seperate_breath. Breaths are given as in linear_r_batch.
+
+        Args:
+            Q (array): Flow rate of all breaths, concatenated
+            offsets (array): Start of each breath, followed by the total length
+            block_size (int): Number of breaths processed together
+
+        Returns:
+            inspi_len (ndarray): inspiration length of each breath
+        """
+        Q = np.asarray(Q, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.diff(offsets)
+        inspi_len = np.zeros(len(lengths), dtype=np.int64)
+        order = np.argsort(lengths, kind='stable')
+        for i in range(0, len(order), block_size):
+            idx = order[i:i+block_size]
+            n = lengths[idx]
+            temp_flow = _ragged_rows(Q, offsets[idx], n, max(int(n.max()), 16))/60
+            inspi_len[idx], _, _ = self._seperate_breath_batch(temp_flow, n)
+        return inspi_len
+
     def add_nan(self, P_A, Q_A, Ers_A, Rrs_A, PEEP_A, PIP_A, TV_A, DP_A):
         """Add numpy nan to list."""
         P_A.append([])
@@ -233,6 +479,8 @@ class Elastance():
     
     def _get_V(self, Q):
         """Cumulative trapezoital integral to get tidal volume from air flow rate"""
+        from scipy import integrate
+
         b_points = np.size(Q)
         time = list(np.linspace(0, (b_points-1)*0.02, b_points))
         return integrate.cumtrapz(Q, x=time, initial=0)
@@ -266,6 +514,43 @@ class Elastance():
 
         return flow_inspi,flow_expi,pressure_inspi,pressure_expi
 
+    def _seperate_breath_batch(self, temp_flow, n):
+        """Vectorized _seperate_breath on padded rows.
+
+        Returns:
+            inspi_len, expi_start, Fth: per breath; Fth is NaN where no
+            inspiration longer than 10 points could be found
+        """
+        width = temp_flow.shape[1]
+        cols = np.arange(width)
+
+        # Column of the next non-positive flow point, searched in temp_flow[:-1]
+        nonpos = (temp_flow <= 0) & (cols <= n[:, None] - 2)
+        nxt = np.minimum.accumulate(np.where(nonpos, cols, width)[:, ::-1], axis=1)[:, ::-1]
+
+        rows = np.arange(len(n))
+        def loc_ends(Fth):
+            found = nxt[rows, np.minimum(1 + Fth, width - 1)]
+            return np.where((found < width) & (1 + Fth < width), found - (1 + Fth), 0)
+
+        # Fth grows until inspiration is longer than 10 points, then is
+        # incremented once more, as in the while loop of _seperate_breath
+        Fth = np.full(len(n), 5.0)
+        pending = np.minimum(loc_ends(5) + 5, n) <= 10
+        Fth[pending] = np.nan
+        for f in range(5, width - 1):
+            if not pending.any():
+                break
+            done = pending & (np.minimum(loc_ends(f) + f, n) > 10)
+            Fth[done] = f + 1
+            pending &= ~done
+
+        F = np.nan_to_num(Fth).astype(np.int64)
+        loc = loc_ends(F)
+        inspi_len = np.minimum(loc + F, n)
+        expi_start = loc + 1 + F
+        return inspi_len, expi_start, Fth
+
     def _extractBNum(self, line):
         """Gets current breath number for debug.
         Returns 0000 when failed."""
@@ -281,6 +566,83 @@ class Elastance():
                     b_num = 0000
         return b_num
 
+def respiratory_mechanics(path):
+    """Analyse one hour file and package the results in a dictionary.
+
+    Kept at module level and free of Qt so that it can be sent to worker
+    processes.
+
+    Args:
+        path (str): path of hour file named patient_<p_no>_<date>_<hour>.txt
+
+    Returns:
+        dObj (dict): results of analysis
+    """
+    _, p_no, date, hour = os.path.basename(path).replace('.txt','').split('_')
+    with trace.span('respiratory_mechanics', file=os.path.basename(path)):
+        P, Q, P_A, Q_A, Ers_A, Rrs_A, b_count, PEEP_A, PIP_A, TV_A, DP_A, b_num_all, b_len, debug = Elastance().calcRespMechanics(path)
+    trace.count('hours_parsed')
+    trace.count('breaths_parsed', b_count)
+    dObj = {
+        'p_no': p_no,
+        'date': date,
+        'hour': hour,
+        'P': P,
+        'Q': Q,
+        'pressure': P_A,
+        'flow': Q_A,
+        'Ers': Ers_A,
+        'Rrs': Rrs_A,
+        'PEEP': PEEP_A,
+        'PIP': PIP_A,
+        'TV': TV_A,
+        'DP': DP_A,
+        'b_count': b_count,
+        'b_num_all': b_num_all,
+        'b_len': b_len,
+        'debug': debug
+    }
+    return dObj
+
+def _around(x, decimals):
+    """Round like the built-in round(), element-wise.
+
+    np.around may disagree with round() for values sitting next to a
+    rounding tie; those few elements are redone with round().
+    """
+    x = np.asarray(x, dtype=np.float64)
+    out = np.around(x, decimals)
+    scaled = x * 10.0**decimals
+    near_tie = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    out[near_tie] = [round(v, decimals) for v in x[near_tie].tolist()]
+    return out
+
+def _near_tie(x, decimals):
+    """True where x is close to a rounding tie at the given decimals."""
+    scaled = np.asarray(x) * 10.0**decimals
+    return np.abs(scaled - np.floor(scaled) - 0.5) < 1e-4
+
+def _ragged_rows(values, start, length, width):
+    """Gather ragged segments into a (len(start), width) matrix.
+    Each row is padded with its last value."""
+    cols = np.minimum(np.arange(width), np.maximum(length - 1, 0)[:, None])
+    return values[start[:, None] + cols]
+
+def _linspace_rows(length, width):
+    """Row i holds np.linspace(0, (length[i]-1)*0.02, length[i]), padded."""
+    stop = (length - 1)*0.02
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step = np.where(length > 1, stop/(length - 1), 0)
+    x = np.arange(width, dtype=np.float64)*step[:, None]
+    last = np.maximum(length - 1, 0)
+    x[np.arange(len(length)), np.minimum(last, width - 1)] = stop
+    return x
+
+def _cumtrapz_rows(y, x):
+    """integrate.cumtrapz(y, x=x, initial=0) along each row."""
+    res = np.cumsum(np.diff(x, axis=1) * (y[:, 1:] + y[:, :-1]) / 2.0, axis=1)
+    return np.concatenate((np.zeros((len(y), 1)), res), axis=1)
+
 def _calcQuartiles(E, R, PEEP_A, PIP_A, TV_A, DP_A):
     """ Calc quartiles """
     TV_A = [np.around(x,0) for x in TV_A]
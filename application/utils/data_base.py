@@ -26,6 +26,7 @@ Database util module.
 # =============================================================================
 # Standard library imports
 # =============================================================================
+import threading
 import logging
 import json
 import os
@@ -33,12 +34,17 @@ import os
 #==============================================================================
 # Third-party imports
 #==============================================================================
-from PyQt5.QtSql import  QSqlQuery
+from PyQt5.QtSql import  QSqlQuery, QSqlDatabase
+from PyQt5.QtCore import QByteArray
+import numpy as np
 
 #==============================================================================
 # Local application imports
 #==============================================================================
 from .calculations import _calcQuartiles
+from .sketch import QuantileSketch, hour_sketches
+from .decimate import minmax_pyramid
+from . import trace
 
 
 #==============================================================================
@@ -48,32 +54,99 @@ from .calculations import _calcQuartiles
 logger = logging.getLogger(__name__)
 base_path = os.path.abspath(os.path.dirname(__file__))
 
-def save_db_hour(db, P, Q, Ers, Rrs, b_count, b_type, PEEP, PIP, TV, DP, AImag, b_num_all, b_len, p_no, date, hour, debug):
+# Header of binary packed columns: magic, numpy dtype string and number of
+# decimals kept for fixed-point columns. Rows written before packing was
+# introduced hold JSON text instead.
+PACK_MAGIC = b'\x00CA1'
+PACK_HEADER_SIZE = 8
 
-    # Calculate quartiles    
-    dObj = _calcQuartiles(Ers, Rrs, PEEP, PIP, TV, DP)
+# Breath type codes of the packed b_type column, 0 is a rejected breath (nan)
+B_TYPE_CODES = {'Normal': 1, 'Asyn': 2}
+B_TYPE_NAMES = [np.nan, 'Normal', 'Asyn']
 
-    # Encoding python object to json
-    p = json.dumps(P)
-    q = json.dumps(Q)
-    Ers_raw = json.dumps(Ers)
-    Rrs_raw = json.dumps(Rrs)
-    PEEP_raw = json.dumps(PEEP)
-    PIP_raw = json.dumps(PIP)
-    TV_raw = json.dumps(TV)
-    DP_raw = json.dumps(DP)
-    AM_raw = json.dumps(AImag)
-    b_type_encoded = json.dumps(b_type)
-    b_num_all = json.dumps(b_num_all)
-    b_len = json.dumps(b_len)
-    debug = json.dumps(debug)
+def pack_array(values, dtype='<f8', decimals=0):
+    """Encode a list of numbers as a typed little-endian numpy buffer
 
-    Norm_cnt = b_type.count('Normal')
-    Asyn_cnt = b_type.count('Asyn')
-    AI_index = round(Asyn_cnt/(Asyn_cnt+Norm_cnt)*100,2)
+    Args:
+        values (list): numbers, nan allowed for float dtypes
+        dtype (str): little-endian numpy dtype string of 3 characters
+        decimals (int): for integer dtypes, store values*10**decimals
+            (fixed-point) so that values rounded to decimals are exact
 
-    query = QSqlQuery(db)
-    query.prepare(f"""INSERT INTO results (p_no, date, hour, p, q, b_count, b_type, b_num_all, b_len, debug,
+    Returns:
+        QByteArray: packed column value
+    """
+    if decimals:
+        values = np.round(np.asarray(values, dtype=np.float64)*10**decimals)
+    arr = np.ascontiguousarray(values, dtype=np.dtype(dtype))
+    header = PACK_MAGIC + arr.dtype.str.encode() + bytes([decimals])
+    return QByteArray(header + arr.tobytes())
+
+def unpack_fixed(value):
+    """Decode a packed column without scaling fixed-point values
+
+    Packed values are neither parsed nor copied: the returned array is a
+    view on the QByteArray of the column value, which it keeps alive.
+
+    Args:
+        value: column value as returned by QSqlQuery.value()
+
+    Returns:
+        values: ndarray view for packed values, list for legacy JSON values
+        scale (int): divide values by scale for the stored numbers, 1 unless
+            the column was packed as fixed-point
+    """
+    header = bytes(value[:PACK_HEADER_SIZE]) if isinstance(value, (QByteArray, bytes)) else b''
+    if header[:len(PACK_MAGIC)] == PACK_MAGIC:
+        dtype = header[len(PACK_MAGIC):-1].decode()
+        arr = np.frombuffer(value, dtype=dtype, offset=PACK_HEADER_SIZE)
+        return arr, 10**header[-1]
+    if isinstance(value, QByteArray):
+        value = value.data()
+    return json.loads(value), 1
+
+def unpack_array(value):
+    """Decode a packed column, falling back to legacy JSON text
+
+    Fixed-point columns (P, Q) are scaled back to floats, which copies
+    them; use unpack_fixed() to defer the scaling to where the values
+    are used.
+
+    Args:
+        value: column value as returned by QSqlQuery.value()
+
+    Returns:
+        ndarray for packed values, list for legacy JSON values
+    """
+    values, scale = unpack_fixed(value)
+    if scale != 1:
+        return values/scale
+    return values
+
+def pack_b_type(b_type):
+    """Encode breath types as uint8 codes"""
+    return pack_array([B_TYPE_CODES.get(b, 0) for b in b_type], '|u1')
+
+def unpack_b_type(value):
+    """Decode breath types to a list of 'Normal', 'Asyn' or nan"""
+    codes = unpack_array(value)
+    if isinstance(codes, list):
+        return codes
+    return [B_TYPE_NAMES[c] for c in codes.tolist()]
+
+def pack_sketch(sketch):
+    """Encode a quantile sketch"""
+    return pack_array(sketch.to_array(), '<i4')
+
+def unpack_sketch(value):
+    """Decode a quantile sketch, None for rows saved without sketches"""
+    if isinstance(value, QByteArray):
+        value = value.data()
+    if not value:
+        return None
+    return QuantileSketch.from_array(unpack_array(value))
+
+INSERT_HOUR_QUERY = """INSERT OR REPLACE INTO results (p_no, date, hour, p, q, b_count, b_type, b_num_all, b_len, debug,
                     Ers_raw, Rrs_raw, PEEP_raw, PIP_raw, TV_raw, DP_raw, AM_raw,
                     Ers_q5,  Rrs_q5,  PEEP_q5,  PIP_q5,  TV_q5,  DP_q5,
                     Ers_q25, Rrs_q25, PEEP_q25, PIP_q25, TV_q25, DP_q25,
@@ -82,7 +155,8 @@ def save_db_hour(db, P, Q, Ers, Rrs, b_count, b_type, PEEP, PIP, TV, DP, AImag,
                     Ers_q95, Rrs_q95, PEEP_q95, PIP_q95, TV_q95, DP_q95,
                     Ers_min, Rrs_min, PEEP_min, PIP_min, TV_min, DP_min,
                     Ers_max, Rrs_max, PEEP_max, PIP_max, TV_max, DP_max,
-                    AI_Norm_cnt, AI_Asyn_cnt, AI_Index) 
+                    AI_Norm_cnt, AI_Asyn_cnt, AI_Index,
+                    Ers_sketch, Rrs_sketch, PEEP_sketch, PIP_sketch, TV_sketch, DP_sketch) 
                     VALUES (:p_no, :date, :hour, :p, :q, :b_count, :b_type, :b_num_all, :b_len, :debug,
                     :Ers_raw, :Rrs_raw, :PEEP_raw, :PIP_raw, :TV_raw, :DP_raw, :AM_raw,
                     :Ers_q5,  :Rrs_q5,  :PEEP_q5,  :PIP_q5,  :TV_q5,  :DP_q5,
@@ -92,7 +166,424 @@ def save_db_hour(db, P, Q, Ers, Rrs, b_count, b_type, PEEP, PIP, TV, DP, AImag,
                     :Ers_q95, :Rrs_q95, :PEEP_q95, :PIP_q95, :TV_q95, :DP_q95,
                     :Ers_min, :Rrs_min, :PEEP_min, :PIP_min, :TV_min, :DP_min,
                     :Ers_max, :Rrs_max, :PEEP_max, :PIP_max, :TV_max, :DP_max,
-                    :AI_Norm_cnt, :AI_Asyn_cnt, :AI_Index)""")
+                    :AI_Norm_cnt, :AI_Asyn_cnt, :AI_Index,
+                    :Ers_sketch, :Rrs_sketch, :PEEP_sketch, :PIP_sketch, :TV_sketch, :DP_sketch)"""
+
+INSERT_BREATHS_QUERY = """INSERT INTO breaths (p_no, date, hour, b_idx, b_num, b_len, b_type,
+                    Ers, Rrs, PEEP, PIP, TV, DP, AImag)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+DELETE_BREATHS_QUERY = "DELETE FROM breaths WHERE p_no=:p_no AND date=:date AND hour=:hour"
+
+INSERT_PYRAMID_QUERY = """INSERT OR REPLACE INTO pyramid (p_no, date, hour, level, p_min, p_max, q_min, q_max)
+                    VALUES (:p_no, :date, :hour, :level, :p_min, :p_max, :q_min, :q_max)"""
+
+def prepare_query(db, statement):
+    """New query on db, prepared with statement"""
+    query = QSqlQuery(db)
+    if not query.prepare(statement):
+        logger.error(f"Error: {query.lastError().text()}")
+    return query
+
+def configure_db(db, readonly=False):
+    """Set pragmas of an open SQLite connection.
+
+    WAL journaling lets readers carry on while a batch is being saved,
+    synchronous=NORMAL only syncs at WAL checkpoints and mmap speeds up
+    reading of large result rows. Read-only connections only set mmap,
+    the journal mode being stored in the database file.
+    """
+    pragmas = ["PRAGMA mmap_size=268435456"]
+    if not readonly:
+        pragmas = ["PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL"] + pragmas
+    query = QSqlQuery(db)
+    for pragma in pragmas:
+        if not query.exec(pragma):
+            logger.warning(f"{pragma} failed: {query.lastError().text()}")
+
+class ConnectionManager():
+    """Hands out a named connection to the database file per thread.
+
+    Qt does not allow a connection to be used outside the thread that
+    created it, so each thread (and each process, having its own manager)
+    gets its own read-write and read-only connections. A worker thread
+    calls release() when done so that its connections are removed.
+    """
+
+    def __init__(self, db_name="CARE_One_data.sqlite"):
+        self.db_name = db_name
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._count = 0
+
+    def connection(self, readonly=False):
+        """Return the open connection of the calling thread
+
+        Args:
+            readonly (bool): open the database file read-only
+
+        Returns:
+            db (QSqlDatabase): open connection, check isOpen() for failure
+        """
+        names = self._local.__dict__.setdefault('names', {})
+        if readonly in names:
+            return QSqlDatabase.database(names[readonly])
+
+        with self._lock:
+            self._count += 1
+            name = f"CARE_One_{'ro' if readonly else 'rw'}_{self._count}"
+        db = QSqlDatabase.addDatabase("QSQLITE", connectionName=name)
+        db.setDatabaseName(self.db_name)
+        if readonly:
+            db.setConnectOptions("QSQLITE_OPEN_READONLY")
+        if db.open():
+            configure_db(db, readonly)
+            logger.info(f"DB connection {name} opened")
+        else:
+            logger.error(f"Unable to open DB connection {name}: {db.lastError().text()}")
+        names[readonly] = name
+        return db
+
+    def release(self):
+        """Close and remove the connections of the calling thread.
+        Queries and handles of these connections must not be used after."""
+        names = self._local.__dict__.pop('names', {})
+        for name in names.values():
+            QSqlDatabase.database(name, open=False).close()
+            QSqlDatabase.removeDatabase(name)
+            logger.info(f"DB connection {name} removed")
+
+connections = ConnectionManager()
+
+@trace.traced()
+def save_db_hours(db, sum_results):
+    """Save results of many hours in one transaction, with statements
+    prepared once for all hours
+
+    Args:
+        db (QSqlDatabase): database connection
+        sum_results (list): results dictionary of each hour
+
+    Returns:
+        bool: True when all hours were committed
+    """
+    in_transaction = db.transaction()
+    if not in_transaction:
+        logger.warning(f"Cannot start transaction, saving hours one by one: {db.lastError().text()}")
+    query = prepare_query(db, INSERT_HOUR_QUERY)
+    breaths_queries = (prepare_query(db, DELETE_BREATHS_QUERY), prepare_query(db, INSERT_BREATHS_QUERY))
+    pyramid_query = prepare_query(db, INSERT_PYRAMID_QUERY)
+    ok = True
+    for r in sum_results:
+        ok = save_db_hour(db, r['P'], r['Q'], r['Ers'], r['Rrs'], r['b_count'], r['b_type'], r['PEEP'], r['PIP'], r['TV'], r['DP'],
+                            r['AImag'], r['b_num_all'], r['b_len'], r['p_no'], r['date'], r['hour'], r['debug'],
+                            query=query, breaths_queries=breaths_queries, pyramid_query=pyramid_query)
+        if not ok:
+            break
+    for q in (query, *breaths_queries, pyramid_query):
+        q.finish()
+    if not in_transaction:
+        return ok
+    with trace.span('commit'):
+        ok = ok and db.commit()
+    if ok:
+        logger.info(f"DB batch of {len(sum_results)} hours committed")
+        return True
+    logger.error(f"DB batch rolled back: {db.lastError().text()}")
+    db.rollback()
+    return False
+
+def _nullable(values):
+    """List of floats for batch binding, None (NULL) in place of nan"""
+    return [None if v != v else float(v) for v in np.asarray(values, dtype=np.float64).tolist()]
+
+def save_db_breaths(db, p_no, date, hour, b_num_all, b_len, b_type, Ers, Rrs, PEEP, PIP, TV, DP, AImag, queries=None):
+    """Save one row per breath of an hour in the breaths table,
+    replacing the breaths saved before for that hour.
+    Rejected breaths are kept with NULL values. Queries already prepared
+    with DELETE_BREATHS_QUERY and INSERT_BREATHS_QUERY may be passed for
+    reuse."""
+    if queries is None:
+        queries = (prepare_query(db, DELETE_BREATHS_QUERY), prepare_query(db, INSERT_BREATHS_QUERY))
+    delete_query, query = queries
+    delete_query.bindValue(":p_no", p_no)
+    delete_query.bindValue(":date", date)
+    delete_query.bindValue(":hour", hour)
+    if not delete_query.exec_():
+        logger.error(f"Error: {delete_query.lastError().text()}")
+        return False
+
+    # execBatch crashes on bound lists of different lengths
+    n = len(b_len)
+    if any(len(values) != n for values in (b_num_all, b_type, Ers, Rrs, PEEP, PIP, TV, DP, AImag)):
+        logger.error(f"Error: per-breath lists of {p_no} {date} {hour} differ in length from b_len ({n})")
+        return False
+    query.addBindValue([p_no]*n)
+    query.addBindValue([date]*n)
+    query.addBindValue([hour]*n)
+    query.addBindValue(list(range(n)))
+    query.addBindValue([int(b) for b in b_num_all])
+    query.addBindValue([int(b) for b in b_len])
+    query.addBindValue([b if isinstance(b, str) else None for b in b_type])
+    for values in (Ers, Rrs, PEEP, PIP, TV, DP, AImag):
+        query.addBindValue(_nullable(values))
+    if not query.execBatch():
+        logger.error(f"Error: {query.lastError().text()}")
+        return False
+    return True
+
+def save_db_pyramid(db, p_no, date, hour, P, Q, query=None):
+    """Save the min/max pyramid of the pressure and flow of an hour.
+    Samples are rounded to 0.1, so are the bucket min and max: they are
+    stored as exact int16 fixed-point like p and q. A query already
+    prepared with INSERT_PYRAMID_QUERY may be passed for reuse."""
+    P_pyr, Q_pyr = minmax_pyramid(P), minmax_pyramid(Q)
+    if query is None:
+        query = prepare_query(db, INSERT_PYRAMID_QUERY)
+    for level in P_pyr:
+        query.bindValue(":p_no", p_no)
+        query.bindValue(":date", date)
+        query.bindValue(":hour", hour)
+        query.bindValue(":level", level)
+        query.bindValue(":p_min", pack_array(P_pyr[level][0], '<i2', decimals=1))
+        query.bindValue(":p_max", pack_array(P_pyr[level][1], '<i2', decimals=1))
+        query.bindValue(":q_min", pack_array(Q_pyr[level][0], '<i2', decimals=1))
+        query.bindValue(":q_max", pack_array(Q_pyr[level][1], '<i2', decimals=1))
+        if not query.exec_():
+            logger.error(f"Error: {query.lastError().text()}")
+            return False
+    return True
+
+@trace.traced()
+def fetch_db_pyramid(db, p_no, date, hour):
+    """Fetch the min/max pyramid of the pressure and flow of an hour
+
+    Returns:
+        P_pyr, Q_pyr (dict): {level: (mins, maxs)}, empty if not saved
+    """
+    P_pyr, Q_pyr = {}, {}
+    query = QSqlQuery(db)
+    query.prepare("""SELECT level, p_min, p_max, q_min, q_max FROM pyramid
+                    WHERE p_no=:p_no AND date=:date AND hour=:hour ORDER BY level""")
+    query.bindValue(":p_no", p_no)
+    query.bindValue(":date", date)
+    query.bindValue(":hour", hour)
+    if not query.exec_():
+        logger.error(f"Error: {query.lastError().text()}")
+        return P_pyr, Q_pyr
+    while query.next():
+        level = query.value(0)
+        P_pyr[level] = (unpack_array(query.value(1)), unpack_array(query.value(2)))
+        Q_pyr[level] = (unpack_array(query.value(3)), unpack_array(query.value(4)))
+    return P_pyr, Q_pyr
+
+@trace.traced()
+def fetch_db_hour(db, p_no, date, hour, samples=True):
+    """Fetch all results of one hour
+
+    Args:
+        samples (bool): read the pressure and flow samples, P and Q are
+            None when False
+
+    Returns:
+        dObj (dict): results of the hour, None if not saved
+    """
+    query = QSqlQuery(db)
+    query.prepare(f"""SELECT {'p, q' if samples else 'NULL, NULL'}, Ers_raw, Rrs_raw, b_count, b_type, b_num_all, b_len, debug,
+                    PEEP_raw, PIP_raw, TV_raw, DP_raw, AM_raw FROM results
+                    WHERE p_no=:p_no AND date=:date AND hour=:hour""")
+    query.bindValue(":p_no", p_no)
+    query.bindValue(":date", date)
+    query.bindValue(":hour", hour)
+    if not query.exec_():
+        logger.error(f"Error: {query.lastError().text()}")
+        return None
+    if not query.next():
+        return None
+    with trace.span('decode'):
+        dObj = {
+            'p_no': p_no,
+            'date': date,
+            'hour': hour,
+            'P': unpack_array(query.value(0)) if samples else None,
+            'Q': unpack_array(query.value(1)) if samples else None,
+            'Ers': unpack_array(query.value(2)),
+            'Rrs': unpack_array(query.value(3)),
+            'b_count': query.value(4),
+            'b_type': unpack_b_type(query.value(5)),
+            'b_num_all': unpack_array(query.value(6)),
+            'b_len': unpack_array(query.value(7)),
+            'debug': json.loads(query.value(8)),
+            'PEEP': unpack_array(query.value(9)),
+            'PIP': unpack_array(query.value(10)),
+            'TV': unpack_array(query.value(11)),
+            'DP': unpack_array(query.value(12)),
+            'AImag': unpack_array(query.value(13))
+        }
+    logger.info("DB entry retrieved successful")
+    return dObj
+
+@trace.traced()
+def fetch_db_samples(db, p_no, date, hour):
+    """Fetch the pressure and flow samples of one hour
+
+    The samples are not scaled, see unpack_fixed().
+
+    Returns:
+        P, Q (ndarray): fixed-point samples, None if not saved
+        scale (int): divide P and Q by scale for the samples
+    """
+    query = QSqlQuery(db)
+    query.prepare("SELECT p, q FROM results WHERE p_no=:p_no AND date=:date AND hour=:hour")
+    query.bindValue(":p_no", p_no)
+    query.bindValue(":date", date)
+    query.bindValue(":hour", hour)
+    if not query.exec_():
+        logger.error(f"Error: {query.lastError().text()}")
+        return None
+    if not query.next():
+        return None
+    with trace.span('decode'):
+        P, scale = unpack_fixed(query.value(0))
+        Q, _ = unpack_fixed(query.value(1))
+        return P, Q, scale
+
+@trace.traced()
+def fetch_db_day(db, p_no, date, hours):
+    """Fetch results of many hours of a patient-day in one query
+
+    Per-breath arrays of a parameter are only read for rows saved without
+    its quantile sketch, the others are None.
+
+    Args:
+        db (QSqlDatabase): database connection
+        p_no (str): patient number
+        date (str): record date
+        hours (iterable): hours to look up
+
+    Returns:
+        results (list): results dictionary of each hour found in db
+        missing (set): hours not found in db
+    """
+    missing = set(hours)
+    results = []
+    logger.info(f'DB lookup params - p_no: {p_no}; date: {date}; hours: {len(missing)}')
+    query = QSqlQuery(db)
+    query.prepare("""SELECT hour,
+                    CASE WHEN Ers_sketch IS NULL THEN Ers_raw END,
+                    CASE WHEN Rrs_sketch IS NULL THEN Rrs_raw END,
+                    b_count, b_type, b_len,
+                    CASE WHEN PEEP_sketch IS NULL THEN PEEP_raw END,
+                    CASE WHEN PIP_sketch IS NULL THEN PIP_raw END,
+                    CASE WHEN TV_sketch IS NULL THEN TV_raw END,
+                    CASE WHEN DP_sketch IS NULL THEN DP_raw END,
+                    AM_raw,
+                    Ers_sketch, Rrs_sketch, PEEP_sketch, PIP_sketch, TV_sketch, DP_sketch FROM results
+                    WHERE p_no=:p_no AND date=:date""")
+    query.bindValue(":p_no", p_no)
+    query.bindValue(":date", date)
+    if not query.exec_():
+        logger.error(f"Error: {query.lastError().text()}")
+        return results, missing
+
+    while query.next():
+        hour = query.value(0)
+        if hour not in missing:
+            continue
+        missing.discard(hour)
+        with trace.span('decode'):
+            sketch = {param: unpack_sketch(query.value(11+i))
+                        for i, param in enumerate(['Ers','Rrs','PEEP','PIP','TV','DP'])}
+            raw = lambda param, column: unpack_array(query.value(column)) if sketch[param] is None else None
+            results.append({
+                'p_no': p_no,
+                'date': date,
+                'hour': hour,
+                'Ers': raw('Ers', 1),
+                'Rrs': raw('Rrs', 2),
+                'PEEP': raw('PEEP', 6),
+                'PIP': raw('PIP', 7),
+                'TV': raw('TV', 8),
+                'DP': raw('DP', 9),
+                'b_count': query.value(3),
+                'b_type': unpack_b_type(query.value(4)),
+                'b_len': unpack_array(query.value(5)),
+                'AImag': unpack_array(query.value(10)),
+                'sketch': sketch
+            })
+    logger.info(f'DB entries found - p_no: {p_no}; date: {date}; found: {len(results)}; missing: {len(missing)}')
+    return results, missing
+
+def fetch_db_saved_hours(db, p_no, date):
+    """Hours of a patient-day saved in the results table"""
+    query = QSqlQuery(db)
+    query.prepare("SELECT hour FROM results WHERE p_no=:p_no AND date=:date")
+    query.bindValue(":p_no", p_no)
+    query.bindValue(":date", date)
+    hours = set()
+    if not query.exec_():
+        logger.error(f"Error: {query.lastError().text()}")
+        return hours
+    while query.next():
+        hours.add(query.value(0))
+    return hours
+
+def fetch_db_hour_id(db, p_no, date, hour):
+    """Row id of an hour in the results table, None if not saved"""
+    query = QSqlQuery(db)
+    query.prepare("SELECT id FROM results WHERE p_no=:p_no AND date=:date AND hour=:hour")
+    query.bindValue(":p_no", p_no)
+    query.bindValue(":date", date)
+    query.bindValue(":hour", hour)
+    if not query.exec_():
+        logger.error(f"Error: {query.lastError().text()}")
+        return None
+    return query.value(0) if query.next() else None
+
+@trace.traced()
+def save_db_hour(db, P, Q, Ers, Rrs, b_count, b_type, PEEP, PIP, TV, DP, AImag, b_num_all, b_len, p_no, date, hour, debug,
+                 query=None, breaths_queries=None, pyramid_query=None):
+    """Save results of one hour and its breaths, replacing any existing rows
+    of that hour. A query already prepared with INSERT_HOUR_QUERY may be
+    passed for reuse, in which case the caller owns the transaction, along
+    with the prepared queries of save_db_breaths and save_db_pyramid."""
+    if query is None:
+        return save_db_hours(db, [{
+            'P': P, 'Q': Q, 'Ers': Ers, 'Rrs': Rrs, 'b_count': b_count, 'b_type': b_type,
+            'PEEP': PEEP, 'PIP': PIP, 'TV': TV, 'DP': DP, 'AImag': AImag,
+            'b_num_all': b_num_all, 'b_len': b_len, 'p_no': p_no, 'date': date, 'hour': hour, 'debug': debug
+        }])
+
+    # Save breaths and waveform pyramid
+    if not save_db_breaths(db, p_no, date, hour, b_num_all, b_len, b_type, Ers, Rrs, PEEP, PIP, TV, DP, AImag,
+                           queries=breaths_queries):
+        return False
+    if not save_db_pyramid(db, p_no, date, hour, P, Q, query=pyramid_query):
+        return False
+
+    # Calculate quartiles    
+    dObj = _calcQuartiles(Ers, Rrs, PEEP, PIP, TV, DP)
+
+    # Encoding arrays to packed binary, debug messages to json
+    p = pack_array(P, '<i2', decimals=1)
+    q = pack_array(Q, '<i2', decimals=1)
+    Ers_raw = pack_array(Ers)
+    Rrs_raw = pack_array(Rrs)
+    PEEP_raw = pack_array(PEEP)
+    PIP_raw = pack_array(PIP)
+    TV_raw = pack_array(TV)
+    DP_raw = pack_array(DP)
+    AM_raw = pack_array(AImag)
+    b_type_encoded = pack_b_type(b_type)
+    b_num_all = pack_array(b_num_all, '<i4')
+    b_len = pack_array(b_len, '<i4')
+    debug = json.dumps(debug)
+
+    Norm_cnt = b_type.count('Normal')
+    Asyn_cnt = b_type.count('Asyn')
+    # no index (NULL) when no breath was classified
+    AI_index = round(Asyn_cnt/(Asyn_cnt+Norm_cnt)*100,2) if Asyn_cnt+Norm_cnt else None
+
     query.bindValue(":p_no", p_no)
     query.bindValue(":date", date)
     query.bindValue(":hour", hour)
@@ -163,7 +654,12 @@ def save_db_hour(db, P, Q, Ers, Rrs, b_count, b_type, PEEP, PIP, TV, DP, AImag,
     query.bindValue(":AI_Norm_cnt", Norm_cnt)
     query.bindValue(":AI_Asyn_cnt", Asyn_cnt)
     query.bindValue(":AI_Index", AI_index)
+
+    for param, sketch in hour_sketches(Ers, Rrs, PEEP, PIP, TV, DP).items():
+        query.bindValue(f":{param}_sketch", pack_sketch(sketch))
     if query.exec_():
         logger.info("DB entry query successful")
+        return True
     else:
-        logger.error(f"Error: {query.lastError().text()}")
\ No newline at end of file
+        logger.error(f"Error: {query.lastError().text()}")
+        return False
\ No newline at end of file
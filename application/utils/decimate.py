@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""
+Decimate module.
+- Reduces waveforms to a screen resolution view for plotting
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import logging
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+
+
+def minmax_indices(y, start, stop, n_buckets):
+    """Indices of the min and max sample of each bucket of y[start:stop]
+
+    The range is cut into n_buckets buckets of equal length. Keeping the
+    extremes of every bucket preserves the envelope of the signal, so the
+    plot looks the same as the full resolution one at screen resolution.
+    Ranges shorter than 2*n_buckets are returned in full.
+
+    Args:
+        y (ndarray): signal
+        start (int): first sample of the range
+        stop (int): end of the range, excluded
+        n_buckets (int): number of buckets, about the plot width in pixels
+
+    Returns:
+        idx (ndarray): sorted sample indices, at most 2*n_buckets
+    """
+    start, stop = max(start, 0), min(stop, len(y))
+    n = stop - start
+    if n <= 2*n_buckets:
+        return np.arange(start, max(stop, start))
+
+    # pad to whole buckets with the last sample, which cannot change the extremes
+    size = -(-n // n_buckets)
+    seg = y[start:stop]
+    seg = np.concatenate((seg, np.full(size*n_buckets - n, seg[-1])))
+    rows = seg.reshape(n_buckets, size)
+    base = start + np.arange(n_buckets)*size
+    is_nan = np.isnan(rows)
+    lo = base + np.argmin(np.where(is_nan, np.inf, rows), axis=1)
+    hi = base + np.argmax(np.where(is_nan, -np.inf, rows), axis=1)
+
+    # keep one nan of each bucket holding some, so that gaps stay visible
+    has_nan = is_nan.any(axis=1)
+    gaps = base[has_nan] + np.argmax(is_nan[has_nan], axis=1)
+    idx = np.unique(np.concatenate((lo, hi, gaps)))
+    return idx[idx < stop]
+
+# Bucket sizes of the waveform pyramid, in samples at 50 Hz: 1 s, 10 s and 1 min
+PYRAMID_LEVELS = (50, 500, 3000)
+
+def minmax_pyramid(y, levels=PYRAMID_LEVELS):
+    """Min and max of y over buckets of several sizes
+
+    Each level is reduced from the one below it, so every level size must
+    be a multiple of the previous one. The last bucket of a level may be
+    partial.
+
+    Args:
+        y (ndarray): signal, without nan
+        levels (tuple): bucket sizes in samples, increasing
+
+    Returns:
+        pyramid (dict): {level: (mins, maxs)}
+    """
+    y = np.asarray(y, dtype=np.float64)
+    pyramid = {}
+    mins, maxs, size = y, y, 1
+    for level in levels:
+        step = level // size
+        starts = np.arange(0, len(mins), step)
+        if len(starts) == 0:
+            mins = maxs = np.zeros(0)
+        else:
+            mins, maxs = np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts)
+        pyramid[level], size = (mins, maxs), level
+    return pyramid
+
+def pyramid_view(mins, maxs, level, start, stop):
+    """Envelope of samples start:stop from one pyramid level
+
+    Args:
+        mins, maxs (ndarray): bucket min and max of the level
+        level (int): bucket size in samples
+        start, stop (int): sample range
+
+    Returns:
+        x (ndarray): sample position of each point, at bucket centres
+        y (ndarray): bucket min and max, interleaved
+    """
+    first = max(start // level, 0)
+    last = min(-(-stop // level), len(mins))
+    k = np.arange(first, max(last, first))
+    x = np.repeat(k*level + level/2, 2)
+    y = np.stack((mins[k], maxs[k]), axis=1).ravel()
+    return x, y
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""
+Preprocessing module.
+- Builds model inputs for many breaths at once
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import logging
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+
+
+def to_ragged(breaths):
+    """Concatenate breaths into one ragged array
+
+    Args:
+        breaths (list): list of per-breath lists or arrays
+
+    Returns:
+        values (ndarray): all breaths, concatenated
+        offsets (ndarray): start of each breath, followed by the total length
+    """
+    offsets = np.cumsum([0] + [len(b) for b in breaths])
+    if offsets[-1] == 0:
+        return np.empty(0), offsets
+    values = np.concatenate([np.asarray(b, dtype=np.float64) for b in breaths])
+    return values, offsets
+
+def head_ragged(values, offsets, lengths):
+    """Keep the first lengths[i] points of each breath of a ragged array
+
+    Returns:
+        values, offsets: the shortened ragged array
+    """
+    n = np.diff(offsets)
+    lengths = np.minimum(lengths, n)
+    pos = np.arange(offsets[-1]) - np.repeat(offsets[:-1], n)
+    keep = pos < np.repeat(lengths, n)
+    return values[keep], np.concatenate(([0], np.cumsum(lengths)))
+
+def norma_resample_batch(values, offsets, data_size):
+    """Normalise, resample and pad many breaths in one vectorized pass
+
+    Each breath is min-max normalised, linearly resampled on the grid
+    np.arange(0, n-1, n/data_size) and padded at the end with its last
+    resampled value, as done one breath at a time by utils.AI.norma_resample.
+
+    Args:
+        values (array): all breaths, concatenated
+        offsets (array): start of each breath, followed by the total length
+        data_size (int): number of samples per breath in the output
+
+    Returns:
+        immatrix (ndarray): (N, data_size) model input matrix
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n = np.diff(offsets)
+    starts = offsets[:-1]
+    if len(n) == 0:
+        return np.empty((0, data_size))
+
+    # normalise data
+    breath = np.repeat(np.arange(len(n)), n)
+    shifted = values - np.minimum.reduceat(values, starts)[breath]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalised = shifted/np.maximum.reduceat(shifted, starts)[breath]
+
+    # resampling grid, np.arange(0, n-1, step) fills i*step
+    step = n/data_size
+    grid_len = np.clip(np.ceil((n - 1)/step), 0, data_size).astype(np.int64)
+    x = np.arange(data_size)*step[:, None]
+    in_grid = np.arange(data_size) < grid_len[:, None]
+
+    # linear interpolation with np.interp arithmetic, as used by interp1d
+    lo = np.minimum(np.floor(x), np.maximum(n - 2, 0)[:, None]).astype(np.int64)
+    lo = np.where(in_grid, lo, 0)
+    y_lo = normalised[starts[:, None] + lo]
+    y_hi = normalised[starts[:, None] + np.minimum(lo + 1, n[:, None] - 1)]
+    with np.errstate(invalid='ignore'):
+        slope = (y_hi - y_lo)/1.0
+        immatrix = np.where(x == lo, y_lo, slope*(x - lo) + y_lo)
+
+    # pad with the last resampled value
+    last = immatrix[np.arange(len(n)), np.maximum(grid_len - 1, 0)]
+    return np.where(in_grid, immatrix, last[:, None])
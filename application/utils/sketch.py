@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""
+Sketch module.
+- Mergeable quantile sketches of respiratory parameters
+
+A sketch keeps the count of breaths at each value rounded to a fixed number
+of decimals (a sparse histogram). Sketches of many hours merge by adding
+counts, so day or week summaries never need the per-breath arrays.
+
+Error bound: the rank of every value is kept exactly, only values are
+rounded. A quantile is therefore within 0.5*10**-decimals of the exact
+np.nanquantile (linear interpolation) of the raw values. PEEP, PIP, DP and
+TV are already rounded to the sketch decimals when calculated, so their
+quantiles are exact.
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+import logging
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+
+# Decimals kept by the sketch of each parameter
+SKETCH_DECIMALS = {'Ers': 2, 'Rrs': 2, 'PEEP': 1, 'PIP': 1, 'TV': 0, 'DP': 1, 'AImag': 2}
+
+
+class QuantileSketch():
+    """Sparse histogram of values rounded to a fixed number of decimals"""
+
+    def __init__(self, decimals, bins=None, counts=None):
+        self.decimals = decimals
+        self.bins = np.zeros(0, dtype=np.int64) if bins is None else np.asarray(bins, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def from_values(cls, values, decimals):
+        """Build a sketch from values, nan values are left out"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        bins, counts = np.unique(np.round(values*10**decimals).astype(np.int64), return_counts=True)
+        return cls(decimals, bins, counts)
+
+    @classmethod
+    def merge_all(cls, sketches):
+        """Merge sketches with the same decimals into one"""
+        sketches = list(sketches)
+        decimals = sketches[0].decimals
+        if any(s.decimals != decimals for s in sketches):
+            raise ValueError('Cannot merge sketches of different decimals')
+        bins = np.concatenate([s.bins for s in sketches])
+        counts = np.concatenate([s.counts for s in sketches])
+        bins, idx = np.unique(bins, return_inverse=True)
+        return cls(decimals, bins, np.bincount(idx, weights=counts, minlength=len(bins)).astype(np.int64))
+
+    def merge(self, other):
+        return QuantileSketch.merge_all([self, other])
+
+    def count(self):
+        return int(self.counts.sum())
+
+    def values(self):
+        return self.bins/10**self.decimals
+
+    def min(self):
+        return self.values()[0] if len(self.bins) else np.nan
+
+    def max(self):
+        return self.values()[-1] if len(self.bins) else np.nan
+
+    def quantile(self, q):
+        """Quantiles with the linear interpolation of np.nanquantile
+
+        Args:
+            q (list): quantiles in [0, 1]
+
+        Returns:
+            ndarray: value of each quantile, nan when the sketch is empty
+        """
+        q = np.asarray(q, dtype=np.float64)
+        n = self.count()
+        if n == 0:
+            return np.full(q.shape, np.nan)
+        values = self.values()
+        cum = np.cumsum(self.counts)
+        h = (n - 1)*q
+        lo = np.floor(h).astype(np.int64)
+        hi = np.minimum(lo + 1, n - 1)
+        x_lo = values[np.searchsorted(cum, lo, side='right')]
+        x_hi = values[np.searchsorted(cum, hi, side='right')]
+        return x_lo + (h - lo)*(x_hi - x_lo)
+
+    def box_stats(self, whis=1.5, label=None):
+        """Box statistics for matplotlib's Axes.bxp, computed as
+        Axes.boxplot would from the raw values
+
+        Args:
+            whis (float): whisker reach, in interquartile ranges
+            label (str): box label
+
+        Returns:
+            dict: med, q1, q3, whislo, whishi, fliers and label
+        """
+        q1, med, q3 = self.quantile([.25, .50, .75])
+        stats = {'med': med, 'q1': q1, 'q3': q3, 'whislo': np.nan, 'whishi': np.nan, 'fliers': []}
+        if label is not None:
+            stats['label'] = label
+        if self.count() == 0:
+            return stats
+
+        # whiskers reach the furthest value within whis*IQR of the box
+        values = self.values()
+        iqr = q3 - q1
+        lo = values[values >= q1 - whis*iqr]
+        hi = values[values <= q3 + whis*iqr]
+        stats['whislo'] = q1 if len(lo) == 0 or lo[0] > q1 else lo[0]
+        stats['whishi'] = q3 if len(hi) == 0 or hi[-1] < q3 else hi[-1]
+        out = (values < stats['whislo']) | (values > stats['whishi'])
+        stats['fliers'] = np.repeat(values[out], self.counts[out])
+        return stats
+
+    def to_array(self):
+        """Flat int array [decimals, bin0, count0, bin1, count1, ...]"""
+        return np.concatenate(([self.decimals], np.stack((self.bins, self.counts), axis=1).ravel()))
+
+    @classmethod
+    def from_array(cls, arr):
+        arr = np.asarray(arr, dtype=np.int64)
+        return cls(int(arr[0]), arr[1::2], arr[2::2])
+
+
+def hour_sketches(Ers, Rrs, PEEP, PIP, TV, DP):
+    """Sketch of each respiratory parameter of an hour
+
+    Returns:
+        dict: {'Ers': QuantileSketch, ..., 'DP': QuantileSketch}
+    """
+    paramsVal = {'Ers': Ers, 'Rrs': Rrs, 'PEEP': PEEP, 'PIP': PIP, 'TV': TV, 'DP': DP}
+    return {p: QuantileSketch.from_values(v, SKETCH_DECIMALS[p]) for p, v in paramsVal.items()}
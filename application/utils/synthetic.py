@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""
+Synthetic module.
+- Generates ventilator hour files for scale and stress testing
+
+Breaths follow the single-compartment model P = E*V + R*Q + PEEP of a
+pressure controlled ventilation: airway pressure rises to PEEP + drive
+during inspiration and is held at PEEP during passive expiration. Files
+are written in the format read by Elastance.parseHourFile, sampled at
+50 Hz:
+
+    BS, S:<breath number>,
+    <flow L/min>, <pressure cmH2O>
+    ...
+    BE
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+from dataclasses import dataclass, replace
+from datetime import timedelta
+import logging
+import math
+import os
+
+#==============================================================================
+# Third-party imports
+#==============================================================================
+import numpy as np
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+
+# Sampling interval of the ventilator, s
+DT = 0.02
+
+
+@dataclass
+class WaveformConfig:
+    """Patient and ventilator settings of synthetic breaths
+
+    Rates and fractions are per breath probabilities.
+    """
+    E: float = 25.0                 # elastance, cmH2O/L
+    R: float = 10.0                 # resistance, cmH2O s/L
+    PEEP: float = 8.0               # cmH2O
+    drive: float = 12.0             # inspiratory pressure above PEEP, cmH2O
+    rate: float = 20.0              # breaths/min
+    ti_fraction: float = 0.33       # inspiratory share of the breath
+    rise_time: float = 0.1          # pressure rise time, s
+    variability: float = 0.05       # breath to breath relative spread of E, R, PEEP and period
+    asyn_fraction: float = 0.0      # breaths with a patient effort notch in inspiration
+    noise: float = 0.0              # Gaussian noise on pressure, cmH2O, flow gets 10x (L/min)
+    spike_rate: float = 0.0         # breaths holding a sample spike, removed by the line filters
+    truncated_fraction: float = 0.0 # breaths cut to fewer than 20 samples before BE
+    malformed_rate: float = 0.0     # breaths holding an unparsable line
+
+
+def breath(cfg, rng, V0=0.0, asyn=False):
+    """Flow and pressure of one breath
+
+    Args:
+        cfg (WaveformConfig): settings of the breath
+        rng (Generator): random numbers
+        V0 (float): lung volume above FRC at the start of the breath, L
+        asyn (bool): add a patient effort notch to inspiration
+
+    Returns:
+        flow (ndarray): L/min
+        pressure (ndarray): cmH2O
+        V_end (float): lung volume at the end of the breath, L
+    """
+    jitter = lambda: 1 + cfg.variability*rng.standard_normal()
+    E, R, PEEP = cfg.E*jitter(), cfg.R*jitter(), cfg.PEEP*jitter()
+    period = 60/cfg.rate*jitter()
+    n = max(int(round(period/DT)), 2)
+    n_insp = max(int(round(n*cfg.ti_fraction)), 1)
+    t = np.arange(n)*DT
+
+    # airway pressure above PEEP, and the driving pressure of the lung
+    Paw = np.zeros(n)
+    Paw[:n_insp] = cfg.drive*np.minimum(t[:n_insp]/max(cfg.rise_time, DT), 1)
+    Pmus = np.zeros(n)
+    if asyn:
+        # the effort pulls the airway pressure down and draws extra flow
+        centre = t[n_insp - 1]*rng.uniform(0.4, 0.7)
+        width = rng.uniform(0.08, 0.15)
+        notch = cfg.drive*rng.uniform(0.2, 0.5)*np.exp(-0.5*((t - centre)/width)**2)
+        notch[n_insp:] = 0
+        Paw -= notch
+        Pmus = 1.5*notch
+    drive = Paw + Pmus
+
+    # exact step of R*dV/dt + E*V = drive for a drive held over each sample
+    a = math.exp(-DT*E/R)
+    V = np.empty(n)
+    v = V0
+    for k in range(n):
+        V[k] = v
+        v = a*v + (1 - a)*drive[k]/E
+    flow = (drive - E*V)/R*60
+    pressure = Paw + PEEP
+
+    if cfg.noise:
+        pressure = pressure + rng.normal(0, cfg.noise, n)
+        flow = flow + rng.normal(0, 10*cfg.noise, n)
+    return flow, pressure, v
+
+def hour_text(cfg, rng, first_b_num=1, seconds=3600, V0=0.0):
+    """Text of an hour file
+
+    Args:
+        cfg (WaveformConfig): settings of the breaths
+        rng (Generator): random numbers
+        first_b_num (int): breath number of the first breath
+        seconds (float): length of the recording
+        V0 (float): lung volume at the start, L
+
+    Returns:
+        text (str): file content
+        n_breaths (int): number of breaths written
+        V_end (float): lung volume at the end, L
+    """
+    parts = []
+    elapsed, b_num = 0.0, first_b_num
+    while elapsed < seconds:
+        flow, pressure, V0 = breath(cfg, rng, V0, asyn=rng.random() < cfg.asyn_fraction)
+        elapsed += len(flow)*DT
+        if rng.random() < cfg.truncated_fraction:
+            keep = int(rng.integers(2, 20))
+            flow, pressure = flow[:keep], pressure[:keep]
+        if rng.random() < cfg.spike_rate:
+            k = int(rng.integers(2, len(flow))) if len(flow) > 2 else 0
+            if rng.random() < 0.5:
+                pressure[k] += rng.choice([-1, 1])*rng.uniform(60, 120)
+            else:
+                flow[k] += rng.choice([-1, 1])*rng.uniform(150, 1200)
+        lines = [f'{q:.2f}, {p:.2f}' for q, p in zip(flow.tolist(), pressure.tolist())]
+        if lines and rng.random() < cfg.malformed_rate:
+            lines[int(rng.integers(len(lines)))] = rng.choice(['', '#', 'nan', '12.3 45.6', '1.2, 3.4, 5.6'])
+        parts.append(f'BS, S:{b_num},')
+        parts.extend(lines)
+        parts.append('BE')
+        b_num += 1
+    return '\n'.join(parts) + '\n', b_num - first_b_num, V0
+
+def patient_config(cfg, rng, spread):
+    """Settings of one patient, E, R, PEEP and rate drawn around cfg
+
+    Args:
+        spread (float): relative spread between patients
+    """
+    draw = lambda value: float(value*math.exp(spread*rng.standard_normal()))
+    return replace(cfg, E=draw(cfg.E), R=draw(cfg.R), PEEP=round(draw(cfg.PEEP)), rate=draw(cfg.rate))
+
+def write_patient(root, patient, start_date, days, hours, cfg, seed=0, spread=0.2):
+    """Write the hour files of one patient
+
+    Files are written to root/P<id>/<date>/patient_P<id>_<date>_<hour>.txt.
+    Breath numbers and lung volume carry on from one hour to the next, and
+    the output only depends on seed and patient.
+
+    Args:
+        root (str): output directory
+        patient (int): patient id
+        start_date (date): date of the first day
+        days (int): number of days
+        hours (int): hours per day, from 00-00-00
+        cfg (WaveformConfig): settings around which the patient is drawn
+        seed (int): random seed
+        spread (float): relative spread of the patient settings
+
+    Returns:
+        paths (list): files written
+        n_breaths (int): breaths written
+    """
+    rng = np.random.default_rng([seed, patient])
+    cfg = patient_config(cfg, rng, spread)
+    p_no = f'P{patient:04d}'
+    paths, b_num, V = [], 1, 0.0
+    for d in range(days):
+        day = (start_date + timedelta(days=d)).isoformat()
+        day_dir = os.path.join(root, p_no, day)
+        os.makedirs(day_dir, exist_ok=True)
+        for h in range(hours):
+            text, n, V = hour_text(cfg, rng, b_num, V0=V)
+            b_num += n
+            path = os.path.join(day_dir, f'patient_{p_no}_{day}_{h:02d}-00-00.txt')
+            with open(path, 'w') as f:
+                f.write(text)
+            paths.append(path)
+    logger.info(f'{p_no}: {len(paths)} hours, {b_num - 1} breaths, E {cfg.E:.1f}, R {cfg.R:.1f}, PEEP {cfg.PEEP}')
+    return paths, b_num - 1
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2021 CARE Trial
+#    Email: CARE Trial <care.trial.2019@gmail.com>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""
+Trace module.
+- Nested timing spans and counters of the analysis pipeline
+- Chrome trace (Perfetto) export and summary table of each run
+
+Tracing is off unless the CARE_ONE_TRACE environment variable is set
+(1, or the directory for trace files) or the 'trace' setting is on.
+When off, span() returns a shared do-nothing context manager:
+
+    with trace.span('parse', file=path):
+        ...
+    trace.count('breaths', n)
+
+    with trace.run('patient_overview'):   # writes the trace and summary
+        ...
+
+Each run collects the spans of its own thread, see Tracer.collect().
+Spans outside a run are not recorded.
+
+Open the written JSON in https://ui.perfetto.dev or chrome://tracing.
+"""
+
+# =============================================================================
+# Standard library imports
+# =============================================================================
+from contextlib import contextmanager
+import functools
+import threading
+import logging
+import json
+import time
+import os
+
+#==============================================================================
+# Setup Logging
+#==============================================================================
+# Get the logger specified in the file
+logger = logging.getLogger(__name__)
+
+TRACE_ENV = 'CARE_ONE_TRACE'
+DEFAULT_DIR = 'traces'
+
+
+class _NullSpan():
+    """Span used while tracing is off"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span():
+    """Timed span, recorded in the collector of its run when it exits"""
+    __slots__ = ('tracer', 'collector', 'name', 'args', 'start', 'child')
+
+    def __init__(self, tracer, collector, name, args):
+        self.tracer = tracer
+        self.collector = collector
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.child = 0.0
+        self.tracer._stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        stack = self.tracer._stack()
+        stack.pop()
+        dur = end - self.start
+        if stack:
+            stack[-1].child += dur
+        # children merged from parallel workers may outlast their parent
+        self.collector.record(self.name, self.start, dur, max(dur - self.child, 0.0), self.args, root=not stack)
+        return False
+
+    def set(self, **args):
+        """Add arguments shown with the span, e.g. sizes known at the end"""
+        self.args.update(args)
+
+
+class Collector():
+    """Spans and counters of one run, see Tracer.collect()"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.events = []
+        self.stats = {}         # name: [calls, total s, self s, max s]
+        self.counters = {}
+        self.threads = {}       # (pid, tid): thread name
+        self.root = 0.0         # total s of spans without parent
+
+    def _ids(self):
+        thread = threading.current_thread()
+        ids = (os.getpid(), thread.ident)
+        if ids not in self.threads:
+            self.threads[ids] = thread.name
+        return ids
+
+    def record(self, name, start, dur, self_time, args, root=False):
+        with self._lock:
+            if root:
+                self.root += dur
+            pid, tid = self._ids()
+            event = {'name': name, 'ph': 'X', 'ts': start*1e6, 'dur': dur*1e6, 'pid': pid, 'tid': tid}
+            if args:
+                event['args'] = args
+            self.events.append(event)
+            stats = self.stats.get(name)
+            if stats is None:
+                self.stats[name] = [1, dur, self_time, dur]
+            else:
+                stats[0] += 1
+                stats[1] += dur
+                stats[2] += self_time
+                stats[3] = max(stats[3], dur)
+
+    def count(self, name, n):
+        ts = time.perf_counter()
+        with self._lock:
+            pid, tid = self._ids()
+            value = self.counters.get(name, 0) + n
+            self.counters[name] = value
+            self.events.append({'name': name, 'ph': 'C', 'ts': ts*1e6, 'pid': pid, 'tid': tid, 'args': {name: value}})
+
+    def merge(self, data, root=True):
+        """Add the data of another collector, e.g. of a worker
+
+        Args:
+            data (dict): see data()
+            root (bool): its spans have no parent here, else their time is
+                taken off the self time of the parent by the caller
+        """
+        with self._lock:
+            if root:
+                self.root += data['root']
+            self.events.extend(data['events'])
+            for name, (calls, total, self_time, longest) in data['stats'].items():
+                stats = self.stats.setdefault(name, [0, 0.0, 0.0, 0.0])
+                stats[0] += calls
+                stats[1] += total
+                stats[2] += self_time
+                stats[3] = max(stats[3], longest)
+            for name, value in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.threads.update(data['threads'])
+
+    def data(self):
+        """Everything collected so far
+
+        Returns:
+            data (dict): events, stats, counters, threads and root, the
+                total time of spans without parent
+        """
+        with self._lock:
+            return {'events': list(self.events), 'stats': {k: list(v) for k, v in self.stats.items()},
+                    'counters': dict(self.counters), 'threads': dict(self.threads), 'root': self.root}
+
+
+class Tracer():
+    """Starts a Collector for each run and records the spans and counters
+    of the thread of the run in it. Spans outside a run, e.g. of a model
+    warm-up, are not recorded, and concurrent runs on other threads keep
+    their own spans.
+
+    Spans of worker processes are brought back with call() and merge().
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.out_dir = DEFAULT_DIR
+        self._local = threading.local()
+
+    def configure(self, enabled, out_dir=None):
+        """Switch tracing on or off
+
+        Args:
+            enabled (bool): record spans and counters
+            out_dir (str): directory of trace files, unchanged when None
+        """
+        self.enabled = bool(enabled)
+        if out_dir:
+            self.out_dir = out_dir
+
+    def configure_from_env(self):
+        """Switch tracing on when CARE_ONE_TRACE is set. 1, true, yes and on
+        write to the default directory, other values name the directory."""
+        value = os.environ.get(TRACE_ENV, '').strip()
+        if value.lower() in ('', '0', 'false', 'no', 'off'):
+            return
+        self.configure(True, None if value.lower() in ('1', 'true', 'yes', 'on') else value)
+
+    def collector(self):
+        """Collector of the run of the calling thread, None outside a run"""
+        return getattr(self._local, 'collector', None)
+
+    def span(self, name, **args):
+        """Context manager timing the code inside it as span name"""
+        collector = self.collector() if self.enabled else None
+        if collector is None:
+            return _NULL_SPAN
+        return _Span(self, collector, name, args)
+
+    def count(self, name, n=1):
+        """Add n to the counter name, e.g. hours or breaths processed"""
+        collector = self.collector() if self.enabled else None
+        if collector is not None:
+            collector.count(name, n)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def collect(self):
+        """Record the spans and counters of the calling thread in a new
+        Collector until exit, then restore the previous one
+
+        Yields:
+            collector (Collector)
+        """
+        previous, stack = self.collector(), self._stack()
+        collector = self._local.collector = Collector()
+        # spans open outside are not parents of the spans of the collector
+        self._local.stack = []
+        try:
+            yield collector
+        finally:
+            self._local.collector, self._local.stack = previous, stack
+
+    def merge(self, data):
+        """Add data collected elsewhere, e.g. by a worker, to the run of the
+        calling thread. Its spans become children of the span open here,
+        whose self time leaves out their time."""
+        collector = self.collector()
+        if collector is None:
+            return
+        stack = self._stack()
+        if stack:
+            stack[-1].child += data['root']
+        collector.merge(data, root=not stack)
+
+    def summary(self, data, wall=None):
+        """Summary table of collected data, spans by total time
+
+        Args:
+            data (dict): see Collector.data()
+            wall (float): wall time of the run, s, for the rates of counters
+
+        Returns:
+            text (str)
+        """
+        lines = [f"{'Span':<24}{'Calls':>7}{'Total s':>10}{'Self s':>10}{'Mean ms':>10}{'Max ms':>10}"]
+        for name, (calls, total, self_time, longest) in sorted(data['stats'].items(), key=lambda s: -s[1][1]):
+            lines.append(f'{name:<24}{calls:>7}{total:>10.3f}{self_time:>10.3f}{total/calls*1000:>10.1f}{longest*1000:>10.1f}')
+        for name, value in sorted(data['counters'].items()):
+            rate = f' ({value/wall:.0f}/s)' if wall else ''
+            lines.append(f'{name}: {value}{rate}')
+        return '\n'.join(lines)
+
+    def write(self, data, path):
+        """Write collected data as a Chrome trace JSON file"""
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                  for (pid, tid), name in data['threads'].items()]
+        events.extend(data['events'])
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'counters': data['counters']}}, f)
+
+    def report(self, name, data, wall=None):
+        """Write the trace of a run and log its summary
+
+        Args:
+            name (str): name of the run, used in the file name
+            data (dict): see Collector.data()
+            wall (float): wall time of the run, s
+
+        Returns:
+            path (str): trace file written, None when nothing was traced
+        """
+        if not data['events']:
+            return None
+        path = os.path.join(self.out_dir, f"trace_{name}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{threading.get_ident()}.json")
+        try:
+            self.write(data, path)
+        except OSError as e:
+            logger.error(f'Cannot write trace {path}: {e}')
+            path = None
+        logger.info(f'Trace of {name}' + (f' written to {path}' if path else '') + '\n' + self.summary(data, wall))
+        return path
+
+    @contextmanager
+    def run(self, name):
+        """Trace the code inside as one run: a root span in a new
+        collector, then report()"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        with self.collect() as collector:
+            try:
+                with self.span(name):
+                    yield
+            finally:
+                self.report(name, collector.data(), time.perf_counter() - start)
+
+tracer = Tracer()
+tracer.configure_from_env()
+
+span = tracer.span
+count = tracer.count
+run = tracer.run
+configure = tracer.configure
+
+
+def enabled():
+    return tracer.enabled
+
+def traced(name=None):
+    """Decorator timing each call of a function as a span, named after the
+    function by default"""
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            collector = tracer.collector() if tracer.enabled else None
+            if collector is None:
+                return func(*args, **kwargs)
+            with _Span(tracer, collector, span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def call(trace_on, func, *args):
+    """Run func(*args) in a worker process, traced when trace_on
+
+    Returns:
+        result: of func
+        data (dict): spans and counters of the call, for merge(), None
+            when not traced
+    """
+    tracer.configure(trace_on)
+    if not trace_on:
+        return func(*args), None
+    with tracer.collect() as collector:
+        result = func(*args)
+    return result, collector.data()
+
+def merge(returned):
+    """Merge the spans of a call() in the run of the calling thread
+
+    Args:
+        returned (tuple): (result, data) returned by call()
+
+    Returns:
+        result: of the call
+    """
+    result, data = returned
+    if data and data['events']:
+        tracer.merge(data)
+    return result